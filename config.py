@@ -1,16 +1,23 @@
 import os
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, date
 from telegram.ext import ContextTypes
 from dotenv import load_dotenv
 from database import (
     get_user, save_user, get_all_users,
     get_student_balance as db_get_student_balance, save_student_balance,
     get_confirmed_lessons, save_confirmed_lesson, delete_confirmed_lesson_by_slot,
-    get_schedule_request, save_schedule_request, delete_schedule_request,
+    get_schedule_request, save_schedule_request,
     get_all_schedule_requests, delete_all_schedule_requests,
     get_user_count_by_role, get_total_confirmed_lessons,
-    update_lesson_reminder_sent, get_lessons_needing_reminder
+    update_lesson_reminder_sent, get_lessons_needing_reminder, get_lessons_between,
+    update_student_balance, charge_student_lesson, get_lesson_day_counts
 )
+from utils.events import event_bus, LessonConfirmed, LessonCancelled, BalanceChanged, ProfileUpdated, \
+    UserRemoved, RequestUpdated
+from utils.schedule_grid import ScheduleGrid, WEEKDAY_NAMES
+from bisect import bisect_left, insort
+import calendar
+from collections import namedtuple
 import json
 
 load_dotenv()
@@ -18,9 +25,64 @@ load_dotenv()
 # Токен бота
 BOT_TOKEN = os.getenv('BOT_TOKEN')
 
+# ========== РЕЖИМ ПОЛУЧЕНИЯ ОБНОВЛЕНИЙ ==========
+
+# Если задан WEBHOOK_URL (публичный адрес за reverse proxy), бот работает через вебхук,
+# иначе - через long polling
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '127.0.0.1')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8080'))
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+# 0 - не регистрировать вебхук в Telegram (локальная проверка через replay_updates.py)
+WEBHOOK_REGISTER = os.getenv('WEBHOOK_REGISTER', '1') == '1'
+# Файл для записи входящих обновлений (пусто - не записывать)
+WEBHOOK_RECORD_FILE = os.getenv('WEBHOOK_RECORD_FILE', '')
+
+# Сколько обновлений обрабатывается одновременно (обновления одного чата - всегда по очереди)
+MAX_CONCURRENT_UPDATES = int(os.getenv('MAX_CONCURRENT_UPDATES', '64'))
+
+# Как часто (в секундах) состояние диалогов и user_data записывается в БД
+PERSISTENCE_INTERVAL = int(os.getenv('PERSISTENCE_INTERVAL', '30'))
+
+# Через сколько секунд бездействия диалог (ConversationHandler) завершается сам
+CONVERSATION_TIMEOUT = int(os.getenv('CONVERSATION_TIMEOUT', '900'))
+
+# Через сколько секунд бездействия временные данные пользователя удаляются из user_data
+USER_STATE_TTL = int(os.getenv('USER_STATE_TTL', '3600'))
+USER_STATE_SWEEP_INTERVAL = int(os.getenv('USER_STATE_SWEEP_INTERVAL', '600'))
+
+# Сколько секунд повторное нажатие той же кнопки в том же сообщении игнорируется
+CALLBACK_DEDUP_TTL = int(os.getenv('CALLBACK_DEDUP_TTL', '30'))
+
+# Сколько секунд первый в листе ожидания может думать над освободившимся слотом,
+# прежде чем предложение уйдет следующему
+WAITLIST_OFFER_TIMEOUT = int(os.getenv('WAITLIST_OFFER_TIMEOUT', '3600'))
+
 # ID администратора/преподавателя
 TEACHER_IDS = [1230120534]
 
+# ========== НАСТРОЙКИ СЕТКИ РАСПИСАНИЯ ==========
+
+# Рабочие дни (0 = Пн ... 6 = Вс), начало и конец рабочего дня,
+# длительность урока и перерыв между уроками в минутах
+WORK_DAYS = [int(day) for day in os.getenv('WORK_DAYS', '2,3,4,5,6').split(',')]
+WORK_DAY_START = os.getenv('WORK_DAY_START', '13:00')
+WORK_DAY_END = os.getenv('WORK_DAY_END', '23:00')
+LESSON_DURATION_MINUTES = int(os.getenv('LESSON_DURATION_MINUTES', '60'))
+LESSON_BREAK_MINUTES = int(os.getenv('LESSON_BREAK_MINUTES', '0'))
+
+SCHEDULE_GRID = ScheduleGrid(
+    work_days=WORK_DAYS,
+    day_start=WORK_DAY_START,
+    day_end=WORK_DAY_END,
+    lesson_minutes=LESSON_DURATION_MINUTES,
+    break_minutes=LESSON_BREAK_MINUTES
+)
+
+# Горизонт бронирования: на сколько недель вперед студенты могут выбирать время
+BOOKING_HORIZON_WEEKS = int(os.getenv('BOOKING_HORIZON_WEEKS', '4'))
+
 
 # ========== ОСНОВНЫЕ ФУНКЦИИ ==========
 
@@ -102,6 +164,20 @@ def get_user_profiles_dict():
 user_profiles = get_user_profiles_dict()
 
 
+def update_user_profiles(event):
+    """Подписчик шины событий: поддерживает user_profiles в актуальном состоянии"""
+    if isinstance(event, ProfileUpdated):
+        user_profiles[event.user_id] = {**user_profiles.get(event.user_id, {}), **event.profile}
+    elif event.archived:
+        if event.user_id in user_profiles:
+            user_profiles[event.user_id]['role'] = 'archived'
+    else:
+        user_profiles.pop(event.user_id, None)
+
+
+event_bus.subscribe(update_user_profiles, ProfileUpdated, UserRemoved)
+
+
 # ========== ФУНКЦИИ ДЛЯ РАБОТЫ С БАЛАНСОМ ==========
 
 def init_student_balance(user_id):
@@ -114,63 +190,82 @@ def get_student_balance(user_id):
     return db_get_student_balance(user_id)
 
 
-def get_balance_display(user_id):
-    """Возвращает отображаемый баланс с правильным знаком"""
-    balance_data = get_student_balance(user_id)
-    bal = balance_data['balance']
+def format_balance(bal):
+    """Денежный баланс с правильным знаком"""
     if bal >= 0:
         return f"+{bal} руб."  # Депозит
     else:
         return f"{bal} руб."  # Долг (уже с минусом)
 
 
+def get_balance_display(user_id):
+    """Возвращает отображаемый баланс с правильным знаком"""
+    balance_data = get_student_balance(user_id)
+    return format_balance(balance_data['balance'])
+
+
+# Неизменяемый снимок баланса студента после операции: из него строятся ответ
+# преподавателю и уведомление студенту без повторного чтения БД.
+# from_prepaid - только для списания урока: урок списан из предоплаты (иначе в долг).
+BalanceSnapshot = namedtuple('BalanceSnapshot', [
+    'user_id', 'fio', 'instruments', 'lessons_left', 'balance', 'lesson_price',
+    'notes', 'total_lessons', 'display', 'from_prepaid'
+], defaults=(None,))
+
+
+def balance_snapshot(user_id, balance=None, from_prepaid=None):
+    """Снимок баланса: balance - запись после изменения, иначе данные представления студента"""
+    view = get_student_view(user_id)
+    balance = balance or view
+    return BalanceSnapshot(
+        user_id=user_id,
+        fio=view['fio'],
+        instruments=tuple(view['instruments']),
+        lessons_left=balance['lessons_left'],
+        balance=balance['balance'],
+        lesson_price=balance['lesson_price'] or 2000,
+        notes=balance['notes'] or '',
+        total_lessons=view['lessons_total'],
+        display=format_balance(balance['balance']),
+        from_prepaid=from_prepaid
+    )
+
+
+def get_balance_snapshot(user_id):
+    """Текущий снимок баланса или None, если профиля студента нет"""
+    if not get_student_view(user_id)['has_profile']:
+        return None
+    return balance_snapshot(user_id)
+
+
 def add_lessons_to_student(user_id, lessons_count):
     """Добавляет уроки в баланс студента"""
-    balance = get_student_balance(user_id)
-    balance['lessons_left'] += lessons_count
-    balance['total_paid_lessons'] = balance.get('total_paid_lessons', 0) + lessons_count
-    save_student_balance(balance)
-    return balance
+    balance = update_student_balance(
+        user_id, 'lessons_left = lessons_left + ?, total_paid_lessons = total_paid_lessons + ?',
+        (lessons_count, lessons_count)
+    )
+    return balance_snapshot(user_id, balance)
 
 
-def use_lesson(user_id):
+def use_lesson(user_id, started_before=None):
     """Использует один урок (если есть предоплаченные) ИЛИ добавляет долг"""
-    balance = get_student_balance(user_id)
-    lesson_price = balance.get('lesson_price', 2000)
-
-    if balance['lessons_left'] > 0:
-        # Есть предоплаченные уроки - списываем один
-        balance['lessons_left'] -= 1
-    else:
-        # Нет уроков - добавляем долг (уменьшаем баланс)
-        balance['balance'] -= lesson_price
-
-    save_student_balance(balance)
-    return True
+    balance, from_prepaid = charge_student_lesson(user_id, started_before)
+    return balance_snapshot(user_id, balance, from_prepaid)
 
 
 def add_deposit(user_id, amount):
     """Добавляет депозит (увеличивает баланс)"""
-    balance = get_student_balance(user_id)
-    balance['balance'] += amount
-    save_student_balance(balance)
-    return balance
+    return balance_snapshot(user_id, update_student_balance(user_id, 'balance = balance + ?', (amount,)))
 
 
 def set_student_notes(user_id, notes):
     """Устанавливает примечания для студента"""
-    balance = get_student_balance(user_id)
-    balance['notes'] = notes
-    save_student_balance(balance)
-    return balance
+    return balance_snapshot(user_id, update_student_balance(user_id, 'notes = ?', (notes,)))
 
 
 def set_student_price(user_id, price):
     """Устанавливает цену урока для студента"""
-    balance = get_student_balance(user_id)
-    balance['lesson_price'] = price
-    save_student_balance(balance)
-    return balance
+    return balance_snapshot(user_id, update_student_balance(user_id, 'lesson_price = ?', (price,)))
 
 
 # ========== ФУНКЦИИ ДЛЯ РАБОТЫ С ЗАНЯТИЯМИ ==========
@@ -194,22 +289,31 @@ def get_confirmed_lessons_dict(user_id=None):
 confirmed_lessons = get_confirmed_lessons_dict()
 
 
+def update_confirmed_lessons(event):
+    """Подписчик шины событий: поддерживает confirmed_lessons в актуальном состоянии"""
+    if isinstance(event, LessonConfirmed):
+        confirmed_lessons.setdefault(event.user_id, []).append(event.lesson)
+    elif isinstance(event, LessonCancelled):
+        removed = set(event.lesson_ids)
+        if event.user_id in confirmed_lessons:
+            confirmed_lessons[event.user_id] = [
+                lesson for lesson in confirmed_lessons[event.user_id] if lesson.get('id') not in removed
+            ]
+    elif not event.archived:
+        confirmed_lessons.pop(event.user_id, None)
+
+
+event_bus.subscribe(update_confirmed_lessons, LessonConfirmed, LessonCancelled, UserRemoved)
+
+
 def add_confirmed_lesson(lesson_data):
     """Добавляет подтвержденное занятие"""
     save_confirmed_lesson(lesson_data)
-    # Обновляем кэш для совместимости
-    user_id = lesson_data['user_id']
-    if user_id not in confirmed_lessons:
-        confirmed_lessons[user_id] = []
-    confirmed_lessons[user_id].append(lesson_data)
 
 
 def remove_confirmed_lesson(user_id, slot_id):
     """Удаляет подтвержденное занятие"""
     delete_confirmed_lesson_by_slot(user_id, slot_id)
-    # Обновляем кэш
-    if user_id in confirmed_lessons:
-        confirmed_lessons[user_id] = [l for l in confirmed_lessons[user_id] if l['slot_id'] != slot_id]
 
 
 # ========== ФУНКЦИИ ДЛЯ РАБОТЫ С ЗАЯВКАМИ НА РАСПИСАНИЕ ==========
@@ -224,87 +328,315 @@ def get_schedule_requests_dict():
 schedule_requests = get_schedule_requests_dict()
 
 
+def update_schedule_requests(event):
+    """Подписчик шины событий: поддерживает schedule_requests в актуальном состоянии"""
+    if event.request is None:
+        schedule_requests.pop(event.user_id, None)
+    else:
+        schedule_requests[event.user_id] = event.request
+
+
+event_bus.subscribe(update_schedule_requests, RequestUpdated)
+
+
 def save_schedule_request_dict(user_id, request_data):
     """Сохраняет заявку на расписание (для совместимости)"""
     request_data['user_id'] = user_id
     save_schedule_request(request_data)
-    schedule_requests[user_id] = request_data
 
 
 def remove_slot_from_all_requests(slot_id: str):
     """Удаляет слот из всех запросов всех студентов"""
-    for user_id, request in list(schedule_requests.items()):
+    # Читаем заявки из БД: сохранение устаревшей заявки затрет новые слоты
+    for request in get_all_schedule_requests():
         if slot_id in request.get('selected_slots', []):
             request['selected_slots'].remove(slot_id)
             save_schedule_request(request)
 
 
 def cleanup_old_requests():
-    """Очищает старые заявки на прошедшие недели"""
-    from database import cleanup_old_requests_weeks_ago
-    return cleanup_old_requests_weeks_ago(1)
+    """Удаляет из заявок и листа ожидания прошедшие слоты (будущие недели сохраняются)"""
+    from database import prune_past_request_slots, prune_past_waitlist
+    removed = prune_past_request_slots(datetime.now().date())
+    prune_past_waitlist(datetime.now().date())
+    return removed
 
 
 def clear_all_requests():
     """Очищает все заявки студентов"""
     delete_all_schedule_requests()
-    schedule_requests.clear()
     return len(schedule_requests)
 
 
 # ========== ФУНКЦИИ РАСПИСАНИЯ ==========
 
-def get_next_week_dates():
-    """Возвращает даты на следующую неделю (среда - воскресенье)"""
-    today = datetime.now()
-
-    # Находим следующую среду
-    days_until_wednesday = (2 - today.weekday() + 7) % 7
-    if days_until_wednesday == 0:  # Если сегодня среда
-        days_until_wednesday = 7
+def get_week_start(week_offset=0):
+    """Первый рабочий день недели горизонта бронирования (0 - ближайшая неделя)"""
+    return SCHEDULE_GRID.next_week_start() + timedelta(weeks=week_offset)
 
-    next_wednesday = today + timedelta(days=days_until_wednesday)
 
-    # Генерируем даты со среды по воскресенье (5 дней)
+def get_week_dates(week_offset=0):
+    """Возвращает рабочие дни недели горизонта бронирования по сетке расписания"""
     week_dates = {}
-    days = ['Ср', 'Чт', 'Пт', 'Сб', 'Вс']
-
-    for i in range(5):  # Ср-Вс
-        current_date = next_wednesday + timedelta(days=i)
+    for i, day in enumerate(SCHEDULE_GRID.week_days(get_week_start(week_offset))):
         week_dates[i] = {
-            'date': current_date.strftime('%d.%m.%Y'),
-            'day_name': days[i]
+            'date': day.strftime('%d.%m.%Y'),
+            'day_name': WEEKDAY_NAMES[day.weekday()],
+            'day': day
         }
 
     return week_dates
 
 
-def get_day_slots(day_index):
-    """Возвращает слоты для конкретного дня (13:00-22:00 для всех дней)"""
-    week_dates = get_next_week_dates()
+def get_next_week_dates():
+    """Возвращает рабочие дни следующей недели по сетке расписания"""
+    return get_week_dates(0)
+
+
+def get_day_slots(day_index, week_offset=0):
+    """Возвращает слоты для конкретного дня по сетке расписания"""
+    week_dates = get_week_dates(week_offset)
     day_info = week_dates.get(day_index, {})
 
     time_slots = {}
-    for hour in range(13, 23):  # 13:00 до 22:00 включительно
-        slot_id = f'day{day_index}_{hour:02d}00'
-        time_slots[slot_id] = f"{hour:02d}:00"
+    if day_info:
+        for time in SCHEDULE_GRID.times:
+            time_slots[SCHEDULE_GRID.slot_id(day_info['day'], time)] = time
 
     return time_slots, day_info
 
 
 def get_available_slots_for_user(user_id):
-    """Возвращает все слоты на неделю для пользователя"""
+    """Возвращает все слоты горизонта бронирования для пользователя"""
     all_slots = {}
-    week_dates = get_next_week_dates()
 
-    for day_index in range(5):  # Пн-Пт
-        day_slots, day_info = get_day_slots(day_index)
-        for slot_id, time in day_slots.items():
-            all_slots[slot_id] = f"{day_info['day_name']} {day_info['date']} {time}"
+    for week_offset in range(BOOKING_HORIZON_WEEKS):
+        for day_index in get_week_dates(week_offset):
+            day_slots, day_info = get_day_slots(day_index, week_offset)
+            for slot_id, time in day_slots.items():
+                all_slots[slot_id] = f"{day_info['day_name']} {day_info['date']} {time}"
 
     return all_slots
 
 
+def get_slot_label(slot_id):
+    """Возвращает название слота по его ID ('Ср 21.10.2026 14:00')"""
+    return SCHEDULE_GRID.slot_label(slot_id)
+
+
+def get_week_offset(slot_day):
+    """Номер недели горизонта, в которую попадает дата (или None)"""
+    days = (slot_day - get_week_start(0)).days
+    if days < 0 or days >= BOOKING_HORIZON_WEEKS * 7:
+        return None
+    return days // 7
+
+
+def get_occupancy_between(start_day, end_day):
+    """Карта занятости {дата: битовая маска} для дат [start_day, end_day) - один индексный запрос"""
+    lessons = get_lessons_between(start_day.strftime('%Y-%m-%d'), end_day.strftime('%Y-%m-%d'))
+    return SCHEDULE_GRID.build_occupancy(lessons)
+
+
+def get_week_occupancy(week_offset=0):
+    """Карта занятости недели горизонта бронирования"""
+    week_start = get_week_start(week_offset)
+    return get_occupancy_between(week_start, week_start + timedelta(days=7))
+
+
+# Кэш числа занятий по дням для календаря: (год, месяц) -> {дата: занятий}.
+# Сбрасывается при любом добавлении или удалении занятий.
+month_lesson_counts = {}
+
+
+def get_month_lesson_counts(months):
+    """{(год, месяц): {дата: занятий}} для списка месяцев; отсутствующие в кэше - одним запросом"""
+    missing = [month for month in months if month not in month_lesson_counts]
+    if missing:
+        first_year, first_month = min(missing)
+        last_year, last_month = max(missing)
+        counts = get_lesson_day_counts(
+            date(first_year, first_month, 1).isoformat(),
+            date(last_year, last_month, calendar.monthrange(last_year, last_month)[1]).isoformat()
+        )
+
+        # Загружены все месяцы диапазона, в том числе без занятий
+        year, month = first_year, first_month
+        while (year, month) <= (last_year, last_month):
+            month_lesson_counts[(year, month)] = {}
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+        for day_str, lessons in counts.items():
+            day = date.fromisoformat(day_str)
+            month_lesson_counts[(day.year, day.month)][day] = lessons
+
+    return {month: month_lesson_counts[month] for month in months}
+
+
+def invalidate_lesson_counts(event):
+    """Подписчик шины событий: занятия изменились - сбрасываем календарный кэш"""
+    month_lesson_counts.clear()
+
+
+event_bus.subscribe(invalidate_lesson_counts, LessonConfirmed, LessonCancelled)
+
+
+def is_slot_free(slot_id, occupancy=None):
+    """Проверяет, свободен ли слот"""
+    parsed = SCHEDULE_GRID.parse_slot_id(slot_id)
+    if not parsed:
+        return False
+
+    if occupancy is None:
+        slot_day = parsed[0]
+        occupancy = get_occupancy_between(slot_day, slot_day + timedelta(days=1))
+    return SCHEDULE_GRID.is_free(occupancy, slot_id)
+
+
+def book_waitlist_slot(user_id, slot_id):
+    """Запись из листа ожидания: проверка занятости и сохранение одной транзакцией"""
+    from database import book_waitlisted_slot
+    return book_waitlisted_slot(
+        {
+            'user_id': user_id,
+            'slot_id': slot_id,
+            'slot_name': get_slot_label(slot_id),
+            'confirmed_by': user_id,
+            'date_added': datetime.now().strftime('%d.%m.%Y %H:%M'),
+        },
+        lambda lessons: SCHEDULE_GRID.is_free(SCHEDULE_GRID.build_occupancy(lessons), slot_id)
+    )
+
+
+def is_slot_bookable(slot_id):
+    """Слот лежит в сетке расписания и внутри горизонта бронирования"""
+    parsed = SCHEDULE_GRID.parse_slot_id(slot_id)
+    if not parsed:
+        return False
+
+    slot_day, time_str = parsed
+    return (SCHEDULE_GRID.is_work_day(slot_day)
+            and SCHEDULE_GRID.slot_index(time_str) is not None
+            and get_week_offset(slot_day) is not None)
+
+
+def get_free_horizon_slots():
+    """Все свободные слоты горизонта бронирования (один запрос занятости)"""
+    horizon_start = get_week_start(0)
+    occupancy = get_occupancy_between(horizon_start, horizon_start + timedelta(weeks=BOOKING_HORIZON_WEEKS))
+
+    free_slots = set()
+    for week_offset in range(BOOKING_HORIZON_WEEKS):
+        for day in SCHEDULE_GRID.week_days(get_week_start(week_offset)):
+            for time_str in SCHEDULE_GRID.times:
+                slot_id = SCHEDULE_GRID.slot_id(day, time_str)
+                if SCHEDULE_GRID.is_free(occupancy, slot_id):
+                    free_slots.add(slot_id)
+    return free_slots
+
+
+def build_slot_assignment():
+    """
+    Предлагает распределение свободных слотов по всем активным заявкам.
+    Возвращает {user_id: [slot_id, ...]}.
+    """
+    from utils.slot_assignment import assign_slots
+    from database import get_prepaid_student_ids
+
+    requests = {request['user_id']: request for request in get_all_schedule_requests()
+                if request.get('selected_slots')}
+    if not requests:
+        return {}
+
+    return assign_slots(requests, get_free_horizon_slots(), get_prepaid_student_ids())
+
+
+# ========== ЛИЧНЫЙ КАБИНЕТ СТУДЕНТА ==========
+
+# Готовые данные для кнопок "Мои занятия" и "Мой баланс": user_id -> представление.
+# Строится при первом обращении и дальше обновляется по событиям из database.py,
+# поэтому повторные нажатия не обращаются к БД.
+student_views = {}
+
+# Ключ сортировки занятий, у которых не удалось определить время начала
+UNKNOWN_LESSON_START = '9999-99-99 99:99'
+
+
+def is_manual_charge(lesson):
+    """Запись о ручном списании урока, а не занятие в расписании"""
+    return 'Ручное списание' in (lesson.get('slot_name') or '')
+
+
+def lesson_view_entry(lesson):
+    """(начало, id, название) - элемент отсортированного списка занятий"""
+    return (lesson.get('starts_at') or UNKNOWN_LESSON_START, lesson['id'], lesson.get('slot_name', ''))
+
+
+def apply_balance_to_view(view, balance):
+    """Копирует сводку баланса в представление"""
+    view['lessons_left'] = balance.get('lessons_left', 0)
+    view['balance'] = balance.get('balance', 0)
+    view['lesson_price'] = balance.get('lesson_price', 2000)
+    view['notes'] = balance.get('notes', '')
+
+
+def build_student_view(user_id):
+    """Собирает представление студента из БД"""
+    profile = get_user(user_id) or {}
+    lessons = get_confirmed_lessons(user_id)
+
+    view = {
+        'has_profile': bool(profile),
+        'fio': profile.get('fio') or 'Не указано',
+        'instruments': profile.get('instruments') or [],
+        'lessons_total': len(lessons),
+        'lessons': sorted(lesson_view_entry(lesson) for lesson in lessons if not is_manual_charge(lesson)),
+    }
+    apply_balance_to_view(view, db_get_student_balance(user_id))
+    student_views[user_id] = view
+    return view
+
+
+def get_student_view(user_id):
+    """Представление студента: профиль, баланс и занятия, отсортированные по времени"""
+    view = student_views.get(user_id)
+    if view is None:
+        view = build_student_view(user_id)
+    return view
+
+
+def get_upcoming_view_lessons(view, now=None):
+    """Предстоящие занятия из представления (включая идущее сейчас)"""
+    now = now or datetime.now()
+    cutoff = (now - timedelta(minutes=LESSON_DURATION_MINUTES)).strftime('%Y-%m-%d %H:%M')
+    return view['lessons'][bisect_left(view['lessons'], (cutoff,)):]
+
+
+def update_student_view(event):
+    """Подписчик шины событий: точечно обновляет построенное представление"""
+    view = student_views.get(event.user_id)
+    if view is None:
+        return
+
+    if isinstance(event, LessonConfirmed):
+        view['lessons_total'] += 1
+        if not is_manual_charge(event.lesson):
+            insort(view['lessons'], lesson_view_entry(event.lesson))
+    elif isinstance(event, LessonCancelled):
+        view['lessons_total'] = max(0, view['lessons_total'] - len(event.lesson_ids))
+        removed = set(event.lesson_ids)
+        view['lessons'] = [entry for entry in view['lessons'] if entry[1] not in removed]
+    elif isinstance(event, BalanceChanged):
+        apply_balance_to_view(view, event.balance)
+    else:
+        # Профиль изменен или удален - перестроим при следующем обращении
+        student_views.pop(event.user_id, None)
+
+
+event_bus.subscribe(update_student_view, LessonConfirmed, LessonCancelled, BalanceChanged,
+                    ProfileUpdated, UserRemoved)
+
+
 # ========== СТАТИСТИЧЕСКИЕ ФУНКЦИИ ==========
 
 def get_total_lessons_count(user_id):
@@ -421,30 +753,12 @@ def get_lessons_for_reminder(target_date):
 # ========== ФУНКЦИИ ОЧИСТКИ ==========
 
 async def cleanup_weekly_requests(context):
-    """Еженедельная очистка старых заявок"""
-    from datetime import datetime
-
+    """Еженедельная очистка заявок: удаляются только прошедшие слоты"""
     print("🧹 Начало еженедельной очистки заявок...")
 
-    today = datetime.now()
-    removed_count = 0
-
-    requests = get_all_schedule_requests()
-
-    for request in requests:
-        user_id = request['user_id']
-
-        # Проверяем, есть ли у студента подтвержденные занятия
-        lessons = get_confirmed_lessons(user_id)
-        has_confirmed_lessons = len(lessons) > 0
-
-        if not has_confirmed_lessons:
-            # У студента нет подтвержденных занятий - удаляем заявку
-            delete_schedule_request(user_id)
-            removed_count += 1
-            print(f"DEBUG: Removed request for student {user_id} (no confirmed lessons)")
+    removed_count = cleanup_old_requests()
 
-    print(f"🧹 Еженедельная очистка завершена. Удалено {removed_count} заявок")
+    print(f"🧹 Еженедельная очистка завершена. Удалено {removed_count} прошедших слотов")
 
     # Отправляем уведомление преподавателю
     if removed_count > 0 and TEACHER_IDS:
@@ -452,8 +766,8 @@ async def cleanup_weekly_requests(context):
             await context.bot.send_message(
                 chat_id=TEACHER_IDS[0],
                 text=f"🧹 *Еженедельная очистка заявок*\n\n"
-                     f"Удалено {removed_count} старых заявок студентов.\n"
-                     f"Студенты без подтвержденных занятий будут выбирать расписание заново."
+                     f"Из заявок студентов удалено {removed_count} прошедших слотов.\n"
+                     f"Слоты на будущие недели сохранены."
             )
         except Exception as e:
             print(f"ERROR sending cleanup notification: {e}")
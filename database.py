@@ -2,6 +2,9 @@
 import sqlite3
 from datetime import datetime, timedelta
 from contextlib import contextmanager
+from utils.schedule_grid import ScheduleGrid, parse_slot_name
+from utils.events import event_bus, LessonConfirmed, LessonCancelled, BalanceChanged, ProfileUpdated, \
+    UserRemoved, RequestUpdated
 import logging
 
 logger = logging.getLogger(__name__)
@@ -74,20 +77,309 @@ def init_database():
             )
         ''')
 
+        # Сохраненное состояние бота (user_data, chat_data) между перезапусками
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS persistence_data (
+                kind TEXT,  -- user_data / chat_data
+                key INTEGER,
+                data BLOB,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (kind, key)
+            )
+        ''')
+
+        # Состояния диалогов ConversationHandler
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS conversation_states (
+                name TEXT,
+                key TEXT,  -- JSON массив (chat_id, user_id)
+                state TEXT,  -- JSON
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (name, key)
+            )
+        ''')
+
+        # Лист ожидания занятых слотов: очередь по slot_id в порядке записи (rowid)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS slot_waitlist (
+                slot_id TEXT NOT NULL,
+                user_id INTEGER NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (slot_id, user_id)
+            )
+        ''')
+
+        # Миграция: абсолютное время начала занятия для календарных запросов
+        migrate_lessons_starts_at(cursor)
+
+        # Миграция: сколько уроков студент хочет получить по заявке
+        if 'desired_lessons' not in get_table_columns(cursor, 'schedule_requests'):
+            cursor.execute('ALTER TABLE schedule_requests ADD COLUMN desired_lessons INTEGER DEFAULT 1')
+
+        # Миграция: отметка о списании проведенного занятия с баланса
+        if 'charged' not in get_table_columns(cursor, 'confirmed_lessons'):
+            cursor.execute('ALTER TABLE confirmed_lessons ADD COLUMN charged INTEGER DEFAULT 0')
+            # Занятия из заявок оплачены при подтверждении, списывать их повторно нельзя
+            cursor.execute('UPDATE confirmed_lessons SET charged = 1 WHERE COALESCE(is_manual, 0) = 0')
+
+        # Миграция: ФИО в нижнем регистре для поиска по началу ФИО
+        migrate_users_fio_lower(cursor)
+
+        # Полнотекстовый поиск по студентам
+        create_users_fts(cursor)
+
+        # Счетчики панели преподавателя (обновляются триггерами, сверяются при запуске)
+        create_dashboard_stats(cursor)
+
         # Индексы для быстрого поиска
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_role_fio_lower ON users(role, fio_lower)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_confirmed_lessons_user_id ON confirmed_lessons(user_id)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_confirmed_lessons_slot_id ON confirmed_lessons(slot_id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_confirmed_lessons_starts_at ON confirmed_lessons(starts_at)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_schedule_requests_user_id ON schedule_requests(user_id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_slot_waitlist_user_id ON slot_waitlist(user_id)')
 
         conn.commit()
         logger.info("База данных инициализирована")
 
 
+def get_table_columns(cursor, table):
+    """Возвращает список колонок таблицы"""
+    cursor.execute(f'PRAGMA table_info({table})')
+    return [row[1] for row in cursor.fetchall()]
+
+
+def get_lesson_starts_at(lesson_data):
+    """Начало занятия в формате ГГГГ-ММ-ДД ЧЧ:ММ (из slot_id или slot_name)"""
+    if lesson_data.get('starts_at'):
+        return lesson_data['starts_at']
+
+    parsed = ScheduleGrid.parse_slot_id(lesson_data.get('slot_id', ''))
+    if not parsed:
+        parsed = parse_slot_name(lesson_data.get('slot_name', ''))
+
+    lesson_date, time_str = parsed
+    if not lesson_date or not time_str:
+        return None
+    return f"{lesson_date.strftime('%Y-%m-%d')} {time_str}"
+
+
+def migrate_lessons_starts_at(cursor):
+    """Добавляет колонку starts_at в confirmed_lessons и заполняет ее для старых записей"""
+    if 'starts_at' in get_table_columns(cursor, 'confirmed_lessons'):
+        return
+
+    cursor.execute('ALTER TABLE confirmed_lessons ADD COLUMN starts_at TEXT')
+
+    cursor.execute('SELECT id, slot_id, slot_name FROM confirmed_lessons')
+    updates = []
+    for row in cursor.fetchall():
+        starts_at = get_lesson_starts_at(dict(row))
+        if starts_at:
+            updates.append((starts_at, row['id']))
+
+    cursor.executemany('UPDATE confirmed_lessons SET starts_at = ? WHERE id = ?', updates)
+    logger.info(f"Заполнено starts_at для {len(updates)} занятий")
+
+
+def normalize_fio(fio):
+    """ФИО для поиска: нижний регистр, ё -> е, одиночные пробелы"""
+    return ' '.join((fio or '').split()).lower().replace('ё', 'е')
+
+
+def migrate_users_fio_lower(cursor):
+    """Добавляет колонку fio_lower в users и заполняет ее (lower() в SQLite не работает с кириллицей)"""
+    if 'fio_lower' in get_table_columns(cursor, 'users'):
+        return
+
+    cursor.execute('ALTER TABLE users ADD COLUMN fio_lower TEXT')
+    cursor.execute('SELECT user_id, fio FROM users')
+    updates = [(normalize_fio(row['fio']), row['user_id']) for row in cursor.fetchall()]
+    cursor.executemany('UPDATE users SET fio_lower = ? WHERE user_id = ?', updates)
+    logger.info(f"Заполнено fio_lower для {len(updates)} пользователей")
+
+
+# Полнотекстовый индекс users_fts (rowid = user_id): ФИО, инструменты (из JSON), цели.
+# unicode61 сам приводит кириллицу к нижнему регистру, ё -> е заменяется явно.
+USERS_FTS_VALUES = '''
+    new.user_id,
+    replace(replace(COALESCE(new.fio, ''), 'ё', 'е'), 'Ё', 'Е'),
+    (SELECT group_concat(value, ' ') FROM json_each(
+        CASE WHEN json_valid(new.instruments) THEN new.instruments ELSE '[]' END)),
+    replace(replace(COALESCE(new.goals, ''), 'ё', 'е'), 'Ё', 'Е')
+'''
+
+# False, если SQLite собран без FTS5 - тогда поиск идет по началу ФИО
+USERS_FTS_ENABLED = True
+
+
+def create_users_fts(cursor):
+    """Создает users_fts и триггеры синхронизации с users; при создании заполняет индекс"""
+    global USERS_FTS_ENABLED
+
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'users_fts'")
+    exists = cursor.fetchone() is not None
+
+    try:
+        cursor.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS users_fts
+            USING fts5(fio, instruments, goals, tokenize = 'unicode61 remove_diacritics 2')
+        ''')
+    except sqlite3.OperationalError as e:
+        USERS_FTS_ENABLED = False
+        logger.warning(f"FTS5 недоступен, полнотекстовый поиск отключен: {e}")
+        return
+
+    # INSERT OR REPLACE не вызывает триггер удаления, поэтому старая запись удаляется здесь
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS users_fts_insert AFTER INSERT ON users BEGIN
+            DELETE FROM users_fts WHERE rowid = new.user_id;
+            INSERT INTO users_fts (rowid, fio, instruments, goals) VALUES ({USERS_FTS_VALUES});
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS users_fts_update AFTER UPDATE OF fio, instruments, goals ON users BEGIN
+            DELETE FROM users_fts WHERE rowid = old.user_id;
+            INSERT INTO users_fts (rowid, fio, instruments, goals) VALUES ({USERS_FTS_VALUES});
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS users_fts_delete AFTER DELETE ON users BEGIN
+            DELETE FROM users_fts WHERE rowid = old.user_id;
+        END
+    ''')
+
+    if not exists:
+        cursor.execute(f'''
+            INSERT INTO users_fts (rowid, fio, instruments, goals)
+            SELECT {USERS_FTS_VALUES.replace('new.', '')} FROM users
+        ''')
+        logger.info("Заполнен полнотекстовый индекс users_fts")
+
+
+# Счетчики панели преподавателя: имя -> запрос, считающий точное значение
+DASHBOARD_STATS = {
+    'students': "SELECT COUNT(*) FROM users WHERE role = 'student'",
+    'confirmed_lessons': "SELECT COUNT(*) FROM confirmed_lessons",
+    'active_requests': "SELECT COUNT(*) FROM schedule_requests WHERE COALESCE(selected_slots, '') NOT IN ('', '[]')",
+    'total_debt': "SELECT COALESCE(SUM(-balance), 0) FROM student_balance WHERE balance < 0",
+    'prepaid_lessons': "SELECT COALESCE(SUM(lessons_left), 0) FROM student_balance WHERE lessons_left > 0",
+}
+
+# Вклад одной строки в счетчик (для new.* и old.*)
+STUDENT_ROW = "({row}.role = 'student')"
+ACTIVE_REQUEST_ROW = "(COALESCE({row}.selected_slots, '') NOT IN ('', '[]'))"
+DEBT_ROW = "(CASE WHEN {row}.balance < 0 THEN -{row}.balance ELSE 0 END)"
+PREPAID_ROW = "(CASE WHEN {row}.lessons_left > 0 THEN {row}.lessons_left ELSE 0 END)"
+# Занятие, которое считается в календаре (ручные списания урока не считаются)
+CALENDAR_LESSON_ROW = "{row}.starts_at IS NOT NULL AND COALESCE({row}.slot_name, '') NOT LIKE '%Ручное списание%'"
+
+
+def stat_delta(name, expression):
+    """SQL изменения счетчика name на expression"""
+    return f"UPDATE dashboard_stats SET value = value + ({expression}) WHERE name = '{name}';"
+
+
+def day_count_delta(row, delta):
+    """SQL изменения числа занятий в день занятия строки row (new/old)"""
+    day = f"substr({row}.starts_at, 1, 10)"
+    condition = CALENDAR_LESSON_ROW.format(row=row)
+    return (
+        f"INSERT OR IGNORE INTO lesson_day_counts (day, lessons) SELECT {day}, 0 WHERE {condition};"
+        f"UPDATE lesson_day_counts SET lessons = lessons + ({delta}) WHERE day = {day} AND {condition};"
+    )
+
+
+def create_dashboard_stats(cursor):
+    """Таблицы счетчиков, триггеры их обновления и сверка с реальными данными"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS dashboard_stats (
+            name TEXT PRIMARY KEY,
+            value INTEGER DEFAULT 0
+        )
+    ''')
+    # Число занятий по дням - для "занятий на этой неделе" и календаря
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS lesson_day_counts (
+            day TEXT PRIMARY KEY,  -- ГГГГ-ММ-ДД
+            lessons INTEGER DEFAULT 0
+        )
+    ''')
+
+    triggers = {
+        'stats_users_insert': ('AFTER INSERT ON users', stat_delta('students', STUDENT_ROW.format(row='new'))),
+        'stats_users_delete': ('AFTER DELETE ON users', stat_delta('students', f"-{STUDENT_ROW.format(row='old')}")),
+        'stats_users_update': ('AFTER UPDATE OF role ON users', stat_delta(
+            'students', f"{STUDENT_ROW.format(row='new')} - {STUDENT_ROW.format(row='old')}")),
+
+        'stats_lessons_insert': ('AFTER INSERT ON confirmed_lessons',
+                                 stat_delta('confirmed_lessons', '1') + day_count_delta('new', 1)),
+        'stats_lessons_delete': ('AFTER DELETE ON confirmed_lessons',
+                                 stat_delta('confirmed_lessons', '-1') + day_count_delta('old', -1)),
+        'stats_lessons_update': ('AFTER UPDATE OF starts_at, slot_name ON confirmed_lessons',
+                                 day_count_delta('old', -1) + day_count_delta('new', 1)),
+
+        'stats_requests_insert': ('AFTER INSERT ON schedule_requests',
+                                  stat_delta('active_requests', ACTIVE_REQUEST_ROW.format(row='new'))),
+        'stats_requests_delete': ('AFTER DELETE ON schedule_requests',
+                                  stat_delta('active_requests', f"-{ACTIVE_REQUEST_ROW.format(row='old')}")),
+        'stats_requests_update': ('AFTER UPDATE OF selected_slots ON schedule_requests', stat_delta(
+            'active_requests', f"{ACTIVE_REQUEST_ROW.format(row='new')} - {ACTIVE_REQUEST_ROW.format(row='old')}")),
+    }
+    for row, sign, event in (('new', '', 'INSERT'), ('old', '-', 'DELETE')):
+        triggers[f'stats_balance_{event.lower()}'] = (
+            f'AFTER {event} ON student_balance',
+            stat_delta('total_debt', sign + DEBT_ROW.format(row=row)) +
+            stat_delta('prepaid_lessons', sign + PREPAID_ROW.format(row=row))
+        )
+    triggers['stats_balance_update'] = (
+        'AFTER UPDATE OF balance, lessons_left ON student_balance',
+        stat_delta('total_debt', f"{DEBT_ROW.format(row='new')} - {DEBT_ROW.format(row='old')}") +
+        stat_delta('prepaid_lessons', f"{PREPAID_ROW.format(row='new')} - {PREPAID_ROW.format(row='old')}")
+    )
+
+    for name, (event, body) in triggers.items():
+        cursor.execute(f'CREATE TRIGGER IF NOT EXISTS {name} {event} BEGIN {body} END')
+
+    verify_dashboard_stats(cursor)
+
+
+def verify_dashboard_stats(cursor):
+    """Сверяет счетчики с реальными данными и исправляет расхождения (при запуске)"""
+    for name, query in DASHBOARD_STATS.items():
+        cursor.execute(query)
+        actual = cursor.fetchone()[0]
+        cursor.execute('SELECT value FROM dashboard_stats WHERE name = ?', (name,))
+        row = cursor.fetchone()
+
+        if row is None or row[0] != actual:
+            if row is not None:
+                logger.warning(f"Счетчик {name} разошелся с данными: {row[0]} вместо {actual}")
+            cursor.execute('INSERT OR REPLACE INTO dashboard_stats (name, value) VALUES (?, ?)', (name, actual))
+
+    cursor.execute(f'''
+        SELECT substr(starts_at, 1, 10) AS day, COUNT(*) AS lessons FROM confirmed_lessons
+        WHERE {CALENDAR_LESSON_ROW.format(row='confirmed_lessons')}
+        GROUP BY day
+    ''')
+    actual_days = {row['day']: row['lessons'] for row in cursor.fetchall()}
+    cursor.execute('SELECT day, lessons FROM lesson_day_counts WHERE lessons != 0')
+    stored_days = {row['day']: row['lessons'] for row in cursor.fetchall()}
+
+    if actual_days != stored_days:
+        if stored_days:
+            logger.warning("Счетчики занятий по дням разошлись с данными, пересчитываем")
+        cursor.execute('DELETE FROM lesson_day_counts')
+        cursor.executemany('INSERT INTO lesson_day_counts (day, lessons) VALUES (?, ?)', actual_days.items())
+
+
 @contextmanager
 def get_connection():
     """Контекстный менеджер для подключения к БД"""
     conn = sqlite3.connect('music_school.db')
     conn.row_factory = sqlite3.Row  # Для доступа по имени столбца
+    # INSERT OR REPLACE вызывает триггеры удаления - иначе счетчики dashboard_stats расходятся
+    conn.execute('PRAGMA recursive_triggers = ON')
     try:
         yield conn
     finally:
@@ -109,11 +401,12 @@ def save_user(user_data):
 
         cursor.execute('''
             INSERT OR REPLACE INTO users 
-            (user_id, fio, birthdate, instruments, goals, role, study_format, updated_at)
-            VALUES (?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+            (user_id, fio, fio_lower, birthdate, instruments, goals, role, study_format, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
         ''', (
             user_data['user_id'],
             user_data.get('fio', ''),
+            normalize_fio(user_data.get('fio', '')),
             user_data.get('birthdate', ''),
             instruments_json,
             user_data.get('goals', ''),
@@ -124,6 +417,8 @@ def save_user(user_data):
         conn.commit()
         logger.info(f"Сохранен пользователь {user_data['user_id']}")
 
+    event_bus.publish(ProfileUpdated(user_data['user_id'], user_data))
+
 
 def get_user(user_id):
     """Получение данных пользователя"""
@@ -141,6 +436,19 @@ def get_user(user_id):
         return None
 
 
+def get_user_names(user_ids):
+    """ФИО пользователей одним запросом: {user_id: fio}"""
+    user_ids = list(user_ids)
+    if not user_ids:
+        return {}
+
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        placeholders = ','.join('?' * len(user_ids))
+        cursor.execute(f'SELECT user_id, fio FROM users WHERE user_id IN ({placeholders})', user_ids)
+        return {row['user_id']: row['fio'] for row in cursor.fetchall()}
+
+
 def get_all_users(role=None):
     """Получение всех пользователей с фильтром по роли"""
     with get_connection() as conn:
@@ -161,6 +469,110 @@ def get_all_users(role=None):
         return users
 
 
+def get_students_page(search='', instrument=None, debt_only=False, limit=10, offset=0):
+    """
+    Страница списка студентов для выбора в клавиатуре.
+    search - начало ФИО (поиск по индексу users(role, fio_lower)), instrument - инструмент,
+    debt_only - только студенты с долгом. Возвращает (студенты, есть ли следующая страница).
+    """
+    conditions = ["u.role = 'student'", "u.fio_lower > ''"]
+    params = []
+
+    prefix = normalize_fio(search)
+    if prefix:
+        # Диапазон по индексу вместо LIKE: LIKE в SQLite не учитывает регистр кириллицы
+        conditions.append('u.fio_lower >= ? AND u.fio_lower < ?')
+        params += [prefix, prefix + '\U0010ffff']
+
+    if instrument:
+        import json
+        conditions.append('u.instruments LIKE ?')
+        params.append(f'%{json.dumps(instrument)}%')
+
+    if debt_only:
+        conditions.append('b.balance < 0')
+
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            SELECT u.user_id, u.fio,
+                   COALESCE(b.lessons_left, 0) AS lessons_left,
+                   COALESCE(b.balance, 0) AS balance,
+                   (SELECT COUNT(*) FROM confirmed_lessons c WHERE c.user_id = u.user_id) AS lessons_count
+            FROM users u
+            LEFT JOIN student_balance b ON b.user_id = u.user_id
+            WHERE {' AND '.join(conditions)}
+            ORDER BY u.fio_lower, u.user_id
+            LIMIT ? OFFSET ?
+        ''', (*params, limit + 1, offset))
+
+        students = [dict(row) for row in cursor.fetchall()]
+
+    return students[:limit], len(students) > limit
+
+
+def get_students_report_rows():
+    """
+    Студенты для отчета со счетчиком занятий - один запрос в порядке индекса users(role, fio_lower)
+    вместо отдельного запроса занятий на каждого студента.
+    """
+    import json
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT u.user_id, u.fio, u.instruments, u.goals,
+                   (SELECT COUNT(*) FROM confirmed_lessons c WHERE c.user_id = u.user_id) AS lessons_count
+            FROM users u
+            WHERE u.role = 'student'
+            ORDER BY u.fio_lower, u.user_id
+        ''')
+
+        students = []
+        for row in cursor:
+            student = dict(row)
+            student['instruments'] = json.loads(student['instruments']) if student['instruments'] else []
+            students.append(student)
+
+        return students
+
+
+def search_students(text, limit=10):
+    """
+    Полнотекстовый поиск студентов по ФИО, инструментам и целям (users_fts).
+    Каждое слово ищется как начало слова; совпадения в ФИО весят больше.
+    """
+    words = normalize_fio(text).replace('"', ' ').split()
+    if not words:
+        return []
+
+    if not USERS_FTS_ENABLED:
+        return get_students_page(search=text, limit=limit)[0]
+
+    match = ' '.join(f'"{word}"*' for word in words)
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT u.user_id, u.fio, u.instruments,
+                   COALESCE(b.lessons_left, 0) AS lessons_left,
+                   COALESCE(b.balance, 0) AS balance
+            FROM users_fts
+            JOIN users u ON u.user_id = users_fts.rowid
+            LEFT JOIN student_balance b ON b.user_id = u.user_id
+            WHERE users_fts MATCH ? AND u.role = 'student'
+            ORDER BY bm25(users_fts, 10.0, 3.0, 1.0)
+            LIMIT ?
+        ''', (match, limit))
+
+        students = []
+        for row in cursor.fetchall():
+            student = dict(row)
+            import json
+            student['instruments'] = json.loads(student['instruments']) if student['instruments'] else []
+            students.append(student)
+
+        return students
+
+
 # ========== ФУНКЦИИ ДЛЯ РАБОТЫ С БАЛАНСОМ ==========
 
 def save_student_balance(balance_data):
@@ -185,6 +597,92 @@ def save_student_balance(balance_data):
 
         conn.commit()
 
+    event_bus.publish(BalanceChanged(balance_data['user_id'], balance_data))
+
+
+def update_student_balance(user_id, set_clause, params=()):
+    """
+    Атомарное изменение баланса одним UPDATE (например 'balance = balance + ?').
+    Возвращает запись баланса после изменения без отдельного чтения (RETURNING).
+    """
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('INSERT OR IGNORE INTO student_balance (user_id) VALUES (?)', (user_id,))
+        cursor.execute(f'''
+            UPDATE student_balance SET {set_clause}, updated_at = CURRENT_TIMESTAMP
+            WHERE user_id = ?
+            RETURNING *
+        ''', (*params, user_id))
+        balance = dict(cursor.fetchone())
+        conn.commit()
+
+    event_bus.publish(BalanceChanged(user_id, balance))
+    return balance
+
+
+def debit_lesson(cursor, user_id):
+    """Списание одного урока в открытой транзакции; возвращает (баланс после списания, из предоплаты)"""
+    cursor.execute('INSERT OR IGNORE INTO student_balance (user_id) VALUES (?)', (user_id,))
+    cursor.execute('''
+        UPDATE student_balance SET lessons_left = lessons_left - 1, updated_at = CURRENT_TIMESTAMP
+        WHERE user_id = ? AND lessons_left > 0
+        RETURNING *
+    ''', (user_id,))
+    row = cursor.fetchone()
+    from_prepaid = row is not None
+
+    if not from_prepaid:
+        cursor.execute('''
+            UPDATE student_balance
+            SET balance = balance - COALESCE(lesson_price, 2000), updated_at = CURRENT_TIMESTAMP
+            WHERE user_id = ?
+            RETURNING *
+        ''', (user_id,))
+        row = cursor.fetchone()
+    return dict(row), from_prepaid
+
+
+def describe_lesson_payment(balance, from_prepaid):
+    """Текст способа оплаты занятия по балансу после списания (как при подтверждении заявки)"""
+    if from_prepaid:
+        return "списан 1 урок из предоплаты"
+
+    lesson_price = balance['lesson_price'] or 2000
+    balance_before = balance['balance'] + lesson_price
+    if balance_before > 0:
+        return f"списано {lesson_price} руб. с депозита"
+    if balance_before == 0:
+        return f"добавлен долг {lesson_price} руб."
+    return f"долг увеличен на {lesson_price} руб."
+
+
+def charge_student_lesson(user_id, started_before=None):
+    """
+    Списывает один урок: из предоплаты, а если ее нет - в долг по цене урока.
+    started_before ('ГГГГ-ММ-ДД ЧЧ:ММ') - отметить оплаченным последнее уже начавшееся
+    несписанное занятие студента, чтобы массовое списание не взяло его повторно.
+    Возвращает (баланс после списания, списано ли из предоплаты).
+    """
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        balance, from_prepaid = debit_lesson(cursor, user_id)
+
+        if started_before:
+            cursor.execute('''
+                UPDATE confirmed_lessons SET charged = 1
+                WHERE id = (
+                    SELECT id FROM confirmed_lessons
+                    WHERE user_id = ? AND starts_at <= ? AND COALESCE(charged, 0) = 0
+                      AND slot_name NOT LIKE '%Ручное списание%'
+                    ORDER BY starts_at DESC LIMIT 1
+                )
+            ''', (user_id, started_before))
+
+        conn.commit()
+
+    event_bus.publish(BalanceChanged(user_id, balance))
+    return balance, from_prepaid
+
 
 def get_student_balance(user_id):
     """Получение баланса студента"""
@@ -210,29 +708,174 @@ def get_student_balance(user_id):
             return default_balance
 
 
+def get_prepaid_student_ids():
+    """ID студентов, у которых есть предоплаченные уроки"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT user_id FROM student_balance WHERE lessons_left > 0')
+        return {row['user_id'] for row in cursor.fetchall()}
+
+
+def get_student_ids(instrument=None):
+    """ID студентов (с заполненным ФИО), при необходимости - только играющих на instrument"""
+    query = "SELECT user_id FROM users WHERE role = 'student' AND fio_lower > ''"
+    params = []
+    if instrument:
+        import json
+        query += ' AND instruments LIKE ?'
+        params.append(f'%{json.dumps(instrument)}%')
+
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(query, params)
+        return [row['user_id'] for row in cursor.fetchall()]
+
+
+def get_student_ids_by_fio(fios):
+    """Нормализованное ФИО -> список ID студентов с таким ФИО (для сопоставления строк выписки)"""
+    names = sorted({normalize_fio(fio) for fio in fios if normalize_fio(fio)})
+    if not names:
+        return {}
+
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            SELECT user_id, fio_lower FROM users
+            WHERE role = 'student' AND fio_lower IN ({','.join('?' * len(names))})
+        ''', names)
+
+        result = {}
+        for row in cursor.fetchall():
+            result.setdefault(row['fio_lower'], []).append(row['user_id'])
+        return result
+
+
+def update_balances_bulk(set_clause, rows):
+    """
+    Одно изменение баланса для многих студентов одной транзакцией (executemany).
+    set_clause - выражение SET с параметрами, rows - кортежи (параметры..., user_id).
+    Возвращает {user_id: баланс после изменения}.
+    """
+    if not rows:
+        return {}
+
+    student_ids = sorted({row[-1] for row in rows})
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        # Студенты без записи баланса получают значения по умолчанию
+        cursor.executemany('INSERT OR IGNORE INTO student_balance (user_id) VALUES (?)',
+                           [(student_id,) for student_id in student_ids])
+        cursor.executemany(f'''
+            UPDATE student_balance SET {set_clause}, updated_at = CURRENT_TIMESTAMP
+            WHERE user_id = ?
+        ''', rows)
+
+        balances = {}
+        # Читаем результат порциями: ограничение SQLite на число параметров запроса
+        for i in range(0, len(student_ids), 500):
+            part = student_ids[i:i + 500]
+            cursor.execute(f'''
+                SELECT * FROM student_balance WHERE user_id IN ({','.join('?' * len(part))})
+            ''', part)
+            balances.update((row['user_id'], dict(row)) for row in cursor.fetchall())
+
+        conn.commit()
+        logger.info(f"Массовое изменение баланса ({set_clause}) у студентов: {len(student_ids)}")
+
+    for student_id, balance in balances.items():
+        event_bus.publish(BalanceChanged(student_id, balance))
+    return balances
+
+
+def add_lessons_bulk(student_ids, lessons):
+    """Добавляет lessons предоплаченных уроков каждому студенту (групповой пакет)"""
+    return update_balances_bulk(
+        'lessons_left = lessons_left + ?, total_paid_lessons = total_paid_lessons + ?',
+        [(lessons, lessons, student_id) for student_id in student_ids]
+    )
+
+
+def set_price_bulk(student_ids, price):
+    """Устанавливает цену урока всем студентам из списка"""
+    return update_balances_bulk('lesson_price = ?', [(price, student_id) for student_id in student_ids])
+
+
+def add_deposits_bulk(deposits):
+    """Зачисляет депозиты [(user_id, сумма), ...]; несколько строк одного студента суммируются"""
+    totals = {}
+    for student_id, amount in deposits:
+        totals[student_id] = totals.get(student_id, 0) + amount
+    return update_balances_bulk('balance = balance + ?', [(amount, student_id) for student_id, amount in totals.items()])
+
+
 # ========== ФУНКЦИИ ДЛЯ РАБОТЫ С ЗАНЯТИЯМИ ==========
 
+def insert_confirmed_lesson(cursor, lesson_data):
+    """INSERT одного занятия в открытой транзакции; возвращает сохраненную запись с id и starts_at"""
+    starts_at = get_lesson_starts_at(lesson_data)
+    cursor.execute('''
+        INSERT INTO confirmed_lessons 
+        (user_id, slot_id, slot_name, confirmed_by, date_added, payment_type, is_manual, starts_at, charged)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (
+        lesson_data['user_id'],
+        lesson_data.get('slot_id', ''),
+        lesson_data.get('slot_name', ''),
+        lesson_data.get('confirmed_by', 0),
+        lesson_data.get('date_added', ''),
+        lesson_data.get('payment_type', ''),
+        lesson_data.get('is_manual', 0),
+        starts_at,
+        1 if lesson_data.get('charged') else 0
+    ))
+    return dict(lesson_data, id=cursor.lastrowid, starts_at=starts_at)
+
+
 def save_confirmed_lesson(lesson_data):
     """Сохранение подтвержденного занятия"""
     with get_connection() as conn:
         cursor = conn.cursor()
+        lesson = insert_confirmed_lesson(cursor, lesson_data)
+        conn.commit()
+        logger.info(f"Сохранено занятие для пользователя {lesson_data['user_id']}")
 
-        cursor.execute('''
-            INSERT INTO confirmed_lessons 
-            (user_id, slot_id, slot_name, confirmed_by, date_added, payment_type, is_manual)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            lesson_data['user_id'],
-            lesson_data.get('slot_id', ''),
-            lesson_data.get('slot_name', ''),
-            lesson_data.get('confirmed_by', 0),
-            lesson_data.get('date_added', ''),
-            lesson_data.get('payment_type', ''),
-            lesson_data.get('is_manual', 0)
-        ))
+    event_bus.publish(LessonConfirmed(lesson['user_id'], lesson))
+
+
+def save_lesson_series(lessons_data, find_free_slots):
+    """
+    Сохраняет серию занятий одной транзакцией вместе с проверкой занятости:
+    find_free_slots(занятия диапазона дат серии) возвращает свободные slot_id.
+    Возвращает (сохраненные занятия, slot_id пропущенных - время занято).
+    """
+    if not lessons_data:
+        return [], []
+
+    starts = [get_lesson_starts_at(lesson_data) for lesson_data in lessons_data]
+    range_start = min(starts)[:10]
+    range_end = (datetime.strptime(max(starts)[:10], '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
+
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        # Блокируем запись до проверки: между проверкой и вставкой слоты никто не займет
+        cursor.execute('BEGIN IMMEDIATE')
+        cursor.execute('SELECT * FROM confirmed_lessons WHERE starts_at >= ? AND starts_at < ?',
+                       (range_start, range_end))
+        free_slots = find_free_slots([dict(row) for row in cursor.fetchall()])
 
+        lessons = []
+        skipped = []
+        for lesson_data in lessons_data:
+            if lesson_data['slot_id'] in free_slots:
+                lessons.append(insert_confirmed_lesson(cursor, lesson_data))
+            else:
+                skipped.append(lesson_data['slot_id'])
         conn.commit()
-        logger.info(f"Сохранено занятие для пользователя {lesson_data['user_id']}")
+        logger.info(f"Сохранено занятий серии одной транзакцией: {len(lessons)}, пропущено: {len(skipped)}")
+
+    for lesson in lessons:
+        event_bus.publish(LessonConfirmed(lesson['user_id'], lesson))
+    return lessons, skipped
 
 
 def get_confirmed_lessons(user_id=None):
@@ -252,26 +895,292 @@ def get_confirmed_lessons(user_id=None):
         return lessons
 
 
+def get_confirmed_lessons_by_ids(lesson_ids):
+    """Получение занятий по списку ID (в том же порядке, удаленные пропускаются)"""
+    if not lesson_ids:
+        return []
+
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        placeholders = ','.join('?' * len(lesson_ids))
+        cursor.execute(f'SELECT * FROM confirmed_lessons WHERE id IN ({placeholders})', tuple(lesson_ids))
+        lessons = {row['id']: dict(row) for row in cursor.fetchall()}
+
+    return [lessons[lesson_id] for lesson_id in lesson_ids if lesson_id in lessons]
+
+
+def get_lessons_between(start, end, user_id=None):
+    """
+    Получение занятий в интервале [start, end) по индексу starts_at.
+    start и end - строки 'ГГГГ-ММ-ДД' или 'ГГГГ-ММ-ДД ЧЧ:ММ'.
+    """
+    with get_connection() as conn:
+        cursor = conn.cursor()
+
+        if user_id:
+            cursor.execute('''
+                SELECT * FROM confirmed_lessons
+                WHERE starts_at >= ? AND starts_at < ? AND user_id = ?
+                ORDER BY starts_at
+            ''', (start, end, user_id))
+        else:
+            cursor.execute('''
+                SELECT * FROM confirmed_lessons
+                WHERE starts_at >= ? AND starts_at < ?
+                ORDER BY starts_at
+            ''', (start, end))
+
+        return [dict(row) for row in cursor.fetchall()]
+
+
+def get_lessons_with_students_between(start, end=None):
+    """
+    Занятия с ФИО и инструментами студентов в интервале [start, end) одним запросом
+    по индексу starts_at, в порядке времени. Ручные списания урока не входят.
+    """
+    import json
+    query = '''
+        SELECT c.id, c.user_id, c.slot_id, c.slot_name, c.starts_at, u.fio, u.instruments
+        FROM confirmed_lessons c
+        JOIN users u ON u.user_id = c.user_id
+        WHERE c.starts_at >= ? {end_condition}
+          AND c.slot_name NOT LIKE '%Ручное списание%'
+        ORDER BY c.starts_at
+    '''
+    params = [start]
+    if end:
+        params.append(end)
+
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(query.format(end_condition='AND c.starts_at < ?' if end else ''), params)
+
+        lessons = []
+        for row in cursor.fetchall():
+            lesson = dict(row)
+            lesson['instruments'] = json.loads(lesson['instruments']) if lesson['instruments'] else []
+            lessons.append(lesson)
+
+        return lessons
+
+
+def get_uncharged_lessons_between(start, end):
+    """
+    Еще не списанные занятия, начавшиеся в интервале [start, end], с ФИО студента,
+    в порядке времени (по индексу starts_at). Ручные списания урока не входят.
+    """
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT c.id, c.user_id, c.slot_name, c.starts_at, u.fio
+            FROM confirmed_lessons c
+            JOIN users u ON u.user_id = c.user_id
+            WHERE c.starts_at >= ? AND c.starts_at <= ?
+              AND COALESCE(c.charged, 0) = 0
+              AND c.slot_name NOT LIKE '%Ручное списание%'
+            ORDER BY c.starts_at
+        ''', (start, end))
+        return [dict(row) for row in cursor.fetchall()]
+
+
+def charge_lessons(lesson_ids):
+    """
+    Списывает проведенные занятия одной транзакцией: по уроку за каждое занятие,
+    сначала из предоплаты, затем в долг по цене урока студента (как use_lesson).
+    Уже списанные занятия пропускаются, поэтому повторный вызов ничего не спишет.
+    Возвращает список списаний в порядке времени.
+    """
+    if not lesson_ids:
+        return []
+
+    placeholders = ','.join('?' * len(lesson_ids))
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        # Блокируем запись сразу: параллельное списание не прочитает те же занятия
+        cursor.execute('BEGIN IMMEDIATE')
+        cursor.execute(f'''
+            SELECT id, user_id, slot_name, starts_at FROM confirmed_lessons
+            WHERE id IN ({placeholders}) AND COALESCE(charged, 0) = 0
+            ORDER BY starts_at, id
+        ''', list(lesson_ids))
+        lessons = [dict(row) for row in cursor.fetchall()]
+        if not lessons:
+            conn.rollback()
+            return []
+
+        student_ids = sorted({lesson['user_id'] for lesson in lessons})
+        student_placeholders = ','.join('?' * len(student_ids))
+        # Студенты без записи баланса получают значения по умолчанию
+        cursor.executemany('INSERT OR IGNORE INTO student_balance (user_id) VALUES (?)',
+                           [(student_id,) for student_id in student_ids])
+        cursor.execute(f'''
+            SELECT * FROM student_balance WHERE user_id IN ({student_placeholders})
+        ''', student_ids)
+        balances = {row['user_id']: dict(row) for row in cursor.fetchall()}
+
+        charges = []
+        for lesson in lessons:
+            balance = balances[lesson['user_id']]
+            lesson_price = balance.get('lesson_price') or 2000
+            from_prepaid = balance['lessons_left'] > 0
+            if from_prepaid:
+                balance['lessons_left'] -= 1
+            else:
+                balance['balance'] -= lesson_price
+
+            charges.append(dict(
+                lesson,
+                from_prepaid=from_prepaid,
+                lesson_price=lesson_price,
+                lessons_left=balance['lessons_left'],
+                balance=balance['balance']
+            ))
+
+        cursor.executemany('''
+            UPDATE student_balance SET lessons_left = ?, balance = ?, updated_at = CURRENT_TIMESTAMP
+            WHERE user_id = ?
+        ''', [(balances[student_id]['lessons_left'], balances[student_id]['balance'], student_id)
+              for student_id in student_ids])
+        cursor.executemany('UPDATE confirmed_lessons SET charged = 1 WHERE id = ?',
+                           [(lesson['id'],) for lesson in lessons])
+
+        conn.commit()
+        logger.info(f"Списано занятий: {len(lessons)} у студентов: {len(student_ids)}")
+
+    for student_id in student_ids:
+        event_bus.publish(BalanceChanged(student_id, balances[student_id]))
+    return charges
+
+
 def delete_confirmed_lesson(lesson_id):
     """Удаление занятия по ID"""
     with get_connection() as conn:
         cursor = conn.cursor()
+        cursor.execute('SELECT user_id, slot_id FROM confirmed_lessons WHERE id = ?', (lesson_id,))
+        row = cursor.fetchone()
         cursor.execute('DELETE FROM confirmed_lessons WHERE id = ?', (lesson_id,))
         conn.commit()
         logger.info(f"Удалено занятие {lesson_id}")
 
+    if row:
+        event_bus.publish(LessonCancelled(row['user_id'], [lesson_id], [row['slot_id']]))
+
 
 def delete_confirmed_lesson_by_slot(user_id, slot_id):
     """Удаление занятия по user_id и slot_id"""
     with get_connection() as conn:
         cursor = conn.cursor()
+        cursor.execute('SELECT id FROM confirmed_lessons WHERE user_id = ? AND slot_id = ?', (user_id, slot_id))
+        lesson_ids = [row['id'] for row in cursor.fetchall()]
         cursor.execute('DELETE FROM confirmed_lessons WHERE user_id = ? AND slot_id = ?', (user_id, slot_id))
         conn.commit()
         logger.info(f"Удалено занятие {slot_id} для пользователя {user_id}")
 
+    if lesson_ids:
+        event_bus.publish(LessonCancelled(user_id, lesson_ids, [slot_id]))
+
+
+# ========== ЛИСТ ОЖИДАНИЯ ЗАНЯТЫХ СЛОТОВ ==========
+
+def add_to_waitlist(slot_id, user_id):
+    """Ставит студента в очередь на слот; возвращает его место в очереди"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('INSERT OR IGNORE INTO slot_waitlist (slot_id, user_id) VALUES (?, ?)', (slot_id, user_id))
+        cursor.execute('''
+            SELECT COUNT(*) AS position FROM slot_waitlist
+            WHERE slot_id = ? AND rowid <= (SELECT rowid FROM slot_waitlist WHERE slot_id = ? AND user_id = ?)
+        ''', (slot_id, slot_id, user_id))
+        position = cursor.fetchone()['position']
+        conn.commit()
+        logger.info(f"Пользователь {user_id} в листе ожидания слота {slot_id}, место {position}")
+        return position
+
+
+def remove_from_waitlist(slot_id, user_id):
+    """Убирает студента из очереди на слот; True, если он там был"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('DELETE FROM slot_waitlist WHERE slot_id = ? AND user_id = ?', (slot_id, user_id))
+        conn.commit()
+        return cursor.rowcount > 0
+
+
+def book_waitlisted_slot(lesson_data, is_free):
+    """
+    Записывает студента из листа ожидания одной транзакцией: проверка, что слот свободен
+    (is_free(занятия дня слота)), выход из очереди, списание урока и сохранение занятия.
+    Возвращает ('booked', занятие, баланс, из предоплаты), ('taken',) или ('stale',) -
+    студента уже нет в очереди на этот слот.
+    """
+    user_id = lesson_data['user_id']
+    slot_id = lesson_data['slot_id']
+    starts_at = get_lesson_starts_at(lesson_data)
+    day_start = starts_at[:10]
+    day_end = (datetime.strptime(day_start, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
+
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        # Блокируем запись сразу: параллельная запись не увидит слот свободным
+        cursor.execute('BEGIN IMMEDIATE')
+        cursor.execute('SELECT * FROM confirmed_lessons WHERE starts_at >= ? AND starts_at < ?',
+                       (day_start, day_end))
+        if not is_free([dict(row) for row in cursor.fetchall()]):
+            conn.rollback()
+            return ('taken',)
+
+        cursor.execute('DELETE FROM slot_waitlist WHERE slot_id = ? AND user_id = ?', (slot_id, user_id))
+        if not cursor.rowcount:
+            conn.rollback()
+            return ('stale',)
+
+        balance, from_prepaid = debit_lesson(cursor, user_id)
+        lesson = insert_confirmed_lesson(cursor, dict(
+            lesson_data, payment_type=describe_lesson_payment(balance, from_prepaid), charged=True))
+        conn.commit()
+        logger.info(f"Пользователь {user_id} записан из листа ожидания на {slot_id}")
+
+    event_bus.publish(BalanceChanged(user_id, balance))
+    event_bus.publish(LessonConfirmed(user_id, lesson))
+    return ('booked', lesson, balance, from_prepaid)
+
+
+def get_next_waitlisted(slot_id):
+    """Первый в очереди на слот (user_id) или None"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT user_id FROM slot_waitlist WHERE slot_id = ? ORDER BY rowid LIMIT 1', (slot_id,))
+        row = cursor.fetchone()
+        return row['user_id'] if row else None
+
+
+def get_user_waitlist(user_id):
+    """Слоты, в очереди на которые стоит студент"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT slot_id FROM slot_waitlist WHERE user_id = ?', (user_id,))
+        return {row['slot_id'] for row in cursor.fetchall()}
+
+
+def prune_past_waitlist(today):
+    """Удаляет очереди на прошедшие дни; возвращает количество удаленных записей"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('DELETE FROM slot_waitlist WHERE slot_id < ?', (today.strftime('%Y%m%d'),))
+        conn.commit()
+        return cursor.rowcount
+
 
 # ========== ФУНКЦИИ ДЛЯ РАБОТЫ С ЗАЯВКАМИ НА РАСПИСАНИЕ ==========
 
+def request_from_row(row):
+    """Заявка из строки schedule_requests: слоты из JSON в список"""
+    import json
+    request = dict(row)
+    request['selected_slots'] = json.loads(request['selected_slots']) if request['selected_slots'] else []
+    return request
+
+
 def save_schedule_request(request_data):
     """Сохранение заявки на расписание"""
     with get_connection() as conn:
@@ -285,19 +1194,28 @@ def save_schedule_request(request_data):
         existing = cursor.fetchone()
 
         if existing:
+            # desired_lessons не передан - оставляем сохраненное значение
             cursor.execute('''
                 UPDATE schedule_requests 
-                SET selected_slots = ?, week_added = ?, updated_at = CURRENT_TIMESTAMP
+                SET selected_slots = ?, week_added = ?,
+                    desired_lessons = COALESCE(?, desired_lessons), updated_at = CURRENT_TIMESTAMP
                 WHERE user_id = ?
-            ''', (selected_slots_json, request_data.get('week_added'), request_data['user_id']))
+                RETURNING *
+            ''', (selected_slots_json, request_data.get('week_added'),
+                  request_data.get('desired_lessons'), request_data['user_id']))
         else:
             cursor.execute('''
-                INSERT INTO schedule_requests (user_id, selected_slots, week_added)
-                VALUES (?, ?, ?)
-            ''', (request_data['user_id'], selected_slots_json, request_data.get('week_added')))
+                INSERT INTO schedule_requests (user_id, selected_slots, week_added, desired_lessons)
+                VALUES (?, ?, ?, ?)
+                RETURNING *
+            ''', (request_data['user_id'], selected_slots_json, request_data.get('week_added'),
+                  request_data.get('desired_lessons') or 1))
 
+        saved = request_from_row(cursor.fetchone())
         conn.commit()
 
+    event_bus.publish(RequestUpdated(saved['user_id'], saved))
+
 
 def get_schedule_request(user_id):
     """Получение заявки на расписание пользователя"""
@@ -305,13 +1223,7 @@ def get_schedule_request(user_id):
         cursor = conn.cursor()
         cursor.execute('SELECT * FROM schedule_requests WHERE user_id = ?', (user_id,))
         row = cursor.fetchone()
-
-        if row:
-            request = dict(row)
-            import json
-            request['selected_slots'] = json.loads(request['selected_slots']) if request['selected_slots'] else []
-            return request
-        return None
+        return request_from_row(row) if row else None
 
 
 def get_all_schedule_requests():
@@ -319,13 +1231,34 @@ def get_all_schedule_requests():
     with get_connection() as conn:
         cursor = conn.cursor()
         cursor.execute('SELECT * FROM schedule_requests')
+        return [request_from_row(row) for row in cursor.fetchall()]
 
-        requests = []
+
+def get_active_requests_with_students():
+    """
+    Заявки с выбранными слотами вместе с ФИО, инструментами и целями студентов - один запрос.
+    Возвращает {user_id: заявка} (при нескольких строках на студента - последняя, как в get_schedule_requests_dict).
+    """
+    import json
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT r.user_id, r.selected_slots, r.desired_lessons, u.fio, u.instruments, u.goals
+            FROM schedule_requests r
+            LEFT JOIN users u ON u.user_id = r.user_id
+            WHERE r.selected_slots IS NOT NULL AND r.selected_slots NOT IN ('', '[]')
+            ORDER BY r.id
+        ''')
+
+        requests = {}
         for row in cursor.fetchall():
             request = dict(row)
-            import json
-            request['selected_slots'] = json.loads(request['selected_slots']) if request['selected_slots'] else []
-            requests.append(request)
+            request['selected_slots'] = json.loads(request['selected_slots'])
+            request['instruments'] = json.loads(request['instruments']) if request['instruments'] else []
+            if request['selected_slots']:
+                requests[request['user_id']] = request
+            else:
+                requests.pop(request['user_id'], None)
 
         return requests
 
@@ -335,18 +1268,26 @@ def delete_schedule_request(user_id):
     with get_connection() as conn:
         cursor = conn.cursor()
         cursor.execute('DELETE FROM schedule_requests WHERE user_id = ?', (user_id,))
+        deleted = cursor.rowcount > 0
         conn.commit()
         logger.info(f"Удалена заявка на расписание пользователя {user_id}")
 
+    if deleted:
+        event_bus.publish(RequestUpdated(user_id, None))
+
 
 def delete_all_schedule_requests():
     """Удаление всех заявок на расписание"""
     with get_connection() as conn:
         cursor = conn.cursor()
-        cursor.execute('DELETE FROM schedule_requests')
+        cursor.execute('DELETE FROM schedule_requests RETURNING user_id')
+        user_ids = [row['user_id'] for row in cursor.fetchall()]
         conn.commit()
         logger.info("Удалены все заявки на расписание")
 
+    for user_id in user_ids:
+        event_bus.publish(RequestUpdated(user_id, None))
+
 
 # ========== ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ ==========
 
@@ -358,6 +1299,39 @@ def get_user_count_by_role(role):
         return cursor.fetchone()['count']
 
 
+def get_dashboard_stats():
+    """Счетчики панели преподавателя: {имя: значение}"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT name, value FROM dashboard_stats')
+        return {row['name']: row['value'] for row in cursor.fetchall()}
+
+
+def get_lessons_count_between_days(start_day, end_day):
+    """Число занятий с start_day по end_day включительно ('ГГГГ-ММ-ДД') по счетчикам lesson_day_counts"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT COALESCE(SUM(lessons), 0) AS count FROM lesson_day_counts
+            WHERE day >= ? AND day <= ?
+        ''', (start_day, end_day))
+        return cursor.fetchone()['count']
+
+
+def get_lesson_day_counts(start_day, end_day):
+    """
+    Число занятий по дням с start_day по end_day включительно ('ГГГГ-ММ-ДД'): {день: занятий}.
+    Счетчики lesson_day_counts - готовый GROUP BY по дате занятия, поиск по первичному ключу day.
+    """
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT day, lessons FROM lesson_day_counts
+            WHERE day >= ? AND day <= ? AND lessons > 0
+        ''', (start_day, end_day))
+        return {row['day']: row['lessons'] for row in cursor.fetchall()}
+
+
 def get_total_confirmed_lessons():
     """Получение общего количества подтвержденных занятий"""
     with get_connection() as conn:
@@ -375,12 +1349,64 @@ def cleanup_old_requests_weeks_ago(weeks=1):
         current_week = datetime.now().isocalendar()[1]
         target_week = current_week - weeks
 
-        cursor.execute('DELETE FROM schedule_requests WHERE week_added < ?', (target_week,))
-        deleted_count = cursor.rowcount
+        cursor.execute('DELETE FROM schedule_requests WHERE week_added < ? RETURNING user_id', (target_week,))
+        user_ids = [row['user_id'] for row in cursor.fetchall()]
+        conn.commit()
+
+        logger.info(f"Очищено {len(user_ids)} старых заявок")
+
+    for user_id in user_ids:
+        event_bus.publish(RequestUpdated(user_id, None))
+    return len(user_ids)
+
+
+def prune_past_request_slots(today):
+    """
+    Удаляет из заявок прошедшие слоты и слоты старого формата (без даты).
+    Заявки, в которых не осталось слотов, удаляются.
+    Возвращает количество удаленных слотов.
+    """
+    import json
+    today_key = today.strftime('%Y%m%d')
+
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT * FROM schedule_requests')
+
+        updates = []
+        deletes = []
+        changed = []
+        removed_slots = 0
+
+        for row in cursor.fetchall():
+            request = request_from_row(row)
+            slots = request['selected_slots']
+            kept = [slot for slot in slots
+                    if ScheduleGrid.parse_slot_id(slot) and slot[:8] >= today_key]
+
+            if len(kept) == len(slots):
+                continue
+
+            removed_slots += len(slots) - len(kept)
+            if kept:
+                updates.append((json.dumps(kept), row['user_id']))
+                changed.append(RequestUpdated(row['user_id'], dict(request, selected_slots=kept)))
+            else:
+                deletes.append((row['user_id'],))
+                changed.append(RequestUpdated(row['user_id'], None))
+
+        cursor.executemany('''
+            UPDATE schedule_requests SET selected_slots = ?, updated_at = CURRENT_TIMESTAMP
+            WHERE user_id = ?
+        ''', updates)
+        cursor.executemany('DELETE FROM schedule_requests WHERE user_id = ?', deletes)
         conn.commit()
 
-        logger.info(f"Очищено {deleted_count} старых заявок")
-        return deleted_count
+        logger.info(f"Удалено {removed_slots} прошедших слотов из заявок, удалено {len(deletes)} пустых заявок")
+
+    for event in changed:
+        event_bus.publish(event)
+    return removed_slots
 
 
 def update_lesson_reminder_sent(lesson_id):
@@ -408,11 +1434,14 @@ def delete_user(user_id):
 
         # Удаляем в правильном порядке (сначала зависимости)
 
-        # 1. Удаляем занятия пользователя
-        cursor.execute('DELETE FROM confirmed_lessons WHERE user_id = ?', (user_id,))
+        # 1. Удаляем занятия пользователя (их слоты освобождаются для листа ожидания)
+        cursor.execute('DELETE FROM confirmed_lessons WHERE user_id = ? RETURNING id, slot_id', (user_id,))
+        deleted_lessons = cursor.fetchall()
+        cursor.execute('DELETE FROM slot_waitlist WHERE user_id = ?', (user_id,))
 
         # 2. Удаляем заявки на расписание
         cursor.execute('DELETE FROM schedule_requests WHERE user_id = ?', (user_id,))
+        had_request = cursor.rowcount > 0
 
         # 3. Удаляем баланс
         cursor.execute('DELETE FROM student_balance WHERE user_id = ?', (user_id,))
@@ -422,7 +1451,14 @@ def delete_user(user_id):
 
         conn.commit()
         logger.info(f"Удален пользователь {user_id} и все связанные данные")
-        return cursor.rowcount  # Возвращаем количество удаленных записей
+
+    if deleted_lessons:
+        event_bus.publish(LessonCancelled(
+            user_id, [row['id'] for row in deleted_lessons], [row['slot_id'] for row in deleted_lessons]))
+    if had_request:
+        event_bus.publish(RequestUpdated(user_id, None))
+    event_bus.publish(UserRemoved(user_id, archived=False))
+    return cursor.rowcount  # Возвращаем количество удаленных записей
 
 
 def archive_user(user_id):
@@ -438,7 +1474,10 @@ def archive_user(user_id):
             WHERE user_id = ?
         ''', (user_id,))
 
-        # 2. Помечаем занятия как архивные
+        # 2. Убираем из листа ожидания
+        cursor.execute('DELETE FROM slot_waitlist WHERE user_id = ?', (user_id,))
+
+        # 3. Помечаем занятия как архивные
         cursor.execute('''
             UPDATE confirmed_lessons 
             SET is_archived = 1 
@@ -447,8 +1486,49 @@ def archive_user(user_id):
 
         conn.commit()
         logger.info(f"Заархивирован пользователь {user_id}")
-        return cursor.rowcount
+
+    event_bus.publish(UserRemoved(user_id, archived=True))
+    return cursor.rowcount
+
+
+# ========== СОХРАНЕНИЕ СОСТОЯНИЯ БОТА ==========
+
+def get_persistence_data(kind):
+    """Загрузка сохраненных данных вида kind: {key: BLOB}"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT key, data FROM persistence_data WHERE kind = ?', (kind,))
+        return {row['key']: row['data'] for row in cursor.fetchall()}
+
+
+def get_conversation_states(name):
+    """Загрузка состояний диалога name: {ключ JSON: состояние JSON}"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT key, state FROM conversation_states WHERE name = ?', (name,))
+        return {row['key']: row['state'] for row in cursor.fetchall()}
+
+
+def save_persistence_batch(data_rows, data_deletes, state_rows, state_deletes):
+    """
+    Запись накопленных изменений одной транзакцией.
+    data_rows: [(kind, key, data)], data_deletes: [(kind, key)],
+    state_rows: [(name, key, state)], state_deletes: [(name, key)]
+    """
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.executemany('''
+            INSERT OR REPLACE INTO persistence_data (kind, key, data, updated_at)
+            VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+        ''', data_rows)
+        cursor.executemany('DELETE FROM persistence_data WHERE kind = ? AND key = ?', data_deletes)
+        cursor.executemany('''
+            INSERT OR REPLACE INTO conversation_states (name, key, state, updated_at)
+            VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+        ''', state_rows)
+        cursor.executemany('DELETE FROM conversation_states WHERE name = ? AND key = ?', state_deletes)
+        conn.commit()
 
 
 # Инициализация базы данных при импорте
-init_database()
\ No newline at end of file
+init_database()
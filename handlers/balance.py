@@ -1,17 +1,33 @@
 # balance.py
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, ReplyKeyboardRemove
-from telegram.ext import ContextTypes, CallbackQueryHandler
-from config import is_teacher, get_student_balance, add_lessons_to_student, \
-    add_deposit, set_student_notes, init_student_balance, set_student_price, \
-    use_lesson, get_balance_display, get_total_lessons_count
-from database import get_all_users, get_confirmed_lessons, get_user
-from datetime import datetime
+from telegram.ext import ContextTypes
+from telegram.helpers import escape_markdown
+from config import is_teacher, add_lessons_to_student, \
+    add_deposit, set_student_notes, set_student_price, \
+    use_lesson, format_balance, get_balance_snapshot, \
+    get_student_view, get_upcoming_view_lessons, LESSON_DURATION_MINUTES
+from database import get_uncharged_lessons_between, charge_lessons
+from utils.callbacks import make_callback
+from utils.inflight import deduplicate_callback
+from utils.notifications import queue_notifications
+from handlers.student_picker import StudentPicker, PICKER_STATE_KEY
+from datetime import datetime, timedelta
 import re
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+# Постраничный список студентов с поиском (handlers/student_picker.py)
+balance_student_picker = StudentPicker(
+    "b",
+    "🎓 *Выберите студента для управления балансом:*",
+    select_callback=lambda student_id: make_callback("b", "s", student_id),
+    cancel_callback=make_callback("b", "c"),
+    button_text=lambda student: f"{student['fio']} (уроков: {student['lessons_left']}, занятий: {student['lessons_count']})"
+)
+
+
 async def start_balance_management_from_query(query, context):
     """Показывает список студентов из callback query"""
     user_id = query.from_user.id
@@ -20,37 +36,9 @@ async def start_balance_management_from_query(query, context):
         await query.edit_message_text("❌ Доступ запрещен.")
         return
 
-    # Получаем список студентов из БД
-    students_data = get_all_users(role='student')
-    students = {}
-    for student in students_data:
-        if student.get('fio'):
-            students[student['user_id']] = student
-
-    if not students:
-        await query.edit_message_text("📭 Пока нет зарегистрированных студентов.")
-        return
-
-    # Создаем клавиатуру со студентами
-    keyboard = []
-    for student_id, profile in students.items():
-        balance = get_student_balance(student_id)
-        total_lessons = get_total_lessons_count(student_id)
-
-        # СТАРЫЙ ФОРМАТ
-        button_text = f"{profile['fio']} (уроков: {balance['lessons_left']}, занятий: {total_lessons})"
-
-        keyboard.append([InlineKeyboardButton(button_text, callback_data=f"balance_select_{student_id}")])
+    await balance_student_picker.show(context, query=query)
 
-    keyboard.append([InlineKeyboardButton("❌ Отмена", callback_data="balance_cancel")])
 
-    reply_markup = InlineKeyboardMarkup(keyboard)
-
-    await query.edit_message_text(
-        "🎓 *Выберите студента для управления балансом:*",
-        parse_mode='Markdown',
-        reply_markup=reply_markup
-    )
 async def start_balance_management(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Начало управления балансом студентов"""
     user_id = update.effective_user.id
@@ -59,77 +47,24 @@ async def start_balance_management(update: Update, context: ContextTypes.DEFAULT
         await update.message.reply_text("❌ Доступ запрещен. Эта функция только для преподавателей.")
         return
 
-    # Получаем список студентов из БД
-    students_data = get_all_users(role='student')
-    students = {}
-    for student in students_data:
-        if student.get('fio'):
-            students[student['user_id']] = student
-
-    if not students:
-        await update.message.reply_text("📭 Пока нет зарегистрированных студентов.")
-        return
-
-    # Создаем клавиатуру со студентами
-    keyboard = []
-    for student_id, profile in students.items():
-        balance = get_student_balance(student_id)
-        total_lessons = get_total_lessons_count(student_id)
-        balance_display = get_balance_display(student_id)
-
-        button_text = f"{profile['fio']} (уроков: {balance['lessons_left']}, занятий: {total_lessons})"
-
-        keyboard.append([InlineKeyboardButton(button_text, callback_data=f"balance_select_{student_id}")])
-
-    keyboard.append([InlineKeyboardButton("❌ Отмена", callback_data="balance_cancel")])
-
-    reply_markup = InlineKeyboardMarkup(keyboard)
-
-    await update.message.reply_text(
-        "🎓 *Выберите студента для управления балансом:*",
-        parse_mode='Markdown',
-        reply_markup=reply_markup
-    )
+    await balance_student_picker.show(context, message=update.message)
 
 
 async def select_student(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработчик выбора студента"""
+    """Обработчик выбора студента (b:s:<id>)"""
     query = update.callback_query
     await query.answer()
 
-    if query.data == "balance_cancel":
-        await query.edit_message_text("❌ Управление балансом отменено.")
-        # Очищаем все данные
-        for key in ['selected_student_id', 'current_action']:
-            if key in context.user_data:
-                del context.user_data[key]
-        return
-
-    # Если это выбор студента: balance_select_12345
-    elif query.data.startswith("balance_select_"):
-        try:
-            parts = query.data.split("_")
-            if len(parts) >= 3:
-                student_id = int(parts[2])
-                context.user_data['selected_student_id'] = student_id
-            else:
-                await query.edit_message_text("❌ Ошибка: неверный формат данных.")
-                return
-        except (IndexError, ValueError) as e:
-            await query.edit_message_text("❌ Ошибка: неверный ID студента.")
-            return
-
-    # Показываем меню студента
-    student_id = context.user_data.get('selected_student_id')
-    if not student_id:
-        await query.edit_message_text("❌ Ошибка: студент не выбран.")
-        return
+    # ID студента уже проверен при разборе callback_data
+    student_id = context.args[0]
+    context.user_data['selected_student_id'] = student_id
+    context.user_data.pop(PICKER_STATE_KEY, None)
 
     await show_student_menu(query, context, student_id)
 
 
-async def show_student_menu(message_or_query, context, student_id: int):
-    """Показывает меню действий для студента"""
+async def show_student_menu(message_or_query, context, student_id: int, snapshot=None):
+    """Показывает меню действий для студента (snapshot - снимок баланса, если он уже есть)"""
     # Определяем, что пришло: сообщение или query
     if hasattr(message_or_query, 'message'):  # Это query
         chat_id = message_or_query.message.chat_id
@@ -140,45 +75,41 @@ async def show_student_menu(message_or_query, context, student_id: int):
         edit_func = None
         reply_func = message_or_query.reply_text
 
-    student_profile = get_user(student_id)
-    if not student_profile:
+    snapshot = snapshot or get_balance_snapshot(student_id)
+    if not snapshot:
         if edit_func:
             await edit_func("❌ Профиль студента не найден.")
         else:
             await reply_func("❌ Профиль студента не найден.")
         return
 
-    balance = get_student_balance(student_id)
-    balance_display = get_balance_display(student_id)
-    total_lessons = get_total_lessons_count(student_id)
-
     student_info = (
-        f"🎹 *Студент:* {student_profile['fio']}\n"
-        f"🎸 *Инструмент:* {', '.join(student_profile.get('instruments', []))}\n\n"
+        f"🎹 *Студент:* {snapshot.fio}\n"
+        f"🎸 *Инструмент:* {', '.join(snapshot.instruments)}\n\n"
         f"💰 *Баланс:*\n"
-        f"• Уроков осталось: {balance['lessons_left']} шт.\n"
-        f"• Всего занятий: {total_lessons} шт.\n"
-        f"• Баланс: {balance_display}\n"
-        f"• Цена урока: {balance.get('lesson_price', 2000)} руб.\n"
-        f"• Примечания: {balance.get('notes', 'Нет')}"
+        f"• Уроков осталось: {snapshot.lessons_left} шт.\n"
+        f"• Всего занятий: {snapshot.total_lessons} шт.\n"
+        f"• Баланс: {snapshot.display}\n"
+        f"• Цена урока: {snapshot.lesson_price} руб.\n"
+        f"• Примечания: {snapshot.notes}"
     )
 
     keyboard = [
         [
-            InlineKeyboardButton("➕ Добавить уроки", callback_data="balance_add_lessons"),
-            InlineKeyboardButton("🎹 Списать урок", callback_data="balance_charge_lesson"),
+            InlineKeyboardButton("➕ Добавить уроки", callback_data=make_callback("b", "a", "add_lessons")),
+            InlineKeyboardButton("🎹 Списать урок", callback_data=make_callback("b", "a", "charge_lesson")),
         ],
         [
-            InlineKeyboardButton("💰 Внести депозит", callback_data="balance_add_deposit"),
-            InlineKeyboardButton("📊 Статистика", callback_data="balance_statistics"),
+            InlineKeyboardButton("💰 Внести депозит", callback_data=make_callback("b", "a", "add_deposit")),
+            InlineKeyboardButton("📊 Статистика", callback_data=make_callback("b", "a", "statistics")),
         ],
         [
-            InlineKeyboardButton("💲 Цена урока", callback_data="balance_set_price"),
-            InlineKeyboardButton("📝 Примечание", callback_data="balance_add_notes"),
+            InlineKeyboardButton("💲 Цена урока", callback_data=make_callback("b", "a", "set_price")),
+            InlineKeyboardButton("📝 Примечание", callback_data=make_callback("b", "a", "add_notes")),
         ],
         [
-            InlineKeyboardButton("◀️ Назад к списку", callback_data="balance_back_to_list"),
-            InlineKeyboardButton("✅ Завершить", callback_data="balance_finish"),
+            InlineKeyboardButton("◀️ Назад к списку", callback_data=make_callback("b", "a", "back_to_list")),
+            InlineKeyboardButton("✅ Завершить", callback_data=make_callback("b", "a", "finish")),
         ]
     ]
 
@@ -217,7 +148,7 @@ async def handle_action_choice(update: Update, context: ContextTypes.DEFAULT_TYP
         await query.edit_message_text("❌ Ошибка: студент не выбран.")
         return
 
-    action = query.data.replace("balance_", "")
+    action = context.args[0]
 
     if action == "finish":
         await query.edit_message_text("✅ Управление балансом завершено.")
@@ -259,8 +190,8 @@ async def handle_action_choice(update: Update, context: ContextTypes.DEFAULT_TYP
             # Для списания урока показываем inline кнопки
             keyboard = [
                 [
-                    InlineKeyboardButton("✅ Списать", callback_data="balance_confirm_lesson"),
-                    InlineKeyboardButton("❌ Отмена", callback_data=f"balance_select_{student_id}")
+                    InlineKeyboardButton("✅ Списать", callback_data=make_callback("b", "y")),
+                    InlineKeyboardButton("❌ Отмена", callback_data=make_callback("b", "s", student_id))
                 ]
             ]
             reply_markup = InlineKeyboardMarkup(keyboard)
@@ -312,9 +243,6 @@ async def handle_balance_input(update: Update, context: ContextTypes.DEFAULT_TYP
             del context.user_data['current_action']
         return
 
-    student_profile = get_user(student_id)
-    student_name = student_profile.get('fio', 'Студент') if student_profile else 'Студент'
-
     # Проверяем нажатие кнопки "Отмена"
     if text == "❌ Отмена":
         # Удаляем ReplyKeyboardMarkup
@@ -346,28 +274,27 @@ async def handle_balance_input(update: Update, context: ContextTypes.DEFAULT_TYP
             )
             return
 
-        # Выполняем действие
+        # Выполняем действие: операция возвращает снимок баланса после изменения
         if action == 'add_deposit':
-            balance = add_deposit(student_id, amount)
-            new_balance_display = get_balance_display(student_id)
-            message = f"✅ *{amount} руб. внесено студентом {student_name}*\n\n• Новый баланс: {new_balance_display}"
+            snapshot = add_deposit(student_id, amount)
+            message = f"✅ *{amount} руб. внесено студентом {snapshot.fio}*\n\n• Новый баланс: {snapshot.display}"
 
             # Уведомляем студента
-            await notify_student_about_balance_change(context, student_id, "deposit_added", "", amount)
+            await notify_student_about_balance_change(context, snapshot, "deposit_added", "", amount)
 
         elif action == 'add_lessons':
-            balance = add_lessons_to_student(student_id, amount)
-            message = f"✅ *{amount} уроков добавлено студенту {student_name}*\n\n• Новый баланс: {balance['lessons_left']} уроков"
+            snapshot = add_lessons_to_student(student_id, amount)
+            message = f"✅ *{amount} уроков добавлено студенту {snapshot.fio}*\n\n• Новый баланс: {snapshot.lessons_left} уроков"
 
             # Уведомляем студента
-            await notify_student_about_balance_change(context, student_id, "lessons_added", "", amount)
+            await notify_student_about_balance_change(context, snapshot, "lessons_added", "", amount)
 
         elif action == 'set_price':
-            balance = set_student_price(student_id, amount)
-            message = f"💲 *Цена урока установлена для {student_name}*\n\n• Новая цена: {balance.get('lesson_price', amount)} руб."
+            snapshot = set_student_price(student_id, amount)
+            message = f"💲 *Цена урока установлена для {snapshot.fio}*\n\n• Новая цена: {snapshot.lesson_price} руб."
 
             # Уведомляем студента
-            await notify_student_about_balance_change(context, student_id, "price_changed", "", amount)
+            await notify_student_about_balance_change(context, snapshot, "price_changed", "", amount)
 
         await update.message.reply_text(
             message,
@@ -377,11 +304,11 @@ async def handle_balance_input(update: Update, context: ContextTypes.DEFAULT_TYP
 
     # Обработка примечания
     elif action == 'add_notes':
-        balance = set_student_notes(student_id, text)
-        message = f"📝 *Примечание добавлено студенту {student_name}*\n\nПримечание: {text}"
+        snapshot = set_student_notes(student_id, text)
+        message = f"📝 *Примечание добавлено студенту {snapshot.fio}*\n\nПримечание: {text}"
 
         # Уведомляем студента
-        await notify_student_about_balance_change(context, student_id, "notes_updated", text)
+        await notify_student_about_balance_change(context, snapshot, "notes_updated", text)
 
         await update.message.reply_text(
             message,
@@ -396,6 +323,7 @@ async def handle_balance_input(update: Update, context: ContextTypes.DEFAULT_TYP
     # Показываем меню студента заново (с inline кнопками)
     await show_student_menu(update.message, context, student_id)
 
+@deduplicate_callback
 async def charge_lesson(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Списание одного урока у студента с добавлением записи"""
     query = update.callback_query
@@ -406,75 +334,58 @@ async def charge_lesson(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.edit_message_text("❌ Ошибка: студент не выбран.")
         return
 
-    student_profile = get_user(student_id)
-    student_name = student_profile.get('fio', 'Студент') if student_profile else 'Студент'
-    balance_before = get_student_balance(student_id)
-    lesson_price = balance_before.get('lesson_price', 2000)
-
-    # 1. Списываем урок
-    if use_lesson(student_id):
-        # 3. Обновляем статистику
-        balance_after = get_student_balance(student_id)
-        new_balance_display = get_balance_display(student_id)
-        total_lessons = get_total_lessons_count(student_id)
-
-        # Формируем сообщение для преподавателя
-        if balance_before['lessons_left'] > 0:
-            message = (
-                f"✅ *Списан 1 урок у студента {student_name}*\n\n"
-                f"• Оплачено уроком из предоплаты\n"
-                f"• Осталось уроков: {balance_after['lessons_left']}\n"
-                f"• Всего занятий: {total_lessons} шт.\n"
-                f"• Новый баланс: {new_balance_display}"
-            )
-        else:
-            message = (
-                f"✅ *Списан 1 урок у студента {student_name}*\n\n"
-                f"• Нет предоплаченных уроков\n"
-                f"• Добавлен долг: {lesson_price} руб.\n"
-                f"• Осталось уроков: {balance_after['lessons_left']}\n"
-                f"• Всего занятий: {total_lessons} шт.\n"
-                f"• Новый баланс: {new_balance_display}"
-            )
-
-        await query.edit_message_text(message, parse_mode='Markdown')
-
-        # Уведомление студенту
-        await notify_student_about_lesson(context, student_id, balance_before, balance_after, lesson_price)
-
-        # Показываем обновленное меню студента
-        await show_student_menu(query, context, student_id)
+    # 1. Списываем урок: снимок баланса после списания, без повторных чтений.
+    # Последнее начавшееся несписанное занятие отмечается оплаченным
+    snapshot = use_lesson(student_id, datetime.now().strftime('%Y-%m-%d %H:%M'))
+
+    # Формируем сообщение для преподавателя
+    if snapshot.from_prepaid:
+        message = (
+            f"✅ *Списан 1 урок у студента {snapshot.fio}*\n\n"
+            f"• Оплачено уроком из предоплаты\n"
+            f"• Осталось уроков: {snapshot.lessons_left}\n"
+            f"• Всего занятий: {snapshot.total_lessons} шт.\n"
+            f"• Новый баланс: {snapshot.display}"
+        )
     else:
-        await query.edit_message_text("❌ Ошибка при списании урока.")
+        message = (
+            f"✅ *Списан 1 урок у студента {snapshot.fio}*\n\n"
+            f"• Нет предоплаченных уроков\n"
+            f"• Добавлен долг: {snapshot.lesson_price} руб.\n"
+            f"• Осталось уроков: {snapshot.lessons_left}\n"
+            f"• Всего занятий: {snapshot.total_lessons} шт.\n"
+            f"• Новый баланс: {snapshot.display}"
+        )
 
+    await query.edit_message_text(message, parse_mode='Markdown')
 
-async def notify_student_about_lesson(context: ContextTypes.DEFAULT_TYPE, student_id: int, balance_before: dict, balance_after: dict, lesson_price: int):
-    """Отправляет уведомление студенту о списании урока"""
-    from database import get_user
-    from config import get_balance_display
+    # Уведомление студенту
+    await notify_student_about_lesson(context, snapshot)
 
-    student_profile = get_user(student_id)
-    if not student_profile:
-        return
+    # Показываем обновленное меню студента
+    await show_student_menu(query, context, student_id, snapshot)
 
-    student_name = student_profile.get('fio', 'Студент')
+
+async def notify_student_about_lesson(context: ContextTypes.DEFAULT_TYPE, snapshot):
+    """Отправляет уведомление студенту о списании урока (по снимку баланса после списания)"""
+    student_id = snapshot.user_id
 
     # Определяем тип списания
-    if balance_before['lessons_left'] > 0:
+    if snapshot.from_prepaid:
         notification = (
             f"📝 *Уведомление об уроке*\n\n"
             f"Проведен 1 урок.\n"
             f"• Списано с предоплаты\n"
-            f"• Осталось уроков: {balance_after['lessons_left']}\n"
-            f"• Баланс: {get_balance_display(student_id)}"
+            f"• Осталось уроков: {snapshot.lessons_left}\n"
+            f"• Баланс: {snapshot.display}"
         )
     else:
         notification = (
             f"📝 *Уведомление об уроке*\n\n"
             f"Проведен 1 урок.\n"
             f"• Нет предоплаченных уроков\n"
-            f"• Добавлен долг: {lesson_price} руб.\n"
-            f"• Новый баланс: {get_balance_display(student_id)}"
+            f"• Добавлен долг: {snapshot.lesson_price} руб.\n"
+            f"• Новый баланс: {snapshot.display}"
         )
 
     # Отправляем уведомление студенту
@@ -502,13 +413,15 @@ async def show_student_statistics(update: Update, context: ContextTypes.DEFAULT_
         await query.edit_message_text("❌ Ошибка: студент не выбран.")
         return
 
-    student_profile = get_user(student_id)
-    balance = get_student_balance(student_id)
+    snapshot = get_balance_snapshot(student_id)
+    if not snapshot:
+        await query.edit_message_text("❌ Профиль студента не найден.")
+        return
 
     # Расчет статистики
-    lessons_left = balance['lessons_left']
-    total_lessons = get_total_lessons_count(student_id)
-    lesson_price = balance.get('lesson_price', 2000)
+    lessons_left = snapshot.lessons_left
+    total_lessons = snapshot.total_lessons
+    lesson_price = snapshot.lesson_price
 
     # Финансовые расчеты
     total_lessons_value = total_lessons * lesson_price
@@ -516,8 +429,8 @@ async def show_student_statistics(update: Update, context: ContextTypes.DEFAULT_
 
     statistics_text = (
         f"📊 *Статистика студента*\n\n"
-        f"*Студент:* {student_profile.get('fio', 'Неизвестно') if student_profile else 'Неизвестно'}\n"
-        f"*Инструмент:* {', '.join(student_profile.get('instruments', [])) if student_profile else 'Не указан'}\n\n"
+        f"*Студент:* {snapshot.fio}\n"
+        f"*Инструмент:* {', '.join(snapshot.instruments) or 'Не указан'}\n\n"
         f"*Статистика уроков:*\n"
         f"• Уроков осталось: {lessons_left} шт.\n"
         f"• Всего занятий: {total_lessons} шт.\n"
@@ -525,15 +438,15 @@ async def show_student_statistics(update: Update, context: ContextTypes.DEFAULT_
         f"*Финансовая статистика:*\n"
         f"• Стоимость всех занятий: {total_lessons_value} руб.\n"
         f"• Стоимость оставшихся уроков: {remaining_value} руб.\n"
-        f"• Текущий баланс: {get_balance_display(student_id)}\n\n"
+        f"• Текущий баланс: {snapshot.display}\n\n"
     )
 
-    if balance.get('notes'):
-        statistics_text += f"*Примечания:*\n{balance['notes']}\n\n"
+    if snapshot.notes:
+        statistics_text += f"*Примечания:*\n{snapshot.notes}\n\n"
 
     # Кнопки возврата
     keyboard = [
-        [InlineKeyboardButton("◀️ Назад к управлению", callback_data=f"balance_select_{student_id}")]
+        [InlineKeyboardButton("◀️ Назад к управлению", callback_data=make_callback("b", "s", student_id))]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
 
@@ -544,10 +457,111 @@ async def show_student_statistics(update: Update, context: ContextTypes.DEFAULT_
     )
 
 
+def get_today_charge_window(now=None):
+    """Интервал начала занятий, которые сегодня уже закончились: (начало дня, сейчас - длительность)"""
+    now = now or datetime.now()
+    day_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    last_start = now - timedelta(minutes=LESSON_DURATION_MINUTES)
+    return day_start.strftime('%Y-%m-%d %H:%M'), last_start.strftime('%Y-%m-%d %H:%M')
+
+
+async def show_today_charges(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Список несписанных занятий, закончившихся сегодня, с кнопкой 'Списать все' (b:t)"""
+    query = update.callback_query
+    if not is_teacher(query.from_user.id):
+        await query.answer("❌ Только преподаватель может списывать уроки", show_alert=True)
+        return
+    await query.answer()
+
+    lessons = get_uncharged_lessons_between(*get_today_charge_window())
+    if not lessons:
+        context.user_data.pop('charge_today', None)
+        await query.edit_message_text("✅ Все проведенные сегодня занятия уже списаны.")
+        return
+
+    # Запоминаем, что видел преподаватель: спишем именно эти занятия
+    context.user_data['charge_today'] = [lesson['id'] for lesson in lessons]
+
+    text = "🧾 *Проведенные сегодня занятия:*\n\n"
+    for lesson in lessons:
+        text += f"• {lesson['starts_at'][11:]} {escape_markdown(lesson['fio'] or 'Без имени')}\n"
+    text += f"\nСписать по 1 уроку за каждое занятие ({len(lessons)} шт.)?"
+
+    keyboard = [
+        [InlineKeyboardButton(f"✅ Списать все ({len(lessons)})", callback_data=make_callback("b", "k"))],
+        [InlineKeyboardButton("❌ Отмена", callback_data=make_callback("b", "c"))]
+    ]
+    await query.edit_message_text(text, parse_mode='Markdown', reply_markup=InlineKeyboardMarkup(keyboard))
+
+
+def today_charge_notification(charges):
+    """Уведомление студенту обо всех списанных сегодня занятиях"""
+    prepaid = sum(1 for charge in charges if charge['from_prepaid'])
+    debt = sum(charge['lesson_price'] for charge in charges if not charge['from_prepaid'])
+    last = charges[-1]
+
+    notification = f"📝 *Уведомление об уроках*\n\nПроведено уроков: {len(charges)}.\n"
+    if prepaid:
+        notification += f"• Списано с предоплаты: {prepaid}\n"
+    if debt:
+        notification += f"• Добавлен долг: {debt} руб.\n"
+    notification += (
+        f"• Осталось уроков: {last['lessons_left']}\n"
+        f"• Баланс: {format_balance(last['balance'])}"
+    )
+    return notification
+
+
+@deduplicate_callback
+async def apply_today_charges(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Списывает все показанные занятия одной транзакцией и ставит уведомления в очередь (b:k)"""
+    query = update.callback_query
+    if not is_teacher(query.from_user.id):
+        await query.answer("❌ Только преподаватель может списывать уроки", show_alert=True)
+        return
+    await query.answer()
+
+    lesson_ids = context.user_data.pop('charge_today', None)
+    if lesson_ids is None:
+        # Список потерян (например, после перезапуска) - показываем заново
+        await show_today_charges(update, context)
+        return
+
+    charges = charge_lessons(lesson_ids)
+    if not charges:
+        await query.edit_message_text("✅ Эти занятия уже списаны.")
+        return
+
+    by_student = {}
+    for charge in charges:
+        by_student.setdefault(charge['user_id'], []).append(charge)
+
+    queue_notifications(
+        context.application,
+        [(student_id, today_charge_notification(student_charges))
+         for student_id, student_charges in by_student.items()]
+    )
+
+    debt = sum(charge['lesson_price'] for charge in charges if not charge['from_prepaid'])
+    await query.edit_message_text(
+        f"✅ *Списано занятий: {len(charges)}*\n\n"
+        f"• Студентов: {len(by_student)}\n"
+        f"• Из предоплаты: {sum(1 for charge in charges if charge['from_prepaid'])}\n"
+        f"• В долг: {debt} руб.\n\n"
+        f"Уведомления студентам отправляются.",
+        parse_mode='Markdown'
+    )
+
+
 async def cancel_balance_management(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Отмена управления балансом"""
     query = update.callback_query
+    await query.answer()
     await query.edit_message_text("❌ Управление балансом отменено.")
+    # Очищаем все данные
+    for key in ['selected_student_id', 'current_action', 'charge_today', PICKER_STATE_KEY]:
+        if key in context.user_data:
+            del context.user_data[key]
 
 
 async def show_my_balance(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -558,112 +572,57 @@ async def show_my_balance(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ Эта функция только для студентов.")
         return
 
-    # Инициализируем баланс если его нет
-    init_student_balance(user_id)
-
-    balance = get_student_balance(user_id)
-    profile = get_user(user_id)
-    total_lessons = get_total_lessons_count(user_id)
+    # Одно обращение к представлению студента вместо запросов профиля, баланса и занятий
+    view = get_student_view(user_id)
 
     balance_text = (
         f"💰 *Ваш баланс*\n\n"
-        f"*ФИО:* {profile.get('fio', 'Не указано') if profile else 'Не указано'}\n"
-        f"*Инструмент:* {', '.join(profile.get('instruments', [])) if profile else 'Не указано'}\n\n"
+        f"*ФИО:* {view['fio']}\n"
+        f"*Инструмент:* {', '.join(view['instruments']) or 'Не указано'}\n\n"
         f"*Статистика уроков:*\n"
-        f"• Уроков осталось: {balance['lessons_left']} шт.\n"
-        f"• Всего занятий: {total_lessons} шт.\n"
+        f"• Уроков осталось: {view['lessons_left']} шт.\n"
+        f"• Всего занятий: {view['lessons_total']} шт.\n"
         f"*Финансы:*\n"
-        f"• Баланс: {get_balance_display(user_id)}\n"
-        f"• Цена урока: {balance.get('lesson_price', 2000)} руб.\n\n"
+        f"• Баланс: {format_balance(view['balance'])}\n"
+        f"• Цена урока: {view['lesson_price']} руб.\n\n"
     )
 
-    if balance.get('notes'):
-        balance_text += f"*Примечания преподавателя:*\n{balance['notes']}\n\n"
-
-    # Ближайшие занятия - ВСЕ, кроме созданных через "Списать урок"
-    from database import get_confirmed_lessons
-    lessons = get_confirmed_lessons(user_id)
-    if lessons:
-        # Фильтруем: пропускаем ТОЛЬКО списания урока
-        real_lessons = []
-        for lesson in lessons:
-            # Пропускаем ТОЛЬКО списания урока (через баланс)
-            slot_name = lesson.get('slot_name', '')
-            payment_type = lesson.get('payment_type', '')
-
-            # Если это списание урока через баланс (создано в charge_lesson)
-            if 'Ручное списание' in slot_name:
-                continue
+    if view['notes']:
+        balance_text += f"*Примечания преподавателя:*\n{view['notes']}\n\n"
 
-            real_lessons.append(lesson)
-
-        if real_lessons:
-            balance_text += "📅 *Ближайшие занятия:*\n"
-
-            # Сортируем по дате
-            def get_lesson_date(lesson):
-                """Получает дату занятия для сортировки"""
-                from datetime import datetime  # Импорт внутри функции
-
-                try:
-                    slot_name = lesson['slot_name']
-                    parts = slot_name.split()
-
-                    date_str = None
-                    time_str = None
-
-                    for part in parts:
-                        if '.' in part and len(part.split('.')) == 3:
-                            date_str = part
-                        elif ':' in part and len(part.split(':')) == 2:
-                            time_str = part
-
-                    if date_str and time_str:
-                        return datetime.strptime(f"{date_str} {time_str}", "%d.%m.%Y %H:%M")
-                except:
-                    return datetime.max
-
-                return datetime.max
-
-            # Сортируем занятия по дате (от ближайших к дальним)
-            real_lessons.sort(key=get_lesson_date)
-
-            # Показываем все занятия
-            for lesson in real_lessons:
-                balance_text += f"• {lesson['slot_name']}\n"
-        else:
-            balance_text += "📅 Пока нет запланированных занятий"
+    # Ближайшие занятия (без ручных списаний), уже отсортированы по времени
+    upcoming = get_upcoming_view_lessons(view)
+    if upcoming:
+        balance_text += "📅 *Ближайшие занятия:*\n"
+        for _, _, slot_name in upcoming:
+            balance_text += f"• {slot_name}\n"
     else:
         balance_text += "📅 Пока нет запланированных занятий"
 
     await update.message.reply_text(balance_text, parse_mode='Markdown')
 
 
-async def notify_student_about_balance_change(context: ContextTypes.DEFAULT_TYPE, student_id: int, change_type: str, details: str, amount: int = None):
-    """Отправляет уведомление студенту об изменении баланса"""
-    from database import get_user
-    from config import get_balance_display, get_student_balance, get_total_lessons_count
+def balance_summary(snapshot):
+    """Блок 'Текущий баланс' для уведомлений студенту"""
+    return (
+        f"*Текущий баланс:*\n"
+        f"• Уроков осталось: {snapshot.lessons_left} шт.\n"
+        f"• Всего занятий: {snapshot.total_lessons} шт.\n"
+        f"• Финансовый баланс: {snapshot.display}\n"
+        f"• Цена урока: {snapshot.lesson_price} руб.\n\n"
+    )
 
-    student_profile = get_user(student_id)
-    if not student_profile:
-        print(f"❌ Профиль студента {student_id} не найден для уведомления")
-        return
 
-    student_name = student_profile.get('fio', 'Студент')
-    balance = get_student_balance(student_id)
-    balance_display = get_balance_display(student_id)
-    total_lessons = get_total_lessons_count(student_id)
+async def notify_student_about_balance_change(context: ContextTypes.DEFAULT_TYPE, snapshot, change_type: str, details: str, amount: int = None):
+    """Отправляет уведомление студенту об изменении баланса (по снимку баланса после операции)"""
+    student_id = snapshot.user_id
 
     # Формируем уведомление в зависимости от типа изменения
     if change_type == "deposit_added":
         notification = (
             f"💰 *Баланс пополнен!*\n\n"
             f"На ваш баланс внесено: *{amount} руб.*\n\n"
-            f"*Текущий баланс:*\n"
-            f"• Финансовый баланс: {balance_display}\n"
-            f"• Уроков осталось: {balance['lessons_left']} шт.\n"
-            f"• Всего занятий: {total_lessons} шт.\n"
-            f"• Цена урока: {balance.get('lesson_price', 2000)} руб.\n\n"
+            f"{balance_summary(snapshot)}"
             f"Спасибо за оплату!"
         )
 
@@ -671,11 +630,7 @@ async def notify_student_about_balance_change(context: ContextTypes.DEFAULT_TYPE
         notification = (
             f"🎹 *Уроки добавлены!*\n\n"
             f"Вам добавлено: *{amount} уроков*\n\n"
-            f"*Текущий баланс:*\n"
-            f"• Уроков осталось: {balance['lessons_left']} шт.\n"
-            f"• Всего занятий: {total_lessons} шт.\n"
-            f"• Финансовый баланс: {balance_display}\n"
-            f"• Цена урока: {balance.get('lesson_price', 2000)} руб.\n\n"
+            f"{balance_summary(snapshot)}"
             f"Приятных занятий!"
         )
 
@@ -683,11 +638,7 @@ async def notify_student_about_balance_change(context: ContextTypes.DEFAULT_TYPE
         notification = (
             f"💲 *Изменена цена урока!*\n\n"
             f"Новая цена урока: *{amount} руб.*\n\n"
-            f"*Текущий баланс:*\n"
-            f"• Уроков осталось: {balance['lessons_left']} шт.\n"
-            f"• Всего занятий: {total_lessons} шт.\n"
-            f"• Финансовый баланс: {balance_display}\n"
-            f"• Цена урока: {balance.get('lesson_price', 2000)} руб.\n\n"
+            f"{balance_summary(snapshot)}"
             f"Все изменения согласованы с вами."
         )
 
@@ -695,11 +646,7 @@ async def notify_student_about_balance_change(context: ContextTypes.DEFAULT_TYPE
         notification = (
             f"📝 *Обновлено примечание!*\n\n"
             f"*Новое примечание:*\n{details}\n\n"
-            f"*Текущий баланс:*\n"
-            f"• Уроков осталось: {balance['lessons_left']} шт.\n"
-            f"• Всего занятий: {total_lessons} шт.\n"
-            f"• Финансовый баланс: {balance_display}\n"
-            f"• Цена урока: {balance.get('lesson_price', 2000)} руб.\n\n"
+            f"{balance_summary(snapshot)}"
             f"Если есть вопросы - обращайтесь!"
         )
 
@@ -718,17 +665,17 @@ async def notify_student_about_balance_change(context: ContextTypes.DEFAULT_TYPE
             text=notification,
             parse_mode='Markdown'
         )
-        print(f"✅ Уведомление отправлено студенту {student_id} ({student_name}) - {change_type}")
+        print(f"✅ Уведомление отправлено студенту {student_id} ({snapshot.fio}) - {change_type}")
     except Exception as e:
         print(f"❌ Не удалось отправить уведомление студенту {student_id}: {e}")
 
 
-# Регистрируем обработчики
-balance_handlers = [
-    # Callback handlers
-    CallbackQueryHandler(select_student, pattern="^balance_select_"),
-    CallbackQueryHandler(handle_action_choice, pattern="^balance_"),
-    CallbackQueryHandler(show_student_statistics, pattern="^balance_statistics$"),
-    CallbackQueryHandler(charge_lesson, pattern="^balance_charge_lesson$"),
-    CallbackQueryHandler(cancel_balance_management, pattern="^balance_cancel$"),
-]
\ No newline at end of file
+# Маршруты callback-кнопок баланса (пространство "b"), см. handlers/callback_router.py
+balance_callback_routes = {
+    's': select_student,
+    'a': handle_action_choice,
+    'y': charge_lesson,
+    't': show_today_charges,
+    'k': apply_today_charges,
+    'c': cancel_balance_management,
+}
\ No newline at end of file
@@ -0,0 +1,290 @@
+# bulk_balance.py
+"""
+Массовые операции с балансом: цена урока и пакет уроков для всех студентов
+инструмента (/bulk) и зачисление депозитов из CSV-выписки (файл .csv в чат).
+
+Преподаватель сначала видит, кого затронет операция, и подтверждает ее кнопкой.
+Операция выполняется одной транзакцией (executemany), уведомления студентам
+ставятся в очередь рассылки (utils/notifications.py).
+"""
+import csv
+import io
+import re
+
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.ext import ContextTypes, MessageHandler, filters
+
+from config import is_teacher, format_balance
+from database import get_student_ids, get_student_ids_by_fio, normalize_fio, \
+    add_lessons_bulk, set_price_bulk, add_deposits_bulk
+from handlers.profile_conversation import VALID_INSTRUMENTS
+from utils.callbacks import make_callback
+from utils.inflight import deduplicate_callback
+from utils.notifications import queue_notifications
+
+BULK_STATE_KEY = 'bulk_operation'
+# Максимальный размер CSV-выписки
+MAX_CSV_BYTES = 512 * 1024
+# Сколько нераспознанных строк выписки показывать
+MAX_SHOWN_ERRORS = 10
+
+INSTRUMENTS = sorted({instrument for names in VALID_INSTRUMENTS.values() for instrument in names})
+ALL_STUDENTS = 'все'
+
+BULK_USAGE = (
+    "📦 *Массовые операции с балансом*\n\n"
+    "`/bulk цена <инструмент> <сумма>` - цена урока для всех студентов инструмента\n"
+    "`/bulk уроки <инструмент> <кол-во>` - добавить пакет уроков\n"
+    f"Инструмент: {', '.join(INSTRUMENTS)} или `{ALL_STUDENTS}`.\n\n"
+    "📥 *Импорт депозитов:* отправьте файл .csv, в каждой строке - "
+    "Telegram ID или ФИО студента и сумма, например:\n"
+    "`Иванова Анна Сергеевна;3000`"
+)
+
+
+def bulk_keyboard():
+    return InlineKeyboardMarkup([[
+        InlineKeyboardButton("✅ Применить", callback_data=make_callback("b", "u")),
+        InlineKeyboardButton("❌ Отмена", callback_data=make_callback("b", "v")),
+    ]])
+
+
+async def bulk_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /bulk цена|уроки <инструмент|все> <число>: подготовка массовой операции"""
+    if not is_teacher(update.effective_user.id):
+        await update.message.reply_text("❌ Доступ запрещен. Эта функция только для преподавателей.")
+        return
+
+    args = context.args or []
+    if len(args) != 3 or args[0].lower() not in ('цена', 'уроки') or not args[2].isdigit() or int(args[2]) <= 0:
+        await update.message.reply_text(BULK_USAGE, parse_mode='Markdown')
+        return
+
+    action = 'price' if args[0].lower() == 'цена' else 'lessons'
+    amount = int(args[2])
+
+    if args[1].lower() == ALL_STUDENTS:
+        instrument = None
+    else:
+        instrument = next((name for name in INSTRUMENTS if name.lower() == args[1].lower()), None)
+        if not instrument:
+            await update.message.reply_text(f"❌ Неизвестный инструмент. Доступны: {', '.join(INSTRUMENTS)}.")
+            return
+
+    student_ids = get_student_ids(instrument)
+    if not student_ids:
+        await update.message.reply_text("📭 Нет студентов для этой операции.")
+        return
+
+    context.user_data[BULK_STATE_KEY] = {'action': action, 'student_ids': student_ids, 'amount': amount}
+
+    group = f"инструмент «{instrument}»" if instrument else "все студенты"
+    if action == 'price':
+        text = f"💲 *Новая цена урока: {amount} руб.*\n\n"
+    else:
+        text = f"➕ *Добавить по {amount} урок(ов)*\n\n"
+    text += f"Группа: {group}\nСтудентов: {len(student_ids)}\n\nПрименить?"
+
+    await update.message.reply_text(text, parse_mode='Markdown', reply_markup=bulk_keyboard())
+
+
+def parse_amount(value):
+    """Сумма из выписки: '3000', '3 000', '3000.00', '3000,00' -> 3000"""
+    value = re.sub(r'\s', '', value).replace(',', '.')
+    try:
+        amount = float(value)
+    except ValueError:
+        return None
+    return int(round(amount)) if amount > 0 else None
+
+
+# Разделители выписки по приоритету: ';' и табуляция не путаются с дробной запятой
+CSV_DELIMITERS = (';', '\t', ',')
+
+
+def split_csv(text, delimiter):
+    """Непустые строки выписки: [(номер строки, [ячейки])]"""
+    lines = []
+    for line_no, row in enumerate(csv.reader(io.StringIO(text), delimiter=delimiter), 1):
+        cells = [cell.strip() for cell in row if cell.strip()]
+        if cells:
+            lines.append((line_no, cells))
+    return lines
+
+
+def row_amount(cells):
+    return parse_amount(cells[-1]) if len(cells) >= 2 else None
+
+
+def detect_delimiter(text):
+    """Разделитель, при котором больше всего строк заканчиваются суммой.
+
+    Sniffer для '3000,00' выбирает запятую, поэтому разделитель проверяется по
+    результату разбора; при равенстве побеждает ';' или табуляция.
+    """
+    best, best_count = ';', -1
+    for delimiter in CSV_DELIMITERS:
+        if delimiter not in text:
+            continue
+        count = sum(1 for _, cells in split_csv(text, delimiter) if row_amount(cells) is not None)
+        if count > best_count:
+            best, best_count = delimiter, count
+    return best
+
+
+def parse_deposit_csv(text):
+    """Строки выписки -> ([(номер строки, ID или ФИО, сумма)], [номера нераспознанных строк])"""
+    rows = []
+    errors = []
+    for index, (line_no, cells) in enumerate(split_csv(text, detect_delimiter(text))):
+        amount = row_amount(cells)
+        if amount is None:
+            # Заголовок таблицы - только первая строка и без цифр, остальное - ошибка
+            if index > 0 or any(char.isdigit() for cell in cells for char in cell):
+                errors.append(line_no)
+            continue
+        rows.append((line_no, ' '.join(cells[:-1]), amount))
+
+    return rows, errors
+
+
+def resolve_deposits(rows):
+    """Сопоставляет строки выписки со студентами: ([(user_id, сумма)], [(строка, причина)])"""
+    student_ids = set(get_student_ids())
+    by_fio = get_student_ids_by_fio(key for _, key, _ in rows if not key.isdigit())
+
+    deposits = []
+    errors = []
+    for line_no, key, amount in rows:
+        if key.isdigit():
+            matches = [int(key)] if int(key) in student_ids else []
+        else:
+            matches = by_fio.get(normalize_fio(key), [])
+
+        if len(matches) == 1:
+            deposits.append((matches[0], amount))
+        elif matches:
+            errors.append((line_no, f"несколько студентов «{key}»"))
+        else:
+            errors.append((line_no, f"студент «{key}» не найден"))
+
+    return deposits, errors
+
+
+async def handle_deposit_csv(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Файл .csv от преподавателя: разбор выписки и подтверждение зачисления депозитов"""
+    if not is_teacher(update.effective_user.id):
+        return
+
+    document = update.message.document
+    if document.file_size and document.file_size > MAX_CSV_BYTES:
+        await update.message.reply_text("❌ Файл слишком большой.")
+        return
+
+    data = bytes(await (await document.get_file()).download_as_bytearray())
+    try:
+        text = data.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        # Выгрузки банков и Excel часто в Windows-1251
+        text = data.decode('cp1251', errors='replace')
+
+    rows, bad_lines = parse_deposit_csv(text)
+    deposits, errors = resolve_deposits(rows)
+    errors = sorted(errors + [(line_no, "не удалось разобрать строку") for line_no in bad_lines])
+
+    if not deposits:
+        await update.message.reply_text(
+            "📭 В файле не найдено ни одного депозита.\n\n" + BULK_USAGE, parse_mode='Markdown')
+        return
+
+    context.user_data[BULK_STATE_KEY] = {'action': 'deposit', 'deposits': deposits}
+
+    # Имена из файла выводятся как есть, поэтому без Markdown
+    text = (
+        f"📥 Импорт депозитов\n\n"
+        f"• Строк к зачислению: {len(deposits)}\n"
+        f"• Студентов: {len({student_id for student_id, _ in deposits})}\n"
+        f"• Сумма: {sum(amount for _, amount in deposits)} руб.\n"
+    )
+    if errors:
+        text += f"\n⚠️ Пропущено строк: {len(errors)}\n"
+        for line_no, reason in errors[:MAX_SHOWN_ERRORS]:
+            text += f"• строка {line_no}: {reason}\n"
+        if len(errors) > MAX_SHOWN_ERRORS:
+            text += f"• ... и еще {len(errors) - MAX_SHOWN_ERRORS}\n"
+    text += "\nЗачислить?"
+
+    await update.message.reply_text(text, reply_markup=bulk_keyboard())
+
+
+def bulk_notification(action, balance, amount):
+    """Уведомление студенту о массовом изменении баланса"""
+    if action == 'deposit':
+        header = f"💰 *Баланс пополнен!*\n\nНа ваш баланс внесено: *{amount} руб.*\n\n"
+    elif action == 'lessons':
+        header = f"🎹 *Уроки добавлены!*\n\nВам добавлено: *{amount} уроков*\n\n"
+    else:
+        header = f"💲 *Изменена цена урока!*\n\nНовая цена урока: *{amount} руб.*\n\n"
+
+    return header + (
+        f"*Текущий баланс:*\n"
+        f"• Уроков осталось: {balance['lessons_left']} шт.\n"
+        f"• Финансовый баланс: {format_balance(balance['balance'])}\n"
+        f"• Цена урока: {balance['lesson_price']} руб."
+    )
+
+
+@deduplicate_callback
+async def apply_bulk_operation(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Выполняет подготовленную массовую операцию (b:u)"""
+    query = update.callback_query
+    if not is_teacher(query.from_user.id):
+        await query.answer("❌ Только преподаватель может менять баланс", show_alert=True)
+        return
+    await query.answer()
+
+    operation = context.user_data.pop(BULK_STATE_KEY, None)
+    if not operation:
+        await query.edit_message_text("❌ Операция устарела. Повторите команду /bulk или отправьте файл заново.")
+        return
+
+    action = operation['action']
+    if action == 'deposit':
+        amounts = {}
+        for student_id, amount in operation['deposits']:
+            amounts[student_id] = amounts.get(student_id, 0) + amount
+        balances = add_deposits_bulk(operation['deposits'])
+        result = f"✅ Зачислено {sum(amounts.values())} руб. на балансы {len(balances)} студентов."
+    else:
+        amount = operation['amount']
+        amounts = dict.fromkeys(operation['student_ids'], amount)
+        if action == 'price':
+            balances = set_price_bulk(operation['student_ids'], amount)
+            result = f"✅ Цена урока {amount} руб. установлена для {len(balances)} студентов."
+        else:
+            balances = add_lessons_bulk(operation['student_ids'], amount)
+            result = f"✅ Добавлено по {amount} урок(ов) {len(balances)} студентам."
+
+    queue_notifications(
+        context.application,
+        [(student_id, bulk_notification(action, balance, amounts[student_id]))
+         for student_id, balance in balances.items()]
+    )
+
+    await query.edit_message_text(result + "\nУведомления студентам отправляются.")
+
+
+async def cancel_bulk_operation(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Отмена массовой операции (b:v)"""
+    query = update.callback_query
+    await query.answer()
+    context.user_data.pop(BULK_STATE_KEY, None)
+    await query.edit_message_text("❌ Массовая операция отменена.")
+
+
+deposit_csv_handler = MessageHandler(filters.Document.FileExtension("csv"), handle_deposit_csv)
+
+bulk_callback_routes = {
+    'u': apply_bulk_operation,
+    'v': cancel_bulk_operation,
+}
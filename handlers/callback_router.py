@@ -0,0 +1,55 @@
+# callback_router.py
+"""
+Единый маршрутизатор callback-кнопок вне диалогов (ConversationHandler).
+
+Пространства имен callback_data:
+    x - пустая кнопка
+    s - выбор расписания студентом
+    c - подтверждение заявки преподавателем
+    a - автоподбор слотов
+    b - управление балансом
+    p - листание и фильтры списка выбора студента
+    w - предложение слота из листа ожидания
+
+Кнопки внутри диалогов (lesson_mgmt_, student_mgmt_, teacher_chat_, edit_)
+обрабатываются своими ConversationHandler. Кнопки, которые не принял никто,
+получают ответ stale_button_handler, чтобы у пользователя не зависали «часики».
+"""
+from telegram import Update
+from telegram.ext import ContextTypes, CallbackQueryHandler
+from utils.callbacks import CallbackRouter
+from handlers.schedule import schedule_callback_routes, confirmation_callback_routes, \
+    auto_assign_callback_routes
+from handlers.balance import balance_callback_routes
+from handlers.bulk_balance import bulk_callback_routes
+from handlers.student_picker import picker_callback_routes
+from handlers.waitlist import waitlist_callback_routes
+
+
+async def answer_ignore(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Пустая кнопка: только снимаем «часики»"""
+    await update.callback_query.answer()
+
+
+async def answer_stale_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Кнопка, которую не обработал ни один маршрут (старые сообщения, завершенный диалог)"""
+    await update.callback_query.answer("Кнопка устарела, откройте меню заново", show_alert=True)
+
+
+# Регистрируется последним среди обработчиков callback-кнопок
+stale_button_handler = CallbackQueryHandler(answer_stale_button)
+
+callback_router = CallbackRouter()
+callback_router.add('x', '', answer_ignore)
+
+for namespace, routes in (
+        ('s', schedule_callback_routes),
+        ('c', confirmation_callback_routes),
+        ('a', auto_assign_callback_routes),
+        ('b', balance_callback_routes),
+        ('b', bulk_callback_routes),
+        ('p', picker_callback_routes),
+        ('w', waitlist_callback_routes),
+):
+    for action, handler in routes.items():
+        callback_router.add(namespace, action, handler)
@@ -1,7 +1,7 @@
 # feedback.py
 from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove
 from telegram.ext import ContextTypes, MessageHandler, filters, ConversationHandler
-from config import TEACHER_IDS, get_user_role, is_teacher
+from config import TEACHER_IDS, get_user_role, is_teacher, CONVERSATION_TIMEOUT
 from database import get_user
 
 # Состояния для обратной связи
@@ -139,5 +139,8 @@ feedback_conversation = ConversationHandler(
         MessageHandler(filters.Regex("^В главное меню$"), cancel_feedback),
         MessageHandler(filters.Regex("^/cancel$"), cancel_feedback)
     ],
-    per_message=False
+    per_message=False,
+    name="feedback",
+    persistent=True,
+    conversation_timeout=CONVERSATION_TIMEOUT
 )
\ No newline at end of file
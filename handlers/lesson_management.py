@@ -1,38 +1,57 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup
 from telegram.ext import ContextTypes, CallbackQueryHandler, MessageHandler, filters, ConversationHandler, CommandHandler
-from config import is_teacher, get_student_balance, get_balance_display
-from database import get_user, get_confirmed_lessons, save_confirmed_lesson, delete_confirmed_lesson_by_slot, \
-    get_all_users
+from config import is_teacher, get_student_balance, get_balance_display, get_occupancy_between, \
+    SCHEDULE_GRID, CONVERSATION_TIMEOUT, WEEKDAY_NAMES, get_month_lesson_counts
+from database import get_user, get_confirmed_lessons, save_confirmed_lesson, delete_confirmed_lesson, \
+    get_confirmed_lessons_by_ids, save_lesson_series
 from datetime import datetime, timedelta
 import calendar
 import re
 from functools import wraps
+from utils.inflight import deduplicate_callback
+from handlers.student_picker import StudentPicker
 
 # Состояния для ConversationHandler
 LESSON_MANAGEMENT_SELECT_STUDENT, LESSON_MANAGEMENT_MAIN, LESSON_MANAGEMENT_CANCEL, \
     LESSON_MANAGEMENT_ADD_SELECT_MONTH, LESSON_MANAGEMENT_ADD_SELECT_DAY, \
     LESSON_MANAGEMENT_ADD_SELECT_TIME, LESSON_MANAGEMENT_ADD_CONFIRM = range(7)
 
-# Времена занятий с 13:00 до 22:00
-AVAILABLE_TIMES = [
-    "13:00", "14:00", "15:00", "16:00", "17:00",
-    "18:00", "19:00", "20:00", "21:00", "22:00"
-]
+# Времена занятий берутся из сетки расписания (config.py)
+AVAILABLE_TIMES = SCHEDULE_GRID.times
 
-# Словарь для отслеживания активных обработок
-active_processing = {}
+# Отметки загрузки дня в календаре: нет занятий / есть свободное время / все занято
+DAY_LOAD_MARKS = ("🟢", "🟡", "🔴")
+
+# Варианты длины еженедельной серии занятий (недель)
+SERIES_WEEKS_OPTIONS = (4, 8, 12, 16)
+
+def lesson_picker_button_text(student):
+    """Кнопка студента: ФИО и число занятий"""
+    if student['lessons_count']:
+        return f"{student['fio']} 📅({student['lessons_count']})"
+    return student['fio']
+
+
+# Постраничный список студентов с поиском (handlers/student_picker.py)
+lesson_student_picker = StudentPicker(
+    "l",
+    "🎹 *Управление занятиями*\n\nВыберите студента:",
+    select_callback=lambda student_id: f"lesson_mgmt_select_{student_id}",
+    cancel_callback="lesson_mgmt_cancel",
+    button_text=lesson_picker_button_text
+)
 
 
 def prevent_double_click(func):
-    """Упрощенный декоратор для предотвращения двойного нажатия"""
+    """Декоратор для предотвращения двойного нажатия (см. utils/inflight.py)"""
+    guarded = deduplicate_callback(func)
 
     @wraps(func)
     async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE, *args, **kwargs):
-        # Без сложной логики определения user_id
         try:
-            return await func(update, context, *args, **kwargs)
+            return await guarded(update, context, *args, **kwargs)
         except Exception as e:
-            # Логируем ошибку, но не блокируем повторные нажатия
+            # Логируем ошибку; после ошибки повторное нажатие снова разрешено
             print(f"Error in {func.__name__}: {e}")
 
     return wrapper
@@ -96,35 +115,6 @@ async def start_lesson_management(update: Update, context: ContextTypes.DEFAULT_
     # СБРАСЫВАЕМ состояние перед началом
     check_and_reset_conversation(user_id, context)
 
-    # Получаем список студентов из БД
-    students_data = get_all_users(role='student')
-    students = {}
-    for student in students_data:
-        if student.get('fio'):
-            students[student['user_id']] = student
-
-    if not students:
-        await update.message.reply_text("📭 Пока нет зарегистрированных студентов.")
-        return ConversationHandler.END
-
-    # Создаем клавиатуру со студентами
-    keyboard = []
-    for student_id, profile in students.items():
-        # Проверяем есть ли у студента занятия
-        lessons = get_confirmed_lessons(student_id)
-        has_lessons = len(lessons) > 0
-        lesson_count = len(lessons)
-
-        button_text = f"{profile['fio']}"
-        if has_lessons:
-            button_text += f" 📅({lesson_count})"
-
-        keyboard.append([InlineKeyboardButton(button_text, callback_data=f"lesson_mgmt_select_{student_id}")])
-
-    keyboard.append([InlineKeyboardButton("❌ Отмена", callback_data="lesson_mgmt_cancel")])
-
-    reply_markup = InlineKeyboardMarkup(keyboard)
-
     # ОЧИЩАЕМ предыдущее состояние ConversationHandler
     # Это важно: нужно завершить старый ConversationHandler
     current_state = context.user_data.get('_conversation_state')
@@ -133,12 +123,7 @@ async def start_lesson_management(update: Update, context: ContextTypes.DEFAULT_
         context.user_data.pop('_conversation_state', None)
         await update.message.reply_text("🔄 Сбрасываю предыдущее состояние...")
 
-    await update.message.reply_text(
-        "🎹 *Управление занятиями*\n\n"
-        "Выберите студента:",
-        parse_mode='Markdown',
-        reply_markup=reply_markup
-    )
+    await lesson_student_picker.show(context, message=update.message)
 
     return LESSON_MANAGEMENT_SELECT_STUDENT
 
@@ -221,8 +206,8 @@ async def show_student_lessons_menu(query, context, student_id: int):
         for i, lesson in enumerate(future_lessons, 1):
             lessons_text += f"{i}. {lesson['slot_name']}\n"
 
-        # Сохраняем занятия для дальнейшего использования
-        context.user_data['future_lessons'] = future_lessons
+        # Сохраняем только ID занятий - сами занятия перечитываются из БД при отмене
+        context.user_data['future_lessons'] = tuple(lesson['id'] for lesson in future_lessons)
     else:
         lessons_text = "📭 *Нет запланированных занятий*\n\n"
 
@@ -306,43 +291,13 @@ async def handle_lesson_management_choice(update: Update, context: ContextTypes.
 
 async def start_lesson_management_from_query(query, context):
     """Запуск управления занятиями из callback query"""
-    # Получаем список студентов из БД
-    students_data = get_all_users(role='student')
-    students = {}
-    for student in students_data:
-        if student.get('fio'):
-            students[student['user_id']] = student
-
-    # Создаем клавиатуру со студентами
-    keyboard = []
-    for student_id, profile in students.items():
-        # Проверяем есть ли у студента занятия
-        lessons = get_confirmed_lessons(student_id)
-        has_lessons = len(lessons) > 0
-        lesson_count = len(lessons)
-
-        button_text = f"{profile['fio']}"
-        if has_lessons:
-            button_text += f" 📅({lesson_count})"
-
-        keyboard.append([InlineKeyboardButton(button_text, callback_data=f"lesson_mgmt_select_{student_id}")])
-
-    keyboard.append([InlineKeyboardButton("❌ Отмена", callback_data="lesson_mgmt_cancel")])
-
-    reply_markup = InlineKeyboardMarkup(keyboard)
-
-    await query.edit_message_text(
-        "🎹 *Управление занятиями*\n\n"
-        "Выберите студента:",
-        parse_mode='Markdown',
-        reply_markup=reply_markup
-    )
+    await lesson_student_picker.show(context, query=query)
 
 
 @prevent_double_click
 async def show_cancel_lesson_menu(query, context, student_id: int):
     """Показывает меню для отмены занятий"""
-    future_lessons = context.user_data.get('future_lessons', [])
+    future_lessons = get_confirmed_lessons_by_ids(context.user_data.get('future_lessons', ()))
 
     if not future_lessons:
         await query.answer("Нет занятий для отмены", show_alert=True)
@@ -352,7 +307,7 @@ async def show_cancel_lesson_menu(query, context, student_id: int):
     for i, lesson in enumerate(future_lessons, 1):
         keyboard.append([InlineKeyboardButton(
             f"❌ {lesson['slot_name']}",
-            callback_data=f"lesson_cancel_{i - 1}"  # Сохраняем индекс занятия
+            callback_data=f"lesson_cancel_{lesson['id']}"
         )])
 
     keyboard.append([InlineKeyboardButton("◀️ Назад", callback_data="lesson_mgmt_back_to_menu")])
@@ -380,16 +335,18 @@ async def cancel_lesson(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return LESSON_MANAGEMENT_MAIN
 
     if query.data.startswith("lesson_cancel_"):
-        lesson_index = int(query.data.split("_")[2])
+        lesson_id = int(query.data.split("_")[2])
         student_id = context.user_data.get('lesson_mgmt_student_id')
 
-        future_lessons = context.user_data.get('future_lessons', [])
+        if lesson_id not in context.user_data.get('future_lessons', ()):
+            return LESSON_MANAGEMENT_CANCEL
 
-        if 0 <= lesson_index < len(future_lessons):
-            lesson = future_lessons[lesson_index]
+        lessons = get_confirmed_lessons_by_ids((lesson_id,))
+        if lessons:
+            lesson = lessons[0]
 
             # 1. Удаляем занятие из БД
-            delete_confirmed_lesson_by_slot(student_id, lesson.get('slot_id', ''))
+            delete_confirmed_lesson(lesson_id)
 
             # 2. Уведомляем студента
             student_profile = get_user(student_id) or {}
@@ -441,10 +398,15 @@ async def show_month_selection(query, context):
     keyboard = []
     row = []
 
+    months = [
+        (current_year + (current_month + i - 1) // 12, (current_month + i - 1) % 12 + 1)
+        for i in range(12)
+    ]
+    # Число занятий по месяцам: один запрос на весь год (или кэш)
+    month_counts = get_month_lesson_counts(months)
+
     # Показываем месяцы на 12 месяцев вперед
-    for i in range(12):
-        month_num = (current_month + i - 1) % 12 + 1
-        year = current_year + (current_month + i - 1) // 12
+    for year, month_num in months:
 
         month_name = [
             "Январь", "Февраль", "Март", "Апрель", "Май", "Июнь",
@@ -453,8 +415,9 @@ async def show_month_selection(query, context):
 
         # Показываем только будущие месяцы (включая текущий)
         if year > current_year or (year == current_year and month_num >= current_month):
+            lessons = sum(month_counts[(year, month_num)].values())
             row.append(InlineKeyboardButton(
-                f"{month_name} {year}",
+                f"{month_name} {year}" + (f" · {lessons}" if lessons else ""),
                 callback_data=f"lesson_add_month_{month_num:02d}_{year}"
             ))
 
@@ -471,7 +434,8 @@ async def show_month_selection(query, context):
 
     await query.edit_message_text(
         "📅 *Добавление занятия*\n\n"
-        "Выберите месяц (доступно на год вперед):",
+        "Выберите месяц (доступно на год вперед).\n"
+        "Число рядом с месяцем - уже запланировано занятий:",
         parse_mode='Markdown',
         reply_markup=reply_markup
     )
@@ -513,6 +477,10 @@ async def show_day_selection(query, context, month: int, year: int):
 
     now = datetime.now()
 
+    # Занятия по дням месяца из кэша (один запрос после изменения расписания)
+    day_counts = get_month_lesson_counts([(year, month)])[(year, month)]
+    slots_per_day = len(AVAILABLE_TIMES)
+
     for day in range(1, days_in_month + 1):
         date_obj = datetime(year, month, day)
 
@@ -527,7 +495,11 @@ async def show_day_selection(query, context, month: int, year: int):
             "Fri": "Пт", "Sat": "Сб", "Sun": "Вс"
         }.get(weekday, weekday)
 
-        button_text = f"{day} ({weekday_rus})"
+        # Загрузка дня: занято / всего слотов
+        busy = day_counts.get(date_obj.date(), 0)
+        mark = DAY_LOAD_MARKS[0 if not busy else 1 if busy < slots_per_day else 2]
+
+        button_text = f"{mark}{day} {weekday_rus} {busy}/{slots_per_day}"
 
         row.append(InlineKeyboardButton(
             button_text,
@@ -555,7 +527,9 @@ async def show_day_selection(query, context, month: int, year: int):
     await query.edit_message_text(
         f"📅 *Добавление занятия*\n\n"
         f"*Месяц:* {month_name} {year}\n"
-        f"Выберите день (доступны только будущие даты):",
+        f"Выберите день (доступны только будущие даты).\n"
+        f"{DAY_LOAD_MARKS[0]} свободно, {DAY_LOAD_MARKS[1]} есть занятия, {DAY_LOAD_MARKS[2]} все занято; "
+        f"число - занято/всего слотов",
         parse_mode='Markdown',
         reply_markup=reply_markup
     )
@@ -584,29 +558,21 @@ async def select_day_for_lesson(update: Update, context: ContextTypes.DEFAULT_TY
 
 @prevent_double_click
 async def show_time_selection(query, context, year: int, month: int, day: int):
-    """Показывает выбор времени для занятия (13:00-22:00)"""
+    """Показывает выбор времени для занятия по сетке расписания"""
     date_obj = datetime(year, month, day)
     date_str = date_obj.strftime("%d.%m.%Y")
 
-    # Проверяем, не занято ли время другими студентами
-    occupied_times = set()
-    all_lessons = get_confirmed_lessons()  # Все занятия из БД
-
-    for lesson in all_lessons:
-        if date_str in lesson['slot_name']:
-            # Извлекаем время из названия занятия
-            parts = lesson['slot_name'].split()
-            for part in parts:
-                if ':' in part:
-                    occupied_times.add(part)
-                    break
+    # Проверяем, не занято ли время другими студентами: свободные слоты дня из битовой маски
+    day = date_obj.date()
+    day_mask = get_occupancy_between(day, day + timedelta(days=1)).get(day, 0)
+    free_indexes = set(SCHEDULE_GRID.free_windows(day_mask))
 
-    # Создаем клавиатуру с временами (13:00-22:00)
+    # Создаем клавиатуру с временами
     keyboard = []
     row = []
 
-    for time_slot in AVAILABLE_TIMES:
-        is_occupied = time_slot in occupied_times
+    for index, time_slot in enumerate(AVAILABLE_TIMES):
+        is_occupied = index not in free_indexes
 
         if is_occupied:
             button_text = f"⛔ {time_slot}"
@@ -637,7 +603,7 @@ async def show_time_selection(query, context, year: int, month: int, day: int):
     await query.edit_message_text(
         f"🕐 *Добавление занятия*\n\n"
         f"*Дата:* {weekday_rus} {date_str}\n"
-        f"Выберите время (13:00-22:00):\n"
+        f"Выберите время ({SCHEDULE_GRID.describe_hours()}):\n"
         f"⛔ - время занято другим студентом",
         parse_mode='Markdown',
         reply_markup=reply_markup
@@ -687,6 +653,7 @@ async def select_time_for_lesson(update: Update, context: ContextTypes.DEFAULT_T
                 InlineKeyboardButton("✅ Подтвердить", callback_data="lesson_add_confirm"),
                 InlineKeyboardButton("❌ Отменить", callback_data="lesson_add_cancel")
             ],
+            [InlineKeyboardButton("🔁 Повторять каждую неделю", callback_data="lesson_add_series")],
             [InlineKeyboardButton("◀️ Назад к выбору времени", callback_data="lesson_add_back_to_time")]
         ]
 
@@ -729,6 +696,19 @@ async def confirm_add_lesson(update: Update, context: ContextTypes.DEFAULT_TYPE)
         await show_student_lessons_menu(query, context, student_id)
         return LESSON_MANAGEMENT_MAIN
 
+    elif query.data == "lesson_add_series":
+        await show_series_weeks_selection(query, context)
+        return LESSON_MANAGEMENT_ADD_CONFIRM
+
+    elif query.data.startswith("lesson_add_weeks_"):
+        context.user_data['series_weeks'] = int(query.data.split("_")[3])
+        await show_series_preview(query, context)
+        return LESSON_MANAGEMENT_ADD_CONFIRM
+
+    elif query.data == "lesson_add_series_confirm":
+        await confirm_add_series(query, context)
+        return LESSON_MANAGEMENT_ADD_CONFIRM
+
     elif query.data == "lesson_add_confirm":
         student_id = context.user_data.get('lesson_mgmt_student_id')
         full_slot_name = context.user_data.get('full_slot_name')
@@ -738,9 +718,11 @@ async def confirm_add_lesson(update: Update, context: ContextTypes.DEFAULT_TYPE)
             await query.edit_message_text("❌ Ошибка: не все данные заполнены.")
             return ConversationHandler.END
 
-        # Генерируем уникальный slot_id
-        from datetime import datetime
-        slot_id = f"manual_{datetime.now().timestamp()}"
+        # ID слота по сетке расписания (дата + время)
+        year = context.user_data.get('selected_year')
+        month = context.user_data.get('selected_month')
+        day = context.user_data.get('selected_day')
+        slot_id = SCHEDULE_GRID.slot_id(datetime(year, month, day), selected_time)
 
         # Сохраняем занятие в БД
         save_confirmed_lesson({
@@ -769,7 +751,6 @@ async def confirm_add_lesson(update: Update, context: ContextTypes.DEFAULT_TYPE)
         cancellation_date = "предыдущего дня"
         if lesson_date:
             try:
-                from datetime import datetime, timedelta
                 lesson_datetime = datetime.strptime(lesson_date, "%d.%m.%Y")
                 previous_day = lesson_datetime - timedelta(days=1)
                 cancellation_date = previous_day.strftime("%d.%m")
@@ -816,6 +797,161 @@ async def confirm_add_lesson(update: Update, context: ContextTypes.DEFAULT_TYPE)
         return LESSON_MANAGEMENT_ADD_CONFIRM
 
 
+def get_series_start(context):
+    """Первое занятие серии (дата) и время из выбранных в диалоге"""
+    day = datetime(
+        context.user_data['selected_year'],
+        context.user_data['selected_month'],
+        context.user_data['selected_day']
+    ).date()
+    return day, context.user_data['selected_time']
+
+
+def get_series_dates(first_day, weeks):
+    return [first_day + timedelta(weeks=i) for i in range(weeks)]
+
+
+def split_series_dates(dates, time_slot, occupancy):
+    """Даты серии по карте занятости: (свободные даты, занятые даты)"""
+    index = SCHEDULE_GRID.slot_index(time_slot)
+
+    free_dates, busy_dates = [], []
+    for day in dates:
+        if index in SCHEDULE_GRID.free_windows(occupancy.get(day, 0)):
+            free_dates.append(day)
+        else:
+            busy_dates.append(day)
+    return free_dates, busy_dates
+
+
+def plan_lesson_series(first_day, time_slot, weeks):
+    """
+    Даты еженедельной серии с first_day: (свободные даты, занятые даты).
+    Занятость всех дат проверяется одним запросом по индексу starts_at.
+    """
+    dates = get_series_dates(first_day, weeks)
+    occupancy = get_occupancy_between(dates[0], dates[-1] + timedelta(days=1))
+    return split_series_dates(dates, time_slot, occupancy)
+
+
+async def show_series_weeks_selection(query, context):
+    """Выбор длины еженедельной серии"""
+    first_day, time_slot = get_series_start(context)
+
+    keyboard = [
+        [InlineKeyboardButton(f"{weeks} нед.", callback_data=f"lesson_add_weeks_{weeks}")
+         for weeks in SERIES_WEEKS_OPTIONS],
+        [InlineKeyboardButton("◀️ Назад к выбору времени", callback_data="lesson_add_back_to_time")]
+    ]
+
+    await query.edit_message_text(
+        f"🔁 *Еженедельная серия занятий*\n\n"
+        f"*Каждый:* {WEEKDAY_NAMES[first_day.weekday()]} в {time_slot}\n"
+        f"*Начиная с:* {first_day.strftime('%d.%m.%Y')}\n\n"
+        f"Сколько недель?",
+        parse_mode='Markdown',
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+
+
+async def show_series_preview(query, context):
+    """Даты серии с отметкой занятых и кнопкой добавления свободных"""
+    first_day, time_slot = get_series_start(context)
+    weeks = context.user_data['series_weeks']
+    free_dates, busy_dates = plan_lesson_series(first_day, time_slot, weeks)
+
+    student_profile = get_user(context.user_data.get('lesson_mgmt_student_id')) or {}
+    busy = set(busy_dates)
+
+    text = (
+        f"🔁 *Серия: {WEEKDAY_NAMES[first_day.weekday()]} {time_slot}, {weeks} нед.*\n\n"
+        f"*Студент:* {student_profile.get('fio', 'Студент')}\n\n"
+    )
+    for day in sorted(free_dates + busy_dates):
+        mark = "⛔" if day in busy else "✅"
+        text += f"{mark} {day.strftime('%d.%m.%Y')}\n"
+    if busy_dates:
+        text += f"\n⛔ - время занято, эти даты будут пропущены ({len(busy_dates)})\n"
+
+    keyboard = []
+    if free_dates:
+        keyboard.append([InlineKeyboardButton(
+            f"✅ Добавить {len(free_dates)} занятий", callback_data="lesson_add_series_confirm")])
+    keyboard.append([InlineKeyboardButton("◀️ Назад", callback_data="lesson_add_series")])
+
+    await query.edit_message_text(text, parse_mode='Markdown', reply_markup=InlineKeyboardMarkup(keyboard))
+
+
+async def confirm_add_series(query, context):
+    """Добавляет свободные даты серии одной транзакцией и отправляет студенту одно уведомление"""
+    student_id = context.user_data.get('lesson_mgmt_student_id')
+    weeks = context.user_data.pop('series_weeks', None)
+    if not student_id or not weeks:
+        await query.edit_message_text("❌ Ошибка: не все данные заполнены.")
+        return
+
+    first_day, time_slot = get_series_start(context)
+    dates = get_series_dates(first_day, weeks)
+
+    def find_free_slots(range_lessons):
+        # Занятость проверяется заново внутри транзакции записи: за время просмотра слоты могли занять
+        free_dates, _ = split_series_dates(dates, time_slot, SCHEDULE_GRID.build_occupancy(range_lessons))
+        return {SCHEDULE_GRID.slot_id(day, time_slot) for day in free_dates}
+
+    date_added = datetime.now().strftime('%d.%m.%Y %H:%M')
+    lessons_data = []
+    for day in dates:
+        slot_id = SCHEDULE_GRID.slot_id(day, time_slot)
+        lessons_data.append({
+            'user_id': student_id,
+            'slot_id': slot_id,
+            'slot_name': SCHEDULE_GRID.slot_label(slot_id),
+            'confirmed_by': query.from_user.id,
+            'date_added': date_added,
+            'payment_type': "Оплата обсуждается с преподавателем",
+            'is_manual': True
+        })
+
+    lessons, skipped_slots = save_lesson_series(lessons_data, find_free_slots)
+    slot_names = [lesson['slot_name'] for lesson in lessons]
+    busy_dates = [SCHEDULE_GRID.parse_slot_id(slot_id)[0] for slot_id in skipped_slots]
+
+    if lessons:
+        notification = (
+            f"✅ *Добавлены регулярные занятия!*\n\n"
+            f"*Каждый {WEEKDAY_NAMES[first_day.weekday()]} в {time_slot}:*\n"
+            + "".join(f"• {name}\n" for name in slot_names) +
+            "\n*Адрес:*\n"
+            "4-й Сыромятнический переулок, 3/5с3\n"
+            "[Яндекс Карты](https://yandex.ru/maps/-/CPAfq2lq)\n\n"
+            "*Примечание:* Оплата будет обсуждена отдельно с преподавателем.\n\n"
+            "ℹ️ *Бесплатная отмена урока доступна НЕ позже 10:00 предыдущего дня*\n\n"
+            "По всем вопросам обращайтесь к преподавателю."
+        )
+        try:
+            await context.bot.send_message(
+                chat_id=student_id,
+                text=notification,
+                parse_mode='Markdown',
+                disable_web_page_preview=True
+            )
+        except Exception as e:
+            print(f"Ошибка уведомления студента: {e}")
+
+    text = f"✅ *Добавлено занятий: {len(lessons)}*\n\n"
+    if busy_dates:
+        text += "⛔ Пропущены (время занято): " + ", ".join(day.strftime('%d.%m') for day in busy_dates) + "\n\n"
+    text += (
+        "⚠️ *Важно!* Уроки НЕ списаны с баланса автоматически.\n"
+        "Для списания средств используйте '💰 Управление балансом'."
+    )
+    if lessons:
+        text += "\n\nСтудент уведомлен."
+
+    keyboard = [[InlineKeyboardButton("➡️ Далее", callback_data="lesson_mgmt_back_to_menu")]]
+    await query.edit_message_text(text, parse_mode='Markdown', reply_markup=InlineKeyboardMarkup(keyboard))
+
+
 @prevent_double_click
 async def show_student_balance(query, context, student_id: int):
     """Показывает баланс студента"""
@@ -858,11 +994,15 @@ async def cancel_lesson_management(update: Update, context: ContextTypes.DEFAULT
 lesson_management_conversation = ConversationHandler(
     entry_points=[
         MessageHandler(filters.Regex("^✏️ Управление занятиями$"), start_lesson_management),
-        CommandHandler("cancel_lessons", force_cancel_lesson_management)  # Добавьте эту строку
+        CommandHandler("cancel_lessons", force_cancel_lesson_management),  # Добавьте эту строку
+        # Переход к студенту из результатов поиска /find
+        CallbackQueryHandler(select_student_for_management, pattern=r"^lesson_mgmt_select_\d+$")
     ],
     states={
         LESSON_MANAGEMENT_SELECT_STUDENT: [
-            CallbackQueryHandler(select_student_for_management, pattern="^lesson_mgmt_")
+            CallbackQueryHandler(select_student_for_management, pattern="^lesson_mgmt_"),
+            lesson_student_picker.callback_handler(),
+            lesson_student_picker.search_handler()
         ],
         LESSON_MANAGEMENT_MAIN: [
             CallbackQueryHandler(handle_lesson_management_choice, pattern="^lesson_mgmt_")
@@ -890,5 +1030,8 @@ lesson_management_conversation = ConversationHandler(
         CallbackQueryHandler(lambda update, context: update.callback_query.answer(), pattern="^ignore$")
     ],
     per_message=False,
-    allow_reentry=True  # ВАЖНО: разрешаем повторный вход
+    allow_reentry=True,  # ВАЖНО: разрешаем повторный вход
+    name="lesson_management",
+    persistent=True,
+    conversation_timeout=CONVERSATION_TIMEOUT
 )
\ No newline at end of file
@@ -1,10 +1,13 @@
 from telegram import Update, ReplyKeyboardMarkup
 from telegram.ext import ContextTypes, MessageHandler, filters
-from config import get_user_role, is_teacher
+from config import is_teacher
 from database import get_user
-import re
 
-# Полный список кнопок меню (добавьте все кнопки из вашей системы)
+TEACHER = ("teacher",)
+STUDENT = ("student",)
+ALL_ROLES = ("teacher", "student")
+
+# Полный список кнопок меню (нужен до запуска: фильтры поиска в списках студентов)
 MENU_BUTTONS = [
     "В главное меню", "🛠 Техподдержка", "👨‍🏫 Мой профиль", "👤 Мой профиль",
     "📊 Панель управления", "🎓 Мои студенты", "📋 Расписание",
@@ -16,18 +19,73 @@ MENU_BUTTONS = [
     "🗑 Удалить студента", "🎂 Дни рождения"
 ]
 
+# Готовые маршруты меню: текст кнопки -> (множество ролей, обработчик).
+# Заполняются один раз в build_menu_routes() при запуске бота.
+MENU_ROUTES = {}
+
+
+def build_menu_routes():
+    """Импортирует обработчики меню и заполняет MENU_ROUTES (один раз при запуске)"""
+    if MENU_ROUTES:
+        return MENU_ROUTES
+
+    from handlers.profile import show_profile
+    from handlers.teacher import teacher_panel, show_students_list, show_teacher_schedule, \
+        show_student_requests, show_upcoming_birthdays
+    from handlers.balance import start_balance_management, show_my_balance
+    from handlers.lesson_management import start_lesson_management
+    from handlers.teacher_chat import start_teacher_chat
+    from handlers.student_management import start_student_management
+    from handlers.schedule import choose_schedule, show_my_lessons
+    from handlers.feedback import start_feedback
+    from handlers.profile_conversation import start_edit_profile, start_create_profile
+
+    menu_table = {
+        "В главное меню": (ALL_ROLES, show_main_menu_button),
+        "🛠 Техподдержка": (ALL_ROLES, show_support),
+        "👨‍🏫 Мой профиль": (ALL_ROLES, show_profile),
+        "👤 Мой профиль": (ALL_ROLES, show_profile),
+
+        "📊 Панель управления": (TEACHER, teacher_panel),
+        "🎓 Мои студенты": (TEACHER, show_students_list),
+        "📋 Расписание": (TEACHER, show_teacher_schedule),
+        "📅 Заявки студентов": (TEACHER, show_student_requests),
+        "💰 Управление балансом": (TEACHER, start_balance_management),
+        "✏️ Управление занятиями": (TEACHER, start_lesson_management),
+        "💬 Написать студенту": (TEACHER, start_teacher_chat),
+        "🗑 Удалить студента": (TEACHER, start_student_management),
+        "🎂 Дни рождения": (TEACHER, show_upcoming_birthdays),
+
+        "📅 Выбрать расписание": (STUDENT, choose_schedule),
+        "🕐 Мои занятия": (STUDENT, show_my_lessons),
+        "💰 Мой баланс": (STUDENT, show_my_balance),
+        "👨‍🏫 Связаться с преподавателем": (STUDENT, start_feedback),
+        "✏️ Изменить профиль": (STUDENT, start_edit_profile),
+        "👤 Создать профиль": (STUDENT, start_create_profile),
+        "👨‍🏫 Заполнить профиль": (STUDENT, start_create_profile),
+    }
+
+    for text, (roles, handler) in menu_table.items():
+        MENU_ROUTES[text] = (frozenset(roles), handler)
+
+    return MENU_ROUTES
+
 
 async def main_message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     text = update.message.text.strip()
-    user_role = get_user_role(user_id)
 
     print(f"DEBUG MAIN_HANDLER: Received text '{text}' from user {user_id}")
 
-    # 1. Если это кнопка меню - обрабатываем
-    if text in MENU_BUTTONS:
-        print(f"DEBUG MAIN_HANDLER: This is a menu button '{text}'")
-        await process_menu_button(update, context, text, user_role)
+    # 1. Если это кнопка меню - обрабатываем (один поиск в словаре)
+    route = (MENU_ROUTES or build_menu_routes()).get(text)
+    if route:
+        roles, handler = route
+        # Все, кто не преподаватель, - студенты: проверка по множеству TEACHER_IDS, без запроса к БД
+        user_role = "teacher" if is_teacher(user_id) else "student"
+        if user_role in roles:
+            print(f"DEBUG MAIN_HANDLER: This is a menu button '{text}'")
+            await handler(update, context)
         return
 
     # 2. Проверяем, является ли это вводом для баланса
@@ -37,33 +95,34 @@ async def main_message_handler(update: Update, context: ContextTypes.DEFAULT_TYP
         await handle_balance_input(update, context)
         return
 
-    # 3. Если это не кнопка меню и не ввод баланса - игнорируем
+    # 3. Поиск студента в открытом списке управления балансом
+    if is_teacher(user_id):
+        from handlers.student_picker import handle_picker_search
+        if await handle_picker_search(update, context, "b"):
+            return
+
+    # 4. Если это не кнопка меню, не ввод баланса и не поиск - игнорируем
     print(f"DEBUG MAIN_HANDLER: Text '{text}' not processed, ignoring...")
 
 
-async def process_menu_button(update: Update, context: ContextTypes.DEFAULT_TYPE,
-                              text: str, user_role: str):
-    """Обработка кнопок меню"""
+async def show_main_menu_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Кнопка 'В главное меню'"""
+    from keyboards.main_menu import show_main_menu
     user_id = update.effective_user.id
+    profile = get_user(user_id)
+    has_profile = True if is_teacher(user_id) else (profile and profile.get('fio'))
+    await show_main_menu(update, context, has_profile=has_profile)
 
-    print(f"DEBUG PROCESS_MENU: Processing button '{text}' for user {user_id}")
-
-    if text == "В главное меню":
-        from keyboards.main_menu import show_main_menu
-        profile = get_user(user_id)
-        has_profile = True if user_role == "teacher" else (profile and profile.get('fio'))
-        await show_main_menu(update, context, has_profile=has_profile)
 
-
-    elif text == "🛠 Техподдержка":
-        # Ваши данные
-        support_username = "UrikezZ"
-        support_name = "Техподдержка 52 Герца"
-        support_message = f"""
+async def show_support(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Кнопка '🛠 Техподдержка'"""
+    support_username = "UrikezZ"
+    support_name = "Техподдержка 52 Герца"
+    support_message = f"""
     🔧 *Техническая поддержка бота*
-    
+
     *Разработчик и поддержка:* @{support_username}
-    
+
     *По каким вопросам писать:*
     • Ошибки и баги в работе бота
     • Проблемы с выбором расписания
@@ -83,67 +142,14 @@ async def process_menu_button(update: Update, context: ContextTypes.DEFAULT_TYPE
     🕐 Ежедневно: 10:00 - 22:00
     ⏱ Ответ в течение 2-3 часов
             """
-        await update.message.reply_text(
-            support_message,
-            parse_mode='Markdown',
-            reply_markup=ReplyKeyboardMarkup(
-                [["В главное меню"]],
-                resize_keyboard=True
-            )
+    await update.message.reply_text(
+        support_message,
+        parse_mode='Markdown',
+        reply_markup=ReplyKeyboardMarkup(
+            [["В главное меню"]],
+            resize_keyboard=True
         )
-
-    elif text == "👨‍🏫 Мой профиль" or text == "👤 Мой профиль":
-        from handlers.profile import show_profile
-        await show_profile(update, context)
-
-    elif user_role == "teacher":
-        if text == "📊 Панель управления":
-            from handlers.teacher import teacher_panel
-            await teacher_panel(update, context)
-        elif text == "🎓 Мои студенты":
-            from handlers.teacher import show_students_list
-            await show_students_list(update, context)
-        elif text == "📋 Расписание":
-            from handlers.teacher import show_teacher_schedule
-            await show_teacher_schedule(update, context)
-        elif text == "📅 Заявки студентов":
-            from handlers.teacher import show_student_requests
-            await show_student_requests(update, context)
-        elif text == "💰 Управление балансом":
-            from handlers.balance import start_balance_management
-            await start_balance_management(update, context)
-        elif text == "✏️ Управление занятиями":
-            from handlers.lesson_management import start_lesson_management
-            await start_lesson_management(update, context)
-        elif text == "💬 Написать студенту":
-            from handlers.teacher_chat import start_teacher_chat
-            await start_teacher_chat(update, context)
-        elif text == "🗑 Удалить студента":
-            from handlers.student_management import start_student_management
-            await start_student_management(update, context)
-        elif text == "🎂 Дни рождения":
-            from handlers.teacher import show_upcoming_birthdays
-            await show_upcoming_birthdays(update, context)
-
-    else:  # student
-        if text == "📅 Выбрать расписание":
-            from handlers.schedule import choose_schedule
-            await choose_schedule(update, context)
-        elif text == "🕐 Мои занятия":
-            from handlers.schedule import show_my_lessons
-            await show_my_lessons(update, context)
-        elif text == "💰 Мой баланс":
-            from handlers.balance import show_my_balance
-            await show_my_balance(update, context)
-        elif text == "👨‍🏫 Связаться с преподавателем":
-            from handlers.feedback import start_feedback
-            await start_feedback(update, context)
-        elif text == "✏️ Изменить профиль":
-            from handlers.profile_conversation import start_edit_profile
-            await start_edit_profile(update, context)
-        elif text == "👤 Создать профиль" or text == "👨‍🏫 Заполнить профиль":
-            from handlers.profile_conversation import start_create_profile
-            await start_create_profile(update, context)
+    )
 
 
 # Создаем обработчик
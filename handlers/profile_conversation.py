@@ -2,7 +2,7 @@
 from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, ConversationHandler, MessageHandler, filters, CallbackQueryHandler, \
     CommandHandler
-from config import get_user_role, init_user_profile, save_user_profile, get_user_profile
+from config import get_user_role, init_user_profile, save_user_profile, get_user_profile, CONVERSATION_TIMEOUT
 from utils.validators import is_valid_date
 from datetime import datetime
 
@@ -659,7 +659,10 @@ create_profile_conversation = ConversationHandler(
         MessageHandler(filters.Regex("^❌ Отмена$"), cancel_create_conversation),
         MessageHandler(filters.Regex("^В главное меню$"), cancel_create_conversation),
     ],
-    per_message=False
+    per_message=False,
+    name="create_profile",
+    persistent=True,
+    conversation_timeout=CONVERSATION_TIMEOUT
 )
 
 # ========== ConversationHandler ДЛЯ РЕДАКТИРОВАНИЯ ПРОФИЛЯ ==========
@@ -691,7 +694,10 @@ edit_profile_conversation = ConversationHandler(
         MessageHandler(filters.Regex("^❌ Отмена$"), cancel_edit_conversation),
         MessageHandler(filters.Regex("^В главное меню$"), cancel_edit_conversation),
     ],
-    per_message=False
+    per_message=False,
+    name="edit_profile",
+    persistent=True,
+    conversation_timeout=CONVERSATION_TIMEOUT
 )
 
 # Экспортируем оба ConversationHandler
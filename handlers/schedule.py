@@ -1,11 +1,18 @@
 # schedule.py
 from datetime import datetime, timedelta
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup
-from telegram.ext import ContextTypes, MessageHandler, filters, CallbackQueryHandler
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, Message
+from telegram.ext import ContextTypes, MessageHandler, filters
 from config import is_teacher, get_student_balance, get_balance_display, get_total_lessons_count, get_user
-from config import get_next_week_dates, get_day_slots, get_available_slots_for_user
-from database import get_confirmed_lessons, get_schedule_request, save_schedule_request, get_user as db_get_user, save_confirmed_lesson, delete_schedule_request
-from config import TEACHER_IDS, add_confirmed_lesson, remove_confirmed_lesson, save_schedule_request_dict
+from config import get_next_week_dates, get_week_dates, get_day_slots, get_slot_label, get_week_occupancy, \
+    get_week_offset, is_slot_free, is_slot_bookable, SCHEDULE_GRID, BOOKING_HORIZON_WEEKS
+from database import get_confirmed_lessons, get_schedule_request, save_schedule_request, get_user_names, save_confirmed_lesson, delete_schedule_request
+from database import add_to_waitlist, remove_from_waitlist, get_user_waitlist
+from config import TEACHER_IDS, add_confirmed_lesson, remove_confirmed_lesson, save_schedule_request_dict, \
+    get_student_view, get_upcoming_view_lessons
+from utils.callbacks import make_callback, parse_callback, slot_args, slot_from_args
+from utils.inflight import deduplicate_callback
+from utils.notifications import queue_notifications
+from utils.render_cache import render_cache, render_hash
 
 def get_previous_day_date(lesson_date_str: str) -> str:
     """Возвращает дату предыдущего дня от даты занятия в формате DD.MM"""
@@ -27,16 +34,26 @@ def get_previous_day_date(lesson_date_str: str) -> str:
 # Вспомогательная функция для безопасного редактирования
 async def safe_edit_message(query, text, parse_mode=None, reply_markup=None):
     """Безопасное редактирование сообщения с обработкой ошибки 'Message is not modified'"""
+    # Сообщение уже показывает то же самое - запрос к Telegram не нужен
+    message = query.message
+    content_hash = render_hash(text, parse_mode, reply_markup)
+    if message is not None and render_cache.is_current(message, content_hash):
+        return True
+
     try:
-        await query.edit_message_text(
+        edited = await query.edit_message_text(
             text=text,
             parse_mode=parse_mode,
             reply_markup=reply_markup
         )
+        if message is not None:
+            render_cache.store(edited if isinstance(edited, Message) else message, content_hash)
         return True
     except Exception as e:
         if "Message is not modified" in str(e):
             print(f"DEBUG: Message already up to date")
+            if message is not None:
+                render_cache.store(message, content_hash)
             return True
         elif "Inline keyboard expected" in str(e):
             # Если нужна инлайн-клавиатура, но мы ее не передали, отправляем новое сообщение
@@ -86,68 +103,72 @@ async def choose_schedule(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await show_day_selection(update, context, user_id, day_index=0)
 
 
-async def show_day_selection(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int, day_index: int):
-    """Показывает выбор дня недели"""
-    week_dates = get_next_week_dates()
+async def show_day_selection(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int, day_index: int,
+                             week_offset: int = 0):
+    """Показывает выбор дня недели (week_offset - номер недели горизонта бронирования)"""
+    week_dates = get_week_dates(week_offset)
 
     keyboard = []
 
-    # Заголовок с датами недели
-    # Получаем первую (среду) и последнюю (воскресенье) даты
+    # Заголовок с датами недели: первый и последний рабочий день
+    last_index = len(week_dates) - 1
     first_day = week_dates[0]['date'] if week_dates else ""
-    last_day = week_dates[4]['date'] if len(week_dates) > 4 else ""
+    last_day = week_dates[last_index]['date'] if week_dates else ""
     week_range = f"{first_day} - {last_day}"
 
-    # Собираем уже занятые слоты
-    occupied_slots = set()
-    all_lessons = get_confirmed_lessons()
-    for lesson in all_lessons:
-        occupied_slots.add(lesson['slot_id'])
+    # Карта занятости недели: {дата: битовая маска} - один запрос по индексу дат
+    occupancy = get_week_occupancy(week_offset)
+
+    request = get_schedule_request(user_id)
+    selected_slots = request.get('selected_slots', []) if request else []
+    waitlist_slots = get_user_waitlist(user_id)
 
-    # Кнопки дней недели (Ср-Вс)
+    # Кнопки рабочих дней недели
     days_row = []
-    for i in range(5):  # Ср-Вс
-        day_info = week_dates[i]
+    for i, day_info in week_dates.items():
         # Проверяем, есть ли выбранные слоты в этом дне
-        request = get_schedule_request(user_id)
-        selected_slots = request.get('selected_slots', []) if request else []
-        has_selected_slots = any(slot.startswith(f'day{i}_') for slot in selected_slots)
-        day_button = f"✅ {day_info['day_name']}" if has_selected_slots else day_info['day_name']
-        days_row.append(InlineKeyboardButton(day_button, callback_data=f"select_day_{i}"))
+        day_prefix = day_info['day'].strftime('%Y%m%d')
+        has_selected_slots = any(slot.startswith(day_prefix) for slot in selected_slots)
+        day_mask = occupancy.get(day_info['day'], 0)
+
+        if has_selected_slots:
+            day_button = f"✅ {day_info['day_name']}"
+        elif not SCHEDULE_GRID.free_count(day_mask):
+            day_button = f"⛔ {day_info['day_name']}"
+        else:
+            day_button = day_info['day_name']
+        days_row.append(InlineKeyboardButton(day_button, callback_data=make_callback("s", "d", week_offset, i)))
 
     keyboard.append(days_row)
 
     # Показываем слоты времени для выбранного дня
     day_info = week_dates[day_index]
-    keyboard.append([InlineKeyboardButton(f"📅 {day_info['day_name']} {day_info['date']}", callback_data="ignore")])
+    keyboard.append([InlineKeyboardButton(f"📅 {day_info['day_name']} {day_info['date']}", callback_data=make_callback("x"))])
 
-    # Показываем слоты времени для выбранного дня (13:00-22:00)
-    time_slots, _ = get_day_slots(day_index)
-    time_row = []
+    time_slots, _ = get_day_slots(day_index, week_offset)
+    day_mask = occupancy.get(day_info['day'], 0)
     slot_items = list(time_slots.items())
 
     # Группируем по 3 времени в строку
     for i in range(0, len(slot_items), 3):
         time_row = []
         for slot_id, time in slot_items[i:i + 3]:
-            # Проверяем, занят ли слот
-            is_occupied = slot_id in occupied_slots
-            request = get_schedule_request(user_id)
-            selected_slots = request.get('selected_slots', []) if request else []
+            # Проверяем, занят ли слот (бит в маске дня)
+            is_occupied = bool(day_mask & SCHEDULE_GRID.mask_for_time(time))
             is_selected = slot_id in selected_slots
 
             if is_occupied:
-                # Занят - нельзя выбрать
-                slot_button = f"⛔ {time}"
-                callback_data = "ignore"
+                # Занят - можно встать в лист ожидания
+                slot_button = f"⏳ {time}" if slot_id in waitlist_slots else f"⛔ {time}"
+                callback_data = make_callback("s", "q", *slot_args(slot_id))
             elif is_selected:
                 # Выбран студентом
                 slot_button = f"✅ {time}"
-                callback_data = f"select_time_{slot_id}"
+                callback_data = make_callback("s", "t", *slot_args(slot_id))
             else:
                 # Свободный
                 slot_button = time
-                callback_data = f"select_time_{slot_id}"
+                callback_data = make_callback("s", "t", *slot_args(slot_id))
 
             time_row.append(InlineKeyboardButton(slot_button, callback_data=callback_data))
 
@@ -157,37 +178,53 @@ async def show_day_selection(update: Update, context: ContextTypes.DEFAULT_TYPE,
     # Кнопки навигации и завершения
     nav_row = []
     if day_index > 0:
-        nav_row.append(InlineKeyboardButton("◀️ Назад", callback_data=f"nav_day_{day_index - 1}"))
+        nav_row.append(InlineKeyboardButton("◀️ Назад", callback_data=make_callback("s", "d", week_offset, day_index - 1)))
 
-    nav_row.append(InlineKeyboardButton("📋 Выбранные", callback_data="show_selected"))
+    nav_row.append(InlineKeyboardButton("📋 Выбранные", callback_data=make_callback("s", "l")))
 
-    if day_index < 4:  # Всего 5 дней (0-4)
-        nav_row.append(InlineKeyboardButton("Вперед ▶️", callback_data=f"nav_day_{day_index + 1}"))
+    if day_index < last_index:
+        nav_row.append(InlineKeyboardButton("Вперед ▶️", callback_data=make_callback("s", "d", week_offset, day_index + 1)))
 
     if nav_row:
         keyboard.append(nav_row)
 
-    keyboard.append([InlineKeyboardButton("✅ Завершить выбор", callback_data="finish_schedule")])
+    # Листание недель горизонта бронирования
+    week_row = []
+    if week_offset > 0:
+        week_row.append(InlineKeyboardButton("⏪ Пред. неделя", callback_data=make_callback("s", "w", week_offset - 1)))
+    week_row.append(InlineKeyboardButton(f"Неделя {week_offset + 1}/{BOOKING_HORIZON_WEEKS}", callback_data=make_callback("x")))
+    if week_offset < BOOKING_HORIZON_WEEKS - 1:
+        week_row.append(InlineKeyboardButton("След. неделя ⏩", callback_data=make_callback("s", "w", week_offset + 1)))
+    keyboard.append(week_row)
+
+    # Сколько уроков студент хочет получить из выбранных слотов
+    desired_lessons = get_desired_lessons(request)
+    keyboard.append([
+        InlineKeyboardButton("➖", callback_data=make_callback("s", "n", "d", week_offset, day_index)),
+        InlineKeyboardButton(f"Нужно уроков: {desired_lessons}", callback_data=make_callback("x")),
+        InlineKeyboardButton("➕", callback_data=make_callback("s", "n", "i", week_offset, day_index))
+    ])
+
+    keyboard.append([InlineKeyboardButton("✅ Завершить выбор", callback_data=make_callback("s", "f"))])
 
     reply_markup = InlineKeyboardMarkup(keyboard)
 
     # Формируем текст выбранных слотов
-    request = get_schedule_request(user_id)
-    selected_slots = request.get('selected_slots', []) if request else []
     if selected_slots:
-        all_slots = get_available_slots_for_user(user_id)
-        selected_text = "\n".join([f"• {all_slots[slot_id]}" for slot_id in selected_slots])
+        selected_text = "\n".join([f"• {get_slot_label(slot_id)}" for slot_id in selected_slots])
     else:
         selected_text = "Пока нет"
 
     message_text = (
-        f"📅 *Выберите удобные время на неделю {week_range} (Среда-Воскресенье):*\n\n"
-        f"• Дни: Ср, Чт, Пт, Сб, Вс\n"
-        f"• Время: 13:00 - 22:00\n"
+        f"📅 *Выберите удобные время на неделю {week_range}:*\n\n"
+        f"• Дни: {SCHEDULE_GRID.describe_days()}\n"
+        f"• Время: {SCHEDULE_GRID.describe_hours()}\n"
         f"• Нажимайте на дни чтобы выбрать время\n"
-        f"• ⛔ - время уже занято\n"
+        f"• ⛔ - время уже занято, нажмите, чтобы встать в лист ожидания\n"
+        f"• ⏳ - вы в листе ожидания: напишем, если время освободится\n"
         f"• ✅ - ваши выбранные время\n"
-        f"• Можно выбрать несколько слотов в разные дни\n\n"
+        f"• Можно выбрать несколько слотов в разные дни\n"
+        f"• ➖/➕ - сколько уроков из выбранных слотов вам нужно\n\n"
         f"*Выбранные слоты:*\n{selected_text}"
     )
 
@@ -197,72 +234,162 @@ async def show_day_selection(update: Update, context: ContextTypes.DEFAULT_TYPE,
         await update.message.reply_text(message_text, parse_mode='Markdown', reply_markup=reply_markup)
 
 
-async def handle_schedule_buttons(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработчик нажатий на кнопки расписания"""
+def get_desired_lessons(request):
+    """Сколько уроков хочет студент: не меньше 1 и не больше числа выбранных слотов"""
+    if not request:
+        return 1
+    selected_count = len(request.get('selected_slots', []))
+    return max(1, min(request.get('desired_lessons') or 1, selected_count))
+
+
+async def get_active_request(query):
+    """Заявка студента для кнопок выбора расписания (None, если сессия устарела)"""
+    request = get_schedule_request(query.from_user.id)
+    if not request:
+        await query.answer()
+        await safe_edit_message(query, "❌ Сессия выбора расписания устарела. Начните заново.")
+    return request
+
+
+async def handle_day_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Навигация по дням / выбор дня для просмотра времени (s:d:<неделя>:<день>)"""
     query = update.callback_query
-    user_id = query.from_user.id
-    callback_data = query.data
+    week_offset, day_index = context.args
 
+    if not await get_active_request(query):
+        return
     await query.answer()
 
-    request = get_schedule_request(user_id)
+    if 0 <= week_offset < BOOKING_HORIZON_WEEKS and 0 <= day_index < len(get_week_dates(week_offset)):
+        await show_day_selection(update, context, query.from_user.id, day_index, week_offset)
+
+
+async def handle_week_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Листание недель горизонта бронирования (s:w:<неделя>)"""
+    query = update.callback_query
+    week_offset = context.args[0]
+
+    if not await get_active_request(query):
+        return
+    await query.answer()
+
+    if 0 <= week_offset < BOOKING_HORIZON_WEEKS:
+        await show_day_selection(update, context, query.from_user.id, 0, week_offset)
+
+
+async def handle_time_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Выбор/отмена времени (s:t:<дата>:<время>)"""
+    query = update.callback_query
+    user_id = query.from_user.id
+    slot_id = slot_from_args(*context.args)
+
+    request = await get_active_request(query)
     if not request:
-        await safe_edit_message(query, "❌ Сессия выбора расписания устарела. Начните заново.")
         return
 
-    if callback_data == "finish_schedule":
-        # Завершаем выбор и отправляем преподавателю
-        await finish_schedule_selection(update, context, user_id)
+    # Слот должен быть в сетке и внутри горизонта бронирования
+    if not is_slot_bookable(slot_id):
+        await query.answer("❌ Это время недоступно для записи", show_alert=True)
+        return
+
+    # ПРОВЕРЯЕМ, НЕ ЗАНЯТ ЛИ УЖЕ ЭТОТ СЛОТ
+    if not is_slot_free(slot_id):
+        await query.answer("❌ Это время уже занято!", show_alert=True)
+        return
+
+    await query.answer()
+
+    selected_slots = request.get('selected_slots', [])
+    if slot_id in selected_slots:
+        selected_slots.remove(slot_id)
+    else:
+        selected_slots.append(slot_id)
+
+    # Обновляем заявку
+    request['selected_slots'] = selected_slots
+    save_schedule_request(request)
+
+    await show_slot_day(update, context, user_id, slot_id)
+
+
+async def show_slot_day(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int, slot_id: str):
+    """Показывает выбор расписания на дне, к которому относится слот"""
+    # Определяем неделю и день по дате слота
+    slot_day = SCHEDULE_GRID.parse_slot_id(slot_id)[0]
+    week_offset = get_week_offset(slot_day)
+    day_index = next((i for i, info in get_week_dates(week_offset).items() if info['day'] == slot_day), 0)
+    await show_day_selection(update, context, user_id, day_index, week_offset)
+
+
+async def handle_waitlist_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Занятое время: встать в лист ожидания или выйти из него (s:q:<дата>:<время>)"""
+    query = update.callback_query
+    user_id = query.from_user.id
+    slot_id = slot_from_args(*context.args)
+
+    if not await get_active_request(query):
         return
 
-    elif callback_data == "show_selected":
-        # Показываем только выбранные слоты
-        await show_selected_slots(update, context, user_id)
+    if not is_slot_bookable(slot_id):
+        await query.answer("❌ Это время недоступно для записи", show_alert=True)
         return
 
-    elif callback_data.startswith("nav_day_"):
-        # Навигация по дням
-        day_index = int(callback_data.split("_")[2])
-        await show_day_selection(update, context, user_id, day_index)
+    if is_slot_free(slot_id):
+        await query.answer("✅ Это время уже свободно - его можно выбрать", show_alert=True)
+    elif any(lesson['slot_id'] == slot_id for lesson in get_confirmed_lessons(user_id)):
+        await query.answer("📅 На это время у вас уже есть занятие", show_alert=True)
         return
+    elif remove_from_waitlist(slot_id, user_id):
+        await query.answer("Вы вышли из листа ожидания")
+    else:
+        position = add_to_waitlist(slot_id, user_id)
+        await query.answer(
+            f"⏳ Вы в листе ожидания на {get_slot_label(slot_id)} (место {position}).\n"
+            f"Если время освободится, бот сразу предложит записаться.",
+            show_alert=True
+        )
 
-    elif callback_data.startswith("select_day_"):
-        # Выбор дня для просмотра времени
-        day_index = int(callback_data.split("_")[2])
-        await show_day_selection(update, context, user_id, day_index)
+    await show_slot_day(update, context, user_id, slot_id)
+
+
+async def handle_desired_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Изменение количества нужных уроков (s:n:<i|d>:<неделя>:<день>)"""
+    query = update.callback_query
+    direction, week_offset, day_index = context.args
+
+    request = await get_active_request(query)
+    if not request:
         return
 
-    elif callback_data.startswith("select_time_"):
-        # Выбор/отмена времени
-        slot_id = callback_data.replace("select_time_", "")
+    desired_lessons = get_desired_lessons(request) + (1 if direction == "i" else -1)
 
-        # ПРОВЕРЯЕМ, НЕ ЗАНЯТ ЛИ УЖЕ ЭТОТ СЛОТ
-        slot_occupied = False
-        all_lessons = get_confirmed_lessons()
-        for lesson in all_lessons:
-            if lesson['slot_id'] == slot_id:
-                slot_occupied = True
-                break
+    if desired_lessons > len(request.get('selected_slots', [])):
+        await query.answer("Сначала выберите больше слотов", show_alert=True)
+        return
 
-        if slot_occupied:
-            await query.answer("❌ Это время уже занято!", show_alert=True)
-            return
+    await query.answer()
+    if desired_lessons < 1:
+        return
 
-        request = get_schedule_request(user_id)
-        selected_slots = request.get('selected_slots', [])
+    request['desired_lessons'] = desired_lessons
+    save_schedule_request(request)
+    await show_day_selection(update, context, query.from_user.id, day_index, week_offset)
 
-        if slot_id in selected_slots:
-            selected_slots.remove(slot_id)
-        else:
-            selected_slots.append(slot_id)
 
-        # Обновляем заявку
-        request['selected_slots'] = selected_slots
-        save_schedule_request(request)
+async def handle_show_selected_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Показывает только выбранные слоты (s:l)"""
+    query = update.callback_query
+    if await get_active_request(query):
+        await show_selected_slots(update, context, query.from_user.id)
 
-        # Определяем день из slot_id (day0, day1, etc.)
-        day_index = int(slot_id[3])  # "day0_14" -> 0
-        await show_day_selection(update, context, user_id, day_index)
+
+async def handle_finish_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Завершает выбор и отправляет заявку преподавателю (s:f)"""
+    query = update.callback_query
+    if not await get_active_request(query):
+        return
+    await query.answer()
+    await finish_schedule_selection(update, context, query.from_user.id)
 
 
 async def show_selected_slots(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int):
@@ -274,12 +401,12 @@ async def show_selected_slots(update: Update, context: ContextTypes.DEFAULT_TYPE
         await update.callback_query.answer("Вы еще не выбрали ни одного слота", show_alert=True)
         return
 
-    all_slots = get_available_slots_for_user(user_id)
-    selected_text = "\n".join([f"• {all_slots[slot_id]}" for slot_id in selected_slots])
+    await update.callback_query.answer()
+    selected_text = "\n".join([f"• {get_slot_label(slot_id)}" for slot_id in selected_slots])
 
     keyboard = [
-        [InlineKeyboardButton("◀️ Вернуться к выбору", callback_data="nav_day_0")],
-        [InlineKeyboardButton("✅ Завершить выбор", callback_data="finish_schedule")]
+        [InlineKeyboardButton("◀️ Вернуться к выбору", callback_data=make_callback("s", "d", 0, 0))],
+        [InlineKeyboardButton("✅ Завершить выбор", callback_data=make_callback("s", "f"))]
     ]
 
     reply_markup = InlineKeyboardMarkup(keyboard)
@@ -326,22 +453,33 @@ async def finish_schedule_selection(update: Update, context: ContextTypes.DEFAUL
         student_instruments = ', '.join(user_info.get('instruments', []))
         student_goals = user_info.get('goals', 'Не указаны')
 
+    # Сохраняем количество нужных уроков с учетом числа выбранных слотов
+    desired_lessons = get_desired_lessons(request)
+    if request.get('desired_lessons') != desired_lessons:
+        request['desired_lessons'] = desired_lessons
+        save_schedule_request(request)
+
     # Формируем сообщение для преподавателя
-    all_slots = get_available_slots_for_user(user_id)
-    slots_text = "\n".join([f"• {all_slots[slot_id]}" for slot_id in selected_slots])
+    slots_text = "\n".join([f"• {get_slot_label(slot_id)}" for slot_id in selected_slots])
 
-    # Получаем даты недели для заголовка
-    week_dates = get_next_week_dates()
-    week_range = f"{week_dates[0]['date']} - {week_dates[4]['date']}"
+    # Период заявки: от первого до последнего выбранного дня
+    slot_days = sorted(SCHEDULE_GRID.parse_slot_id(slot_id)[0] for slot_id in selected_slots
+                       if SCHEDULE_GRID.parse_slot_id(slot_id))
+    if slot_days:
+        week_range = f"{slot_days[0].strftime('%d.%m.%Y')} - {slot_days[-1].strftime('%d.%m.%Y')}"
+    else:
+        week_dates = get_next_week_dates()
+        week_range = f"{week_dates[0]['date']} - {week_dates[len(week_dates) - 1]['date']}"
 
     teacher_message = (
         f"🎹 НОВАЯ ЗАЯВКА НА РАСПИСАНИЕ\n"
-        f"Неделя: {week_range}\n\n"
+        f"Период: {week_range}\n\n"
         f"👤Студент: {student_name}\n"
         f"🎸Инструмент: {student_instruments}\n"
         f"Цели: {student_goals}\n"
         f"Username: @{update.callback_query.from_user.username or 'Не указан'}\n"
         f"User ID: {user_id}\n\n"
+        f"Нужно уроков: {desired_lessons}\n\n"
         f"Выбранные слоты:\n{slots_text}\n\n"
         f"Выберите подходящие слоты для подтверждения (можно выбрать несколько):"
     )
@@ -349,18 +487,18 @@ async def finish_schedule_selection(update: Update, context: ContextTypes.DEFAUL
     # Создаем клавиатуру для преподавателя с возможностью выбора нескольких
     teacher_keyboard = []
     for slot_id in selected_slots:
-        slot_name = all_slots[slot_id]
+        slot_name = get_slot_label(slot_id)
         teacher_keyboard.append([
-            InlineKeyboardButton(f"◻️ {slot_name}", callback_data=f"confirm_{user_id}_{slot_id}")
+            InlineKeyboardButton(f"◻️ {slot_name}", callback_data=make_callback("c", "t", user_id, *slot_args(slot_id)))
         ])
 
     # Кнопка для подтверждения всех выбранных слотов
     teacher_keyboard.append([
-        InlineKeyboardButton("✅ Подтвердить выбранные", callback_data=f"confirm_multiple_{user_id}")
+        InlineKeyboardButton("✅ Подтвердить выбранные", callback_data=make_callback("c", "m", user_id))
     ])
 
     teacher_keyboard.append([
-        InlineKeyboardButton("❌ Отклонить все", callback_data=f"reject_all_{user_id}")
+        InlineKeyboardButton("❌ Отклонить все", callback_data=make_callback("c", "r", user_id))
     ])
 
     reply_markup = InlineKeyboardMarkup(teacher_keyboard)
@@ -379,8 +517,8 @@ async def finish_schedule_selection(update: Update, context: ContextTypes.DEFAUL
         await safe_edit_message(
             update.callback_query,
             f"✅ *Заявка отправлена преподавателю!*\n"
-            f"*Неделя:* {week_range}\n\n"
-            f"Вы выбрали {len(selected_slots)} слотов. "
+            f"*Период:* {week_range}\n\n"
+            f"Вы выбрали {len(selected_slots)} слотов, нужно уроков: {desired_lessons}. "
             f"Ожидайте подтверждения в течение дня.\n\n"
             "Преподаватель свяжется с вами для окончательного подтверждения времени.",
             parse_mode='Markdown'
@@ -394,80 +532,77 @@ async def finish_schedule_selection(update: Update, context: ContextTypes.DEFAUL
         print(f"Ошибка отправки преподавателю: {e}")
 
 
-async def handle_teacher_confirmation(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработчик подтверждения слотов преподавателем с возможностью выбора нескольких"""
+async def check_teacher_callback(query):
+    """Проверяет, что кнопку подтверждения нажал преподаватель"""
+    if not is_teacher(query.from_user.id):
+        await query.answer()
+        await safe_edit_message(query, "❌ Доступ запрещен")
+        return False
+    return True
+
+
+async def handle_confirm_slot_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Отметка/снятие отметки слота в заявке студента (c:t:<студент>:<дата>:<время>)"""
     query = update.callback_query
-    teacher_id = query.from_user.id
-    callback_data = query.data
+    if not await check_teacher_callback(query):
+        return
+
+    # Получаем текущее сообщение
+    original_text = query.message.text
+
+    # Создаем новую клавиатуру: переключаем только нажатую кнопку
+    new_keyboard = []
+    has_changes = False
+
+    for row in query.message.reply_markup.inline_keyboard:
+        new_row = []
+        for button in row:
+            if button.callback_data == query.data:
+                # Определяем по тексту, выбрана ли уже кнопка
+                if "✅" in button.text:
+                    slot_name = button.text.replace("✅ ", "")
+                    new_button = InlineKeyboardButton(f"◻️ {slot_name}", callback_data=button.callback_data)
+                else:
+                    slot_name = button.text.replace("◻️ ", "")
+                    new_button = InlineKeyboardButton(f"✅ {slot_name}", callback_data=button.callback_data)
+
+                new_row.append(new_button)
+                has_changes = True
+            else:
+                # Оставляем остальные кнопки как есть
+                new_row.append(button)
+        new_keyboard.append(new_row)
+
+    if not has_changes:
+        await query.answer("Кнопка не найдена", show_alert=True)
+        return
 
     await query.answer()
+    await safe_edit_message(
+        query,
+        text=original_text,
+        parse_mode=None,
+        reply_markup=InlineKeyboardMarkup(new_keyboard)
+    )
 
-    # Проверяем, что это преподаватель
-    if not is_teacher(teacher_id):
-        await safe_edit_message(query, "❌ Доступ запрещен")
+
+@deduplicate_callback
+async def handle_confirm_multiple_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Подтверждение всех отмеченных слотов (c:m:<студент>)"""
+    query = update.callback_query
+    if not await check_teacher_callback(query):
         return
+    await confirm_all_selected_slots(update, context, context.args[0], query.from_user.id)
 
-    if callback_data.startswith("confirm_"):
-        if "multiple" in callback_data:
-            # Подтверждение всех выбранных слотов
-            student_id = int(callback_data.split("_")[2])
-            await confirm_all_selected_slots(update, context, student_id, teacher_id)
-        else:
-            # Подтверждение/отмена конкретного слота
-            _, student_id, slot_id = callback_data.split("_", 2)
-            student_id = int(student_id)
-
-            # Получаем текущее сообщение
-            original_text = query.message.text
-
-            # Создаем новую клавиатуру
-            new_keyboard = []
-            has_changes = False
-
-            for row in query.message.reply_markup.inline_keyboard:
-                new_row = []
-                for button in row:
-                    # Ищем кнопку с этим слотом
-                    if button.callback_data == f"confirm_{student_id}_{slot_id}":
-                        # Определяем по тексту, выбрана ли уже кнопка
-                        is_selected = "✅" in button.text
-
-                        if not is_selected:
-                            # Выбираем слот
-                            slot_name = button.text.replace("◻️ ", "")
-                            new_button = InlineKeyboardButton(
-                                f"✅ {slot_name}",
-                                callback_data=f"confirm_{student_id}_{slot_id}"
-                            )
-                        else:
-                            # Отменяем выбор
-                            slot_name = button.text.replace("✅ ", "")
-                            new_button = InlineKeyboardButton(
-                                f"◻️ {slot_name}",
-                                callback_data=f"confirm_{student_id}_{slot_id}"
-                            )
-
-                        new_row.append(new_button)
-                        has_changes = True
-                    else:
-                        # Оставляем остальные кнопки как есть
-                        new_row.append(button)
-                new_keyboard.append(new_row)
-
-            if has_changes:
-                await safe_edit_message(
-                    query,
-                    text=original_text,
-                    parse_mode=None,
-                    reply_markup=InlineKeyboardMarkup(new_keyboard)
-                )
-            else:
-                await query.answer("Кнопка не найдена", show_alert=True)
 
-    elif callback_data.startswith("reject_all_"):
-        # Отклонение всех слотов
-        student_id = int(callback_data.split("_")[2])
-        await reject_student_request(update, context, student_id, teacher_id)
+@deduplicate_callback
+async def handle_reject_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Отклонение заявки студента (c:r:<студент>)"""
+    query = update.callback_query
+    if not await check_teacher_callback(query):
+        return
+    await query.answer()
+    await reject_student_request(update, context, context.args[0], query.from_user.id)
 
 
 async def confirm_all_selected_slots(update: Update, context: ContextTypes.DEFAULT_TYPE,
@@ -484,25 +619,18 @@ async def confirm_all_selected_slots(update: Update, context: ContextTypes.DEFAU
 
     for row in query.message.reply_markup.inline_keyboard:
         for button in row:
-            if ("✅" in button.text and
-                    button.callback_data and
-                    button.callback_data.startswith("confirm_") and
-                    "multiple" not in button.callback_data):
-
-                try:
-                    parts = button.callback_data.split("_")
-                    if len(parts) >= 3:
-                        slot_student_id = int(parts[1])
-                        slot_id = "_".join(parts[2:])
-
-                        if slot_student_id == student_id:
-                            selected_slots.append(slot_id)
-                            # Извлекаем название слота из текста кнопки
-                            slot_name = button.text.replace("✅ ", "").replace("◻️ ", "")
-                            slot_names.append(slot_name)
-                except (ValueError, IndexError) as e:
-                    print(f"DEBUG: Error parsing callback_data {button.callback_data}: {e}")
-                    continue
+            if "✅" not in button.text:
+                continue
+
+            callback = parse_callback(button.callback_data)
+            if not callback or (callback.namespace, callback.action) != ("c", "t"):
+                continue
+
+            slot_student_id, slot_date, slot_time = callback.args
+            if slot_student_id == student_id:
+                selected_slots.append(slot_from_args(slot_date, slot_time))
+                # Извлекаем название слота из текста кнопки
+                slot_names.append(button.text.replace("✅ ", "").replace("◻️ ", ""))
 
     if not selected_slots:
         await query.answer("Вы не выбрали ни одного слота! Нажмите на слоты чтобы отметить их галочкой.",
@@ -540,6 +668,8 @@ async def confirm_all_selected_slots(update: Update, context: ContextTypes.DEFAU
         print(f"DEBUG: No slots were confirmed for student {student_id}")
         return
 
+    await query.answer()
+
     # Получаем баланс после списаний
     balance_after = get_student_balance(student_id)
     lessons_after = balance_after['lessons_left']
@@ -649,43 +779,28 @@ async def confirm_all_selected_slots(update: Update, context: ContextTypes.DEFAU
 async def confirm_single_slot_in_batch(context: ContextTypes.DEFAULT_TYPE,
                                        student_id: int, slot_id: str,
                                        teacher_id: int, slot_name: str):
-    """Подтверждает один слот студента (для использования в пакетном режиме)"""
-    from config import get_balance_display, use_lesson, get_student_balance
+    """
+    Подтверждает один слот студента (для использования в пакетном режиме).
+    Возвращает снимок баланса после списания (BalanceSnapshot) или False, если слот занят.
+    """
+    from config import use_lesson
+    from database import describe_lesson_payment
     from datetime import datetime
 
     print(f"DEBUG: Starting confirm_single_slot_in_batch for student {student_id}, slot {slot_id}")
 
-    # 1. ПРОВЕРЯЕМ, НЕ ПОДТВЕРЖДЕН ЛИ УЖЕ ЭТОТ СЛОТ
-    all_lessons = get_confirmed_lessons()
-    for lesson in all_lessons:
-        if lesson['slot_id'] == slot_id:
-            print(f"DEBUG: Slot {slot_id} already confirmed for student {lesson['user_id']}")
-            return False
+    # 1. ПРОВЕРЯЕМ, НЕ ЗАНЯТ ЛИ УЖЕ ЭТОТ СЛОТ
+    if not is_slot_free(slot_id):
+        print(f"DEBUG: Slot {slot_id} is already occupied")
+        return False
 
     try:
-        # СПИСЫВАЕМ УРОК ИЛИ ДЕНЬГИ С БАЛАНСА
-        balance_before = get_student_balance(student_id)
-        print(
-            f"DEBUG: Balance before lesson: lessons_left={balance_before['lessons_left']}, balance={balance_before['balance']}")
-
         # Используем урок (списываем с баланса или добавляем долг)
-        use_lesson(student_id)
+        snapshot = use_lesson(student_id)
+        print(f"DEBUG: Balance after lesson: lessons_left={snapshot.lessons_left}, balance={snapshot.balance}")
 
-        balance_after = get_student_balance(student_id)
-        print(
-            f"DEBUG: Balance after lesson: lessons_left={balance_after['lessons_left']}, balance={balance_after['balance']}")
-
-        # Определяем тип списания
-        lesson_price = balance_before.get('lesson_price', 2000)
-        if balance_before['lessons_left'] > 0:
-            payment_type = "списан 1 урок из предоплаты"
-        else:
-            if balance_before['balance'] > 0:
-                payment_type = f"списано {lesson_price} руб. с депозита"
-            elif balance_before['balance'] == 0:
-                payment_type = f"добавлен долг {lesson_price} руб."
-            else:
-                payment_type = f"долг увеличен на {lesson_price} руб."
+        # Тип списания - по балансу после списания, без повторного чтения
+        payment_type = describe_lesson_payment(snapshot._asdict(), snapshot.from_prepaid)
 
         # Сохраняем занятие
         lesson_data = {
@@ -694,7 +809,9 @@ async def confirm_single_slot_in_batch(context: ContextTypes.DEFAULT_TYPE,
             'slot_name': slot_name,
             'confirmed_by': teacher_id,
             'date_added': datetime.now().strftime('%d.%m.%Y %H:%M'),
-            'payment_type': payment_type
+            'payment_type': payment_type,
+            # Урок уже списан выше - массовое списание за день его пропустит
+            'charged': True
         }
         add_confirmed_lesson(lesson_data)
 
@@ -705,7 +822,7 @@ async def confirm_single_slot_in_batch(context: ContextTypes.DEFAULT_TYPE,
         remove_slot_from_all_requests(slot_id)
         print(f"DEBUG: Removed slot {slot_id} from all requests")
 
-        return True
+        return snapshot
 
     except Exception as e:
         print(f"ERROR: Failed to confirm slot {slot_id} for student {student_id}: {e}")
@@ -723,17 +840,14 @@ async def confirm_single_slot(update: Update, context: ContextTypes.DEFAULT_TYPE
 
     print(f"DEBUG: Starting confirm_single_slot for student {student_id}, slot {slot_id}")
 
-    # 1. ПРОВЕРЯЕМ, НЕ ПОДТВЕРЖДЕН ЛИ УЖЕ ЭТОТ СЛОТ
-    all_lessons = get_confirmed_lessons()
-    for lesson in all_lessons:
-        if lesson['slot_id'] == slot_id:
-            print(f"DEBUG: Slot {slot_id} already confirmed for student {lesson['user_id']}")
-            await update.callback_query.answer(f"Это время уже занято!", show_alert=True)
-            return False
+    # 1. ПРОВЕРЯЕМ, НЕ ЗАНЯТ ЛИ УЖЕ ЭТОТ СЛОТ
+    if not is_slot_free(slot_id):
+        print(f"DEBUG: Slot {slot_id} is already occupied")
+        await update.callback_query.answer(f"Это время уже занято!", show_alert=True)
+        return False
 
     # Получаем актуальное название слота
-    all_slots = get_available_slots_for_user(student_id)
-    slot_name = all_slots.get(slot_id, f"Слот {slot_id}")
+    slot_name = get_slot_label(slot_id)
 
     # Проверяем, не подтвержден ли уже этот слот у этого студента
     student_lessons = get_confirmed_lessons(student_id)
@@ -775,7 +889,9 @@ async def confirm_single_slot(update: Update, context: ContextTypes.DEFAULT_TYPE
             'slot_name': slot_name,
             'confirmed_by': teacher_id,
             'date_added': datetime.now().strftime('%d.%m.%Y %H:%M'),
-            'payment_type': payment_type
+            'payment_type': payment_type,
+            # Урок уже списан выше - массовое списание за день его пропустит
+            'charged': True
         }
         add_confirmed_lesson(lesson_data)
 
@@ -880,11 +996,148 @@ async def reject_student_request(update: Update, context: ContextTypes.DEFAULT_T
         )
 
 
+async def check_auto_assign_callback(query):
+    """Автоподбор доступен только преподавателю"""
+    if not is_teacher(query.from_user.id):
+        await query.answer("❌ Только преподаватель может распределять слоты", show_alert=True)
+        return False
+    await query.answer()
+    return True
+
+
+async def handle_auto_assign_show(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Автоподбор: показать предложенное распределение (a:s)"""
+    if await check_auto_assign_callback(update.callback_query):
+        await show_auto_assignment(update, context)
+
+
+@deduplicate_callback
+async def handle_auto_assign_apply(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Автоподбор: утвердить предложение (a:y)"""
+    query = update.callback_query
+    if not await check_auto_assign_callback(query):
+        return
+
+    if context.user_data.get('auto_assignment'):
+        await apply_auto_assignment(update, context, query.from_user.id)
+    else:
+        # Предложение потеряно (например, после перезапуска) - считаем заново
+        await show_auto_assignment(update, context)
+
+
+async def handle_auto_assign_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Автоподбор: отмена (a:n)"""
+    query = update.callback_query
+    if not await check_auto_assign_callback(query):
+        return
+
+    context.user_data.pop('auto_assignment', None)
+    await safe_edit_message(query, "❌ Автоподбор отменен.")
+
+
+async def show_auto_assignment(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Рассчитывает распределение свободных слотов по всем заявкам и показывает его преподавателю"""
+    from config import build_slot_assignment
+
+    assignment = build_slot_assignment()
+
+    if not assignment:
+        await safe_edit_message(
+            update.callback_query,
+            "🤖 Автоподбор: нет заявок, которые можно удовлетворить свободными слотами."
+        )
+        return
+
+    # Сохраняем предложение, чтобы утвердить именно то, что видел преподаватель
+    context.user_data['auto_assignment'] = assignment
+
+    # Имена всех студентов распределения - одним запросом
+    student_names = get_user_names(assignment)
+
+    text = "🤖 Предложенное распределение:\n\n"
+    for student_id, slot_ids in assignment.items():
+        text += f"👤 {student_names.get(student_id) or 'Неизвестно'}\n"
+        for slot_id in slot_ids:
+            text += f"   • {get_slot_label(slot_id)}\n"
+        text += "\n"
+
+    total = sum(len(slot_ids) for slot_ids in assignment.values())
+    text += f"Всего: {total} занятий для {len(assignment)} студентов"
+
+    keyboard = [
+        [InlineKeyboardButton("✅ Утвердить все", callback_data=make_callback("a", "y"))],
+        [InlineKeyboardButton("❌ Отмена", callback_data=make_callback("a", "n"))]
+    ]
+
+    await safe_edit_message(update.callback_query, text, reply_markup=InlineKeyboardMarkup(keyboard))
+
+
+async def apply_auto_assignment(update: Update, context: ContextTypes.DEFAULT_TYPE, teacher_id: int):
+    """Подтверждает все занятия из предложенного распределения"""
+    assignment = context.user_data.pop('auto_assignment')
+
+    confirmed_total = 0
+    skipped_total = 0
+
+    notifications = []
+
+    for student_id, slot_ids in assignment.items():
+        confirmed_names = []
+        snapshot = None
+        for slot_id in slot_ids:
+            slot_name = get_slot_label(slot_id)
+            # confirm_single_slot_in_batch еще раз проверяет, что слот свободен
+            slot_snapshot = await confirm_single_slot_in_batch(context, student_id, slot_id, teacher_id, slot_name)
+            if slot_snapshot:
+                confirmed_names.append(slot_name)
+                snapshot = slot_snapshot
+            else:
+                skipped_total += 1
+
+        if not confirmed_names:
+            continue
+        confirmed_total += len(confirmed_names)
+
+        # Заявка выполнена - удаляем, иначе уменьшаем количество нужных уроков
+        request = get_schedule_request(student_id)
+        if request:
+            desired_left = get_desired_lessons(request) - len(confirmed_names)
+            if desired_left > 0 and request.get('selected_slots'):
+                request['desired_lessons'] = desired_left
+                save_schedule_request(request)
+            else:
+                delete_schedule_request(student_id)
+
+        # Баланс - из снимка последнего списания, без повторного чтения БД
+        lessons_text = "\n".join(f"{i}. {name}" for i, name in enumerate(confirmed_names, 1))
+        notifications.append((
+            student_id,
+            f"✅ *Запись на уроки подтверждена!*\n\n"
+            f"*Подтвержденные занятия:*\n{lessons_text}\n\n"
+            "*Адрес:*\n"
+            "4-й Сыромятнический переулок, 3/5с3\n"
+            "[Яндекс Карты](https://yandex.ru/maps/-/CPAfq2lq)\n\n"
+            "ℹ️ *Бесплатная отмена урока доступна не позже 10:00 предыдущего дня*\n\n"
+            f"Уроков осталось: {snapshot.lessons_left} шт.\n"
+            f"Баланс: {snapshot.display}\n"
+        ))
+
+    # Уведомления уходят через очередь рассылки, не задерживая ответ преподавателю
+    queue_notifications(context.application, notifications)
+
+    text = f"✅ Автоподбор утвержден: подтверждено {confirmed_total} занятий."
+    if skipped_total:
+        text += f"\n⚠️ Пропущено {skipped_total} слотов - они уже заняты."
+
+    await safe_edit_message(update.callback_query, text)
+
+
 async def show_my_lessons(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показывает подтвержденные занятия студента"""
     user_id = update.effective_user.id
 
-    lessons = get_confirmed_lessons(user_id)
+    # Предстоящие занятия из представления студента, уже отсортированные по времени
+    lessons = get_upcoming_view_lessons(get_student_view(user_id))
     if not lessons:
         await update.message.reply_text(
             "📭 У вас пока нет подтвержденных занятий.\n"
@@ -894,8 +1147,8 @@ async def show_my_lessons(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     lessons_text = "📋 *Ваши подтвержденные занятия:*\n\n"
 
-    for lesson in lessons:
-        lessons_text += f"• {lesson['slot_name']}\n"
+    for _, _, slot_name in lessons:
+        lessons_text += f"• {slot_name}\n"
 
     await update.message.reply_text(lessons_text, parse_mode='Markdown')
 
@@ -937,63 +1190,38 @@ async def send_reminder_to_student(context, student_id, lesson):
 
 def get_lesson_order(lesson):
     """Получает порядок занятия для сортировки"""
-    try:
-        slot_id = lesson['slot_id']
-
-        # Если это ручное занятие (начинается с manual_)
-        if slot_id.startswith('manual_'):
-            try:
-                # Пытаемся извлечь дату из названия занятия
-                slot_name = lesson['slot_name']
-                parts = slot_name.split()
-
-                date_str = None
-                time_str = None
-
-                for part in parts:
-                    if '.' in part and len(part.split('.')) == 3:
-                        date_str = part
-                    elif ':' in part and len(part.split(':')) == 2:
-                        time_str = part
-
-                if date_str and time_str:
-                    lesson_date = datetime.strptime(f"{date_str} {time_str}", "%d.%m.%Y %H:%M")
-                    day_num = lesson_date.weekday()  # 0-6 (пн=0)
-                    time_val = lesson_date.hour * 100 + lesson_date.minute
-                    return (day_num, time_val)
-            except:
-                return (0, 0)
-
-        # Если это обычное занятие из расписания (формат: dayX_YY)
-        elif slot_id.startswith('day'):
-            try:
-                # Извлекаем день из slot_id (формат: "day0_14")
-                day_num = int(slot_id[3])  # "day0_14" -> 0
-                time_part = slot_id.split('_')[1]
-                time_val = int(time_part) if time_part.isdigit() else 0
-                return (day_num, time_val)
-            except:
-                return (0, 0)
-
-        # Для любых других форматов
-        else:
-            return (0, 0)
-
-    except Exception as e:
-        print(f"Ошибка парсинга занятия {lesson.get('slot_name')}: {e}")
+    key = SCHEDULE_GRID.lesson_key(lesson)
+    if not key:
         return (0, 0)
 
+    lesson_date, time_str = key
+    return (lesson_date.weekday(), int(time_str.replace(':', '')))
+
 # Регистрируем обработчики
 schedule_handlers = [
     MessageHandler(filters.Regex("^📅 Выбрать расписание$"), choose_schedule),
     MessageHandler(filters.Regex("^🕐 Мои занятия$"), show_my_lessons),
-    CallbackQueryHandler(handle_schedule_buttons, pattern="^select_day_"),
-    CallbackQueryHandler(handle_schedule_buttons, pattern="^select_time_"),
-    CallbackQueryHandler(handle_schedule_buttons, pattern="^nav_day_"),
-    CallbackQueryHandler(handle_schedule_buttons, pattern="^show_selected"),
-    CallbackQueryHandler(handle_schedule_buttons, pattern="^finish_schedule"),
-    CallbackQueryHandler(handle_teacher_confirmation, pattern="^confirm_"),
-    CallbackQueryHandler(handle_teacher_confirmation, pattern="^reject_all_"),
-    CallbackQueryHandler(handle_teacher_confirmation, pattern="^confirmed_"),
-    CallbackQueryHandler(lambda update, context: update.callback_query.answer(), pattern="^ignore$"),
-]
\ No newline at end of file
+]
+
+# Маршруты callback-кнопок по пространствам, см. handlers/callback_router.py
+schedule_callback_routes = {
+    'd': handle_day_button,
+    'w': handle_week_button,
+    't': handle_time_button,
+    'n': handle_desired_button,
+    'q': handle_waitlist_button,
+    'l': handle_show_selected_button,
+    'f': handle_finish_button,
+}
+
+confirmation_callback_routes = {
+    't': handle_confirm_slot_button,
+    'm': handle_confirm_multiple_button,
+    'r': handle_reject_button,
+}
+
+auto_assign_callback_routes = {
+    's': handle_auto_assign_show,
+    'y': handle_auto_assign_apply,
+    'n': handle_auto_assign_cancel,
+}
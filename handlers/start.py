@@ -63,6 +63,13 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         help_text = f"""
 👨‍🏫 *Панель преподавателя*
 
+*Поиск студента:*
+/find <ФИО, инструмент или цель> - например `/find иван вокал`
+
+*Массовые операции с балансом:*
+/bulk - цена урока или пакет уроков для всех студентов инструмента
+Файл .csv (ID или ФИО; сумма) - импорт депозитов
+
 *Техническая поддержка бота:*
 📞 Написать разработчику: @{support_username} ({support_name})
 
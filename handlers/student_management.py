@@ -1,7 +1,8 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup
 from telegram.ext import ContextTypes, CallbackQueryHandler, MessageHandler, filters, ConversationHandler
-from config import is_teacher, get_all_students
+from config import is_teacher, CONVERSATION_TIMEOUT
 from database import get_user, delete_user, get_confirmed_lessons, get_student_balance
+from handlers.student_picker import StudentPicker
 import logging
 
 logger = logging.getLogger(__name__)
@@ -10,6 +11,25 @@ logger = logging.getLogger(__name__)
 STUDENT_MGMT_SELECT, STUDENT_MGMT_CONFIRM = range(2)
 
 
+def management_picker_button_text(student):
+    """Кнопка студента: ФИО и число занятий"""
+    if student['lessons_count']:
+        return f"{student['fio']} 📅({student['lessons_count']})"
+    return student['fio']
+
+
+# Постраничный список студентов с поиском (handlers/student_picker.py)
+management_student_picker = StudentPicker(
+    "m",
+    "🎓 *Управление студентами*\n\n"
+    "Выберите студента для удаления:\n"
+    "📅 - у студента есть запланированные занятия",
+    select_callback=lambda student_id: f"student_mgmt_select_{student_id}",
+    cancel_callback="student_mgmt_cancel",
+    button_text=management_picker_button_text
+)
+
+
 async def start_student_management(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Начало управления студентами (удаление)"""
     user_id = update.effective_user.id
@@ -18,40 +38,7 @@ async def start_student_management(update: Update, context: ContextTypes.DEFAULT
         await update.message.reply_text("❌ Доступ запрещен. Эта функция только для преподавателей.")
         return ConversationHandler.END
 
-    # Получаем список студентов
-    students = get_all_students()
-
-    if not students:
-        await update.message.reply_text("📭 Пока нет зарегистрированных студентов.")
-        return ConversationHandler.END
-
-    # Создаем клавиатуру со студентами
-    keyboard = []
-    for student in students:
-        # Формируем информацию о студенте
-        has_lessons = student['has_lessons']
-        lessons_count = student['lessons_count']
-
-        button_text = f"{student['fio']}"
-        if has_lessons:
-            button_text += f" 📅({lessons_count})"
-
-        keyboard.append([InlineKeyboardButton(
-            button_text,
-            callback_data=f"student_mgmt_select_{student['user_id']}"
-        )])
-
-    keyboard.append([InlineKeyboardButton("❌ Отмена", callback_data="student_mgmt_cancel")])
-
-    reply_markup = InlineKeyboardMarkup(keyboard)
-
-    await update.message.reply_text(
-        "🎓 *Управление студентами*\n\n"
-        "Выберите студента для удаления:\n"
-        "📅 - у студента есть запланированные занятия",
-        parse_mode='Markdown',
-        reply_markup=reply_markup
-    )
+    await management_student_picker.show(context, message=update.message)
 
     return STUDENT_MGMT_SELECT
 
@@ -184,7 +171,9 @@ student_management_conversation = ConversationHandler(
     entry_points=[MessageHandler(filters.Regex("^🗑 Удалить студента$"), start_student_management)],
     states={
         STUDENT_MGMT_SELECT: [
-            CallbackQueryHandler(select_student_for_management, pattern="^student_mgmt_")
+            CallbackQueryHandler(select_student_for_management, pattern="^student_mgmt_"),
+            management_student_picker.callback_handler(),
+            management_student_picker.search_handler()
         ],
         STUDENT_MGMT_CONFIRM: [
             CallbackQueryHandler(confirm_student_deletion, pattern="^student_mgmt_")
@@ -194,5 +183,8 @@ student_management_conversation = ConversationHandler(
         MessageHandler(filters.Regex("^❌ Отмена$"), cancel_student_management),
         MessageHandler(filters.Regex("^В главное меню$"), cancel_student_management),
     ],
-    per_message=False
+    per_message=False,
+    name="student_management",
+    persistent=True,
+    conversation_timeout=CONVERSATION_TIMEOUT
 )
\ No newline at end of file
@@ -0,0 +1,171 @@
+# student_picker.py
+"""
+Постраничный список выбора студента с поиском по началу ФИО и фильтрами.
+
+Используется в управлении балансом, занятиями, чате со студентом и удалении студента.
+Каждая страница - один запрос LIMIT/OFFSET по индексу users(role, fio_lower), поэтому
+время построения клавиатуры не зависит от числа студентов.
+
+Состояние списка (какой список открыт, фильтр, строка поиска) хранится
+в context.user_data['student_picker'], страница и фильтр - в callback_data (p:n:...).
+"""
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.ext import CallbackQueryHandler, MessageHandler, filters
+from telegram.helpers import escape_markdown
+
+from config import is_teacher
+from database import get_students_page
+from handlers.main_handler import MENU_BUTTONS
+from utils.callbacks import make_callback, parse_callback
+
+PICKER_PAGE_SIZE = 8
+PICKER_STATE_KEY = 'student_picker'
+
+# Фильтр -> (текст кнопки, инструмент)
+PICKER_FILTER_LABELS = {
+    'a': ("Все", None),
+    'd': ("💸 Долг", None),
+    'p': ("🎹", "Фортепиано"),
+    'v': ("🎤", "Вокал"),
+    'r': ("🎧", "Аранжировка"),
+}
+
+# Все зарегистрированные списки: имя -> StudentPicker
+PICKERS = {}
+
+
+class StudentPicker:
+    """Список выбора студента для одного раздела бота"""
+
+    def __init__(self, name, title, select_callback, cancel_callback, button_text):
+        self.name = name
+        self.title = title
+        self.select_callback = select_callback  # student_id -> callback_data кнопки студента
+        self.cancel_callback = cancel_callback
+        self.button_text = button_text  # строка страницы -> текст кнопки студента
+        PICKERS[name] = self
+
+    def render(self, page=0, filter_key='a', search=''):
+        """Возвращает (текст, клавиатура) страницы списка"""
+        instrument = PICKER_FILTER_LABELS[filter_key][1]
+        students, has_more = get_students_page(
+            search=search,
+            instrument=instrument,
+            debt_only=filter_key == 'd',
+            limit=PICKER_PAGE_SIZE,
+            offset=page * PICKER_PAGE_SIZE
+        )
+
+        keyboard = [
+            [InlineKeyboardButton(self.button_text(student), callback_data=self.select_callback(student['user_id']))]
+            for student in students
+        ]
+
+        # Листание
+        if page > 0 or has_more:
+            nav_row = []
+            if page > 0:
+                nav_row.append(InlineKeyboardButton(
+                    "◀️", callback_data=make_callback("p", "n", self.name, page - 1, filter_key)))
+            nav_row.append(InlineKeyboardButton(f"стр. {page + 1}", callback_data=make_callback("x")))
+            if has_more:
+                nav_row.append(InlineKeyboardButton(
+                    "▶️", callback_data=make_callback("p", "n", self.name, page + 1, filter_key)))
+            keyboard.append(nav_row)
+
+        # Фильтры (смена фильтра - с первой страницы)
+        keyboard.append([
+            InlineKeyboardButton(
+                f"• {label} •" if key == filter_key else label,
+                callback_data=make_callback("p", "n", self.name, 0, key)
+            )
+            for key, (label, _) in PICKER_FILTER_LABELS.items()
+        ])
+
+        if search:
+            keyboard.append([InlineKeyboardButton("✖️ Сбросить поиск", callback_data=make_callback("p", "c", self.name))])
+
+        keyboard.append([InlineKeyboardButton("❌ Отмена", callback_data=self.cancel_callback)])
+
+        text = f"{self.title}\n\n"
+        if search:
+            text += f"🔎 Поиск: *{escape_markdown(search)}*\n"
+        if not students:
+            text += "📭 Студенты не найдены.\n"
+        text += "_Отправьте начало ФИО, чтобы найти студента._"
+
+        return text, InlineKeyboardMarkup(keyboard)
+
+    async def show(self, context, message=None, query=None):
+        """Открывает список с первой страницы: новым сообщением или редактированием query"""
+        context.user_data[PICKER_STATE_KEY] = {'name': self.name, 'filter': 'a', 'search': ''}
+        text, reply_markup = self.render()
+
+        if query:
+            await query.edit_message_text(text, parse_mode='Markdown', reply_markup=reply_markup)
+        else:
+            await message.reply_text(text, parse_mode='Markdown', reply_markup=reply_markup)
+
+    def callback_handler(self):
+        """Обработчик листания и фильтров для состояния ConversationHandler"""
+        return CallbackQueryHandler(handle_picker_callback, pattern=f"^p:[nc]:{self.name}(:|$)")
+
+    def search_handler(self):
+        """Обработчик поиска (текст, кроме кнопок меню) для состояния ConversationHandler"""
+        async def search(update, context):
+            # Состояние диалога не меняется (обработчик возвращает None)
+            await handle_picker_search(update, context, self.name)
+
+        return MessageHandler(filters.TEXT & ~filters.COMMAND & ~filters.Text(MENU_BUTTONS), search)
+
+
+def get_picker_state(context, name):
+    """Состояние открытого списка name или None"""
+    state = context.user_data.get(PICKER_STATE_KEY)
+    if state and state.get('name') == name:
+        return state
+    return None
+
+
+async def handle_picker_callback(update, context):
+    """Листание, фильтр и сброс поиска (p:n:<список>:<страница>:<фильтр>, p:c:<список>)"""
+    query = update.callback_query
+    await query.answer()
+
+    if not is_teacher(query.from_user.id):
+        return
+
+    # В ConversationHandler аргументы не разобраны - разбираем так же, как маршрутизатор
+    if not context.args:
+        context.args = list(parse_callback(query.data).args)
+
+    name = context.args[0]
+    picker = PICKERS[name]
+    state = get_picker_state(context, name) or {'name': name, 'filter': 'a', 'search': ''}
+
+    if len(context.args) == 3:
+        page, state['filter'] = context.args[1], context.args[2]
+    else:
+        page, state['search'] = 0, ''
+
+    context.user_data[PICKER_STATE_KEY] = state
+    text, reply_markup = picker.render(page, state['filter'], state['search'])
+    await query.edit_message_text(text, parse_mode='Markdown', reply_markup=reply_markup)
+
+
+async def handle_picker_search(update, context, name):
+    """Поиск по началу ФИО в открытом списке name; возвращает True, если текст обработан"""
+    state = get_picker_state(context, name)
+    if not state or not is_teacher(update.effective_user.id):
+        return False
+
+    state['search'] = update.message.text.strip()[:50]
+    text, reply_markup = PICKERS[name].render(0, state['filter'], state['search'])
+    await update.message.reply_text(text, parse_mode='Markdown', reply_markup=reply_markup)
+    return True
+
+
+picker_callback_routes = {
+    'n': handle_picker_callback,
+    'c': handle_picker_callback,
+}
@@ -0,0 +1,56 @@
+# student_search.py
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.ext import ContextTypes
+from telegram.helpers import escape_markdown
+from config import is_teacher, format_balance
+from database import search_students
+from utils.callbacks import make_callback
+
+SEARCH_RESULTS_LIMIT = 10
+
+
+async def find_student_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /find <текст>: полнотекстовый поиск студента по ФИО, инструментам и целям"""
+    user_id = update.effective_user.id
+
+    if not is_teacher(user_id):
+        await update.message.reply_text("❌ Доступ запрещен. Эта функция только для преподавателей.")
+        return
+
+    text = ' '.join(context.args or []).strip()
+    if not text:
+        await update.message.reply_text(
+            "🔎 *Поиск студента*\n\n"
+            "Использование: `/find Иванова` или `/find вокал`\n"
+            "Можно вводить начало слов: `/find иван фортеп`",
+            parse_mode='Markdown'
+        )
+        return
+
+    students = search_students(text, limit=SEARCH_RESULTS_LIMIT)
+    if not students:
+        await update.message.reply_text(f"📭 По запросу «{text}» студенты не найдены.")
+        return
+
+    lines = [f"🔎 *Найдено студентов: {len(students)}*\n"]
+    keyboard = []
+    for i, student in enumerate(students, 1):
+        instruments = ', '.join(student.get('instruments') or [])
+        line = f"{i}. {escape_markdown(student['fio'])}"
+        if instruments:
+            line += f" ({escape_markdown(instruments)})"
+        line += f"\n    уроков: {student['lessons_left']}, баланс: {format_balance(student['balance'])}"
+        lines.append(line)
+
+        # Сразу переходим к студенту в нужном разделе
+        keyboard.append([
+            InlineKeyboardButton(f"{i}. 💰 Баланс", callback_data=make_callback("b", "s", student['user_id'])),
+            InlineKeyboardButton("✏️ Занятия", callback_data=f"lesson_mgmt_select_{student['user_id']}"),
+            InlineKeyboardButton("💬 Написать", callback_data=f"teacher_chat_{student['user_id']}"),
+        ])
+
+    await update.message.reply_text(
+        '\n'.join(lines),
+        parse_mode='Markdown',
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
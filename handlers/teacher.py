@@ -1,9 +1,12 @@
 # teacher.py
-from telegram import Update
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, MessageHandler, filters
-from config import is_teacher, get_birthday_info, get_user_role
-from database import get_all_users, get_confirmed_lessons, get_user
+from config import is_teacher, get_birthday_info, get_user_role, LESSON_DURATION_MINUTES, WEEKDAY_NAMES
+from database import get_all_users, get_user, get_students_report_rows, get_lessons_with_students_between, \
+    get_active_requests_with_students
 from keyboards.main_menu import show_main_menu
+from utils.callbacks import make_callback
+from utils.report import send_report
 from datetime import datetime, timedelta
 
 
@@ -19,22 +22,29 @@ async def teacher_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ Доступ запрещен. Эта функция только для преподавателей.")
         return
 
-    # Статистика
-    from database import get_user_count_by_role, get_total_confirmed_lessons, get_all_schedule_requests
+    # Статистика: готовые счетчики из dashboard_stats, без подсчета по всем таблицам
+    from database import get_dashboard_stats, get_lessons_count_between_days
 
-    total_students = get_user_count_by_role('student')
-    total_lessons = get_total_confirmed_lessons()
-    active_requests = len([r for r in get_all_schedule_requests() if r.get('selected_slots')])
+    stats = get_dashboard_stats()
+    today = datetime.now().date()
+    week_end = today + timedelta(days=6 - today.weekday())
+    week_lessons = get_lessons_count_between_days(today.isoformat(), week_end.isoformat())
 
     stats_text = (
         f"📊 *Панель управления преподавателя*\n\n"
-        f"• Всего студентов: {total_students}\n"
-        f"• Подтвержденных занятий: {total_lessons}\n"
-        f"• Активных заявок: {active_requests}\n\n"
+        f"• Всего студентов: {stats.get('students', 0)}\n"
+        f"• Подтвержденных занятий: {stats.get('confirmed_lessons', 0)}\n"
+        f"• Занятий до конца недели: {week_lessons}\n"
+        f"• Активных заявок: {stats.get('active_requests', 0)}\n"
+        f"• Предоплачено уроков: {stats.get('prepaid_lessons', 0)}\n"
+        f"• Общий долг студентов: {stats.get('total_debt', 0)} руб.\n\n"
         f"Используйте кнопки меню для управления:"
     )
 
-    await update.message.reply_text(stats_text, parse_mode='Markdown')
+    reply_markup = InlineKeyboardMarkup([
+        [InlineKeyboardButton("🧾 Списать уроки за сегодня", callback_data=make_callback("b", "t"))]
+    ])
+    await update.message.reply_text(stats_text, parse_mode='Markdown', reply_markup=reply_markup)
 
 
 async def show_students_list(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -45,26 +55,28 @@ async def show_students_list(update: Update, context: ContextTypes.DEFAULT_TYPE)
         await update.message.reply_text("❌ Доступ запрещен. Эта функция только для преподавателей.")
         return
 
-    # Получаем всех студентов из БД
-    students = get_all_users(role='student')
+    # Все студенты со счетчиком занятий одним запросом
+    students = get_students_report_rows()
 
     if not students:
         await update.message.reply_text("📭 Пока нет зарегистрированных студентов.")
         return
 
-    students_text = "🎓 *Список студентов:*\n\n"
+    await send_report(update.message, students_list_blocks(students))
+
+
+def students_list_blocks(students):
+    """Блоки отчета 'Список студентов': заголовок и по блоку на студента"""
+    yield "🎓 *Список студентов:*\n\n"
 
     for i, student in enumerate(students, 1):
-        confirmed_count = len(get_confirmed_lessons(student['user_id']))
-        students_text += (
+        yield (
             f"{i}. *{student['fio']}*\n"
             f"   Инструменты: {', '.join(student['instruments'])}\n"
-            f"   Занятий: {confirmed_count}\n"
-            f"   Цели: {student.get('goals', 'Не указаны')}\n\n"
+            f"   Занятий: {student['lessons_count']}\n"
+            f"   Цели: {student.get('goals') or 'Не указаны'}\n\n"
         )
 
-    await update.message.reply_text(students_text, parse_mode='Markdown')
-
 
 async def show_teacher_schedule(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показывает расписание преподавателя - группировка по дням с инструментами"""
@@ -74,66 +86,11 @@ async def show_teacher_schedule(update: Update, context: ContextTypes.DEFAULT_TY
         await update.message.reply_text("❌ Доступ запрещен. Эта функция только для преподавателей.")
         return
 
-    # Собираем все подтвержденные занятия всех студентов
-    all_lessons = get_confirmed_lessons()  # Все занятия
-
-    if not all_lessons:
-        await update.message.reply_text("📅 На этой неделе нет запланированных занятий.")
-        return
+    # Будущие и идущие сейчас занятия вместе с профилями студентов - один запрос, порядок из SQL
+    window_start = datetime.now() - timedelta(minutes=LESSON_DURATION_MINUTES)
+    lessons = get_lessons_with_students_between(window_start.strftime('%Y-%m-%d %H:%M'))
 
-    # СОРТИРУЕМ занятия по дате и времени
-    all_lessons_with_details = []
-    now = datetime.now()  # ← ДОБАВЛЕНО: текущее время для фильтрации
-
-    for lesson in all_lessons:
-        student_profile = get_user(lesson['user_id'])
-        if student_profile:
-            student_name = student_profile.get('fio', 'Неизвестный студент')
-            student_instruments = ', '.join(student_profile.get('instruments', []))
-
-            # Пропускаем списания урока через баланс
-            slot_name = lesson.get('slot_name', '')
-            if 'Ручное списание' in slot_name:
-                continue
-
-            # Парсим дату и время из slot_name для сортировки
-            date_str = ""
-            time_str = ""
-
-            parts = slot_name.split()
-            for part in parts:
-                if '.' in part and len(part.split('.')) == 3:
-                    date_str = part
-                elif ':' in part and len(part.split(':')) == 2:
-                    time_str = part
-
-            try:
-                if date_str and time_str:
-                    lesson_datetime = datetime.strptime(f"{date_str} {time_str}", "%d.%m.%Y %H:%M")
-
-                    # ФИЛЬТРАЦИЯ: пропускаем прошедшие занятия ← ДОБАВЛЕНО!
-                    lesson_end_time = lesson_datetime + timedelta(hours=1)  # занятие длится 1 час
-                    if lesson_end_time < now:
-                        continue  # ← Пропускаем прошедшие занятия!
-
-                else:
-                    lesson_datetime = datetime.max
-            except:
-                lesson_datetime = datetime.max
-
-            all_lessons_with_details.append({
-                'student_id': lesson['user_id'],
-                'student_name': student_name,
-                'student_instruments': student_instruments,
-                'slot_name': lesson['slot_name'],
-                'slot_id': lesson['slot_id'],
-                'date_str': date_str,
-                'time_str': time_str,
-                'datetime': lesson_datetime
-            })
-
-    # Проверяем, остались ли будущие занятия ← ДОБАВЛЕНО!
-    if not all_lessons_with_details:
+    if not lessons:
         await update.message.reply_text(
             "📅 *На будущие даты нет запланированных занятий.*\n\n"
             "Студенты могут выбрать расписание через '📅 Выбрать расписание'\n"
@@ -142,77 +99,39 @@ async def show_teacher_schedule(update: Update, context: ContextTypes.DEFAULT_TY
         )
         return
 
-    # Сортируем занятия по дате
-    all_lessons_with_details.sort(key=lambda x: x['datetime'])
-
-    # ... остальной код БЕЗ ИЗМЕНЕНИЙ (группировка по дням, формирование текста) ...
-    # Группируем занятия по дням
+    # Группировка по дням за один проход: занятия уже отсортированы по starts_at
     lessons_by_day = {}
-
-    for lesson in all_lessons_with_details:
-        # Извлекаем день из названия занятия
-        slot_name = lesson['slot_name']
-        parts = slot_name.split()
-
-        day_info = ""
-        for part in parts:
-            if part in ['Пн', 'Вт', 'Ср', 'Чт', 'Пт', 'Сб', 'Вс']:
-                day_info = part
-                break
-
-        # Ищем дату
-        date_info = lesson['date_str'] if lesson['date_str'] else ""
-
-        # Формируем ключ дня
-        day_key = f"{day_info} {date_info}" if date_info else day_info
-
-        if day_key not in lessons_by_day:
-            lessons_by_day[day_key] = []
-
-        lessons_by_day[day_key].append({
-            'time': lesson['time_str'],
-            'student_name': lesson['student_name'],
-            'instruments': lesson['student_instruments'],
-            'datetime': lesson['datetime']
+    for lesson in lessons:
+        lesson_date, time_str = lesson['starts_at'].split(' ')
+        day = datetime.strptime(lesson_date, '%Y-%m-%d')
+        day_key = f"{WEEKDAY_NAMES[day.weekday()]} {day.strftime('%d.%m.%Y')}"
+
+        lessons_by_day.setdefault(day_key, []).append({
+            'time': time_str,
+            'student_name': lesson['fio'] or 'Неизвестный студент',
+            'instruments': ', '.join(lesson['instruments'])
         })
 
-    # Сортируем дни по порядку (по дате, а не по названию дня)
-    def get_day_datetime(day_key):
-        try:
-            # Извлекаем дату из ключа
-            parts = day_key.split()
-            for part in parts:
-                if '.' in part and len(part.split('.')) == 3:
-                    return datetime.strptime(part, "%d.%m.%Y")
-        except:
-            pass
-        return datetime.max
-
-    sorted_days = sorted(lessons_by_day.keys(), key=get_day_datetime)
-
-    # Формируем сообщение с группировкой по дням
-    schedule_text = "📋 *Ваше расписание (только будущие занятия):*\n\n"  # ← ИЗМЕНЕНО!
+    await send_report(update.message, schedule_blocks(lessons_by_day, len(lessons)))
 
-    for day in sorted_days:
-        schedule_text += f"*{day}:*\n"
 
-        # Сортируем занятия по времени внутри дня
-        day_lessons = lessons_by_day[day]
-        day_lessons.sort(key=lambda x: x['datetime'])
+def schedule_blocks(lessons_by_day, total_lessons):
+    """Блоки отчета 'Расписание': заголовок, по блоку на день, итог"""
+    yield "📋 *Ваше расписание (только будущие занятия):*\n\n"
 
+    for day, day_lessons in lessons_by_day.items():
+        lines = [f"*{day}:*\n"]
         for lesson in day_lessons:
-            schedule_text += f"• *{lesson['time']}* - {lesson['student_name']} "
+            line = f"• *{lesson['time']}* - {lesson['student_name']} "
             if lesson['instruments']:
-                schedule_text += f"({lesson['instruments']})"
-            schedule_text += "\n"
+                line += f"({lesson['instruments']})"
+            lines.append(line + "\n")
+        lines.append("\n")
 
-        schedule_text += "\n"
+        yield ''.join(lines)
 
     # Добавляем общее количество занятий
-    total_lessons = len(all_lessons_with_details)
-    schedule_text += f"*Всего будущих занятий:* {total_lessons}"
-
-    await update.message.reply_text(schedule_text, parse_mode='Markdown')
+    yield f"*Всего будущих занятий:* {total_lessons}"
 
 
 async def show_student_requests(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -223,39 +142,43 @@ async def show_student_requests(update: Update, context: ContextTypes.DEFAULT_TY
         await update.message.reply_text("❌ Доступ запрещен. Эта функция только для преподавателей.")
         return
 
-    # Фильтруем активные заявки (где есть выбранные слоты)
-    from config import get_schedule_requests_dict
-    schedule_requests = get_schedule_requests_dict()
-    active_requests = {sid: request for sid, request in schedule_requests.items()
-                       if request.get('selected_slots')}
+    # Активные заявки (где есть выбранные слоты) сразу с профилями студентов - один запрос
+    active_requests = get_active_requests_with_students()
 
     if not active_requests:
         await update.message.reply_text("📭 На данный момент студенты не отправили заявок на занятия.")
         return
 
-    requests_text = "📋 *Заявки от студентов:*\n\n"
+    # Автоматическое распределение свободных слотов по всем заявкам
+    reply_markup = InlineKeyboardMarkup([[InlineKeyboardButton("🤖 Автоподбор", callback_data=make_callback("a", "s"))]])
+
+    await send_report(update.message, requests_blocks(active_requests), reply_markup=reply_markup)
+
+
+def requests_blocks(active_requests):
+    """Блоки отчета 'Заявки студентов': заголовок и по блоку на заявку"""
+    from config import get_slot_label
 
-    for i, (student_id, request) in enumerate(active_requests.items(), 1):
-        student_profile = get_user(student_id)
-        student_name = student_profile.get('fio', 'Неизвестный студент') if student_profile else 'Неизвестный студент'
-        instruments = student_profile.get('instruments', []) if student_profile else []
-        goals = student_profile.get('goals', 'Не указаны') if student_profile else 'Не указаны'
+    # Название каждого слота считается один раз за отчет, даже если его выбрали несколько студентов
+    slot_labels = {}
 
-        requests_text += f"*{i}. {student_name}*\n"
-        requests_text += f"   Инструменты: {', '.join(instruments)}\n"
-        requests_text += f"   Цели: {goals}\n"
-        requests_text += f"   Выбранные слоты:\n"
+    yield "📋 *Заявки от студентов:*\n\n"
 
-        # Получаем названия слотов
-        from config import get_available_slots_for_user
-        all_slots = get_available_slots_for_user(student_id)
-        for slot_id in request.get('selected_slots', []):
-            slot_name = all_slots.get(slot_id, f"Слот {slot_id}")
-            requests_text += f"   • {slot_name}\n"
+    for i, request in enumerate(active_requests.values(), 1):
+        lines = [
+            f"*{i}. {request['fio'] or 'Неизвестный студент'}*\n",
+            f"   Инструменты: {', '.join(request['instruments'])}\n",
+            f"   Цели: {request['goals'] or 'Не указаны'}\n",
+            f"   Выбранные слоты:\n",
+        ]
 
-        requests_text += "\n"
+        for slot_id in request['selected_slots']:
+            if slot_id not in slot_labels:
+                slot_labels[slot_id] = get_slot_label(slot_id)
+            lines.append(f"   • {slot_labels[slot_id]}\n")
 
-    await update.message.reply_text(requests_text, parse_mode='Markdown')
+        lines.append(f"   Нужно уроков: {request.get('desired_lessons') or 1}\n\n")
+        yield ''.join(lines)
 
 
 async def show_teacher_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -274,7 +197,6 @@ async def handle_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик кнопки 'В главное меню'"""
     user_id = update.effective_user.id
     user_role = get_user_role(user_id)
-    from database import get_user
     profile = get_user(user_id)
     has_profile = True if user_role == "teacher" else (profile and profile.get('fio'))
 
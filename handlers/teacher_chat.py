@@ -1,6 +1,7 @@
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup
+from telegram import Update, ReplyKeyboardMarkup
 from telegram.ext import ContextTypes, CallbackQueryHandler, MessageHandler, filters, ConversationHandler
-from config import user_profiles, is_teacher
+from config import user_profiles, is_teacher, CONVERSATION_TIMEOUT
+from handlers.student_picker import StudentPicker
 import logging
 
 logger = logging.getLogger(__name__)
@@ -9,6 +10,16 @@ logger = logging.getLogger(__name__)
 TEACHER_CHOOSE_STUDENT, TEACHER_WRITE_MESSAGE = range(2)
 
 
+# Постраничный список студентов с поиском (handlers/student_picker.py)
+chat_student_picker = StudentPicker(
+    "c",
+    "💬 *Выберите студента для отправки сообщения:*",
+    select_callback=lambda student_id: f"teacher_chat_{student_id}",
+    cancel_callback="teacher_chat_cancel",
+    button_text=lambda student: f"{student['fio']} 📅" if student['lessons_count'] else student['fio']
+)
+
+
 async def start_teacher_chat(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Начало отправки сообщения студенту"""
     user_id = update.effective_user.id
@@ -17,40 +28,7 @@ async def start_teacher_chat(update: Update, context: ContextTypes.DEFAULT_TYPE)
         await update.message.reply_text("❌ Доступ запрещен.")
         return ConversationHandler.END
 
-    # Получаем список студентов ИЗ БАЗЫ ДАННЫХ
-    from database import get_all_users
-    all_users = get_all_users()
-    students = {}
-    for user in all_users:
-        if not is_teacher(user['user_id']) and user.get('fio'):
-            students[user['user_id']] = user
-
-    if not students:
-        await update.message.reply_text("📭 Пока нет зарегистрированных студентов.")
-        return ConversationHandler.END
-
-    # Создаем клавиатуру со студентами
-    keyboard = []
-    for student_id, profile in students.items():
-        # Проверяем есть ли у студента занятия
-        from config import confirmed_lessons
-        has_lessons = student_id in confirmed_lessons and confirmed_lessons[student_id]
-
-        button_text = f"{profile['fio']}"
-        if has_lessons:
-            button_text += " 📅"
-
-        keyboard.append([InlineKeyboardButton(button_text, callback_data=f"teacher_chat_{student_id}")])
-
-    keyboard.append([InlineKeyboardButton("❌ Отмена", callback_data="teacher_chat_cancel")])
-
-    reply_markup = InlineKeyboardMarkup(keyboard)
-
-    await update.message.reply_text(
-        "💬 *Выберите студента для отправки сообщения:*",
-        parse_mode='Markdown',
-        reply_markup=reply_markup
-    )
+    await chat_student_picker.show(context, message=update.message)
 
     return TEACHER_CHOOSE_STUDENT
 
@@ -60,6 +38,9 @@ async def choose_student(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
 
+    if not is_teacher(query.from_user.id):
+        return ConversationHandler.END
+
     if query.data == "teacher_chat_cancel":
         await query.edit_message_text("❌ Отправка сообщения отменена.")
         return ConversationHandler.END
@@ -175,10 +156,16 @@ async def cancel_teacher_chat(update: Update, context: ContextTypes.DEFAULT_TYPE
 
 # Создаем ConversationHandler
 teacher_chat_conversation = ConversationHandler(
-    entry_points=[MessageHandler(filters.Regex("^💬 Написать студенту$"), start_teacher_chat)],
+    entry_points=[
+        MessageHandler(filters.Regex("^💬 Написать студенту$"), start_teacher_chat),
+        # Переход к студенту из результатов поиска /find
+        CallbackQueryHandler(choose_student, pattern=r"^teacher_chat_\d+$")
+    ],
     states={
         TEACHER_CHOOSE_STUDENT: [
-            CallbackQueryHandler(choose_student, pattern="^teacher_chat_")
+            CallbackQueryHandler(choose_student, pattern="^teacher_chat_"),
+            chat_student_picker.callback_handler(),
+            chat_student_picker.search_handler()
         ],
         TEACHER_WRITE_MESSAGE: [
             MessageHandler(filters.TEXT & ~filters.COMMAND, send_message_to_student)
@@ -188,5 +175,8 @@ teacher_chat_conversation = ConversationHandler(
         MessageHandler(filters.Regex("^/cancel$"), cancel_teacher_chat),
         MessageHandler(filters.Regex("^В главное меню$"), cancel_teacher_chat)
     ],
-    per_message=False
+    per_message=False,
+    name="teacher_chat",
+    persistent=True,
+    conversation_timeout=CONVERSATION_TIMEOUT
 )
\ No newline at end of file
@@ -0,0 +1,183 @@
+# waitlist.py
+"""
+Лист ожидания занятых слотов.
+
+Студент нажимает на занятое время (⛔) в выборе расписания и встает в очередь
+на этот слот. Когда занятие удаляют (отмена преподавателем, удаление студента),
+database.py публикует событие LessonCancelled с освободившимися слотами, и первому
+в очереди сразу уходит предложение записаться - без периодических проверок.
+Отказ или молчание дольше WAITLIST_OFFER_TIMEOUT передает предложение следующему.
+Запись списывает урок с баланса, как подтверждение заявки.
+"""
+import logging
+from datetime import datetime
+
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.ext import ContextTypes
+
+from config import TEACHER_IDS, WAITLIST_OFFER_TIMEOUT, get_slot_label, is_slot_free, is_slot_bookable, \
+    book_waitlist_slot, remove_slot_from_all_requests, format_balance
+from database import get_next_waitlisted, remove_from_waitlist, get_user
+from utils.callbacks import make_callback, slot_args, slot_from_args
+from utils.events import event_bus, LessonCancelled
+from utils.inflight import deduplicate_callback
+from utils.notifications import queue_notifications
+
+logger = logging.getLogger(__name__)
+
+
+def is_slot_ahead(slot_id):
+    """Слот еще впереди и в горизонте бронирования"""
+    return is_slot_bookable(slot_id) and datetime.strptime(slot_id, '%Y%m%d_%H%M') > datetime.now()
+
+
+def is_slot_open(slot_id):
+    """Слот еще впереди, в горизонте бронирования и никем не занят"""
+    return is_slot_ahead(slot_id) and is_slot_free(slot_id)
+
+
+def waitlist_offer(slot_id):
+    """Предложение первому в очереди: (текст, клавиатура)"""
+    text = (
+        f"🔔 *Освободилось время!*\n\n"
+        f"*Занятие:* {get_slot_label(slot_id)}\n\n"
+        f"Вы первый в листе ожидания на это время. Записаться?\n"
+        f"Предложение действует {WAITLIST_OFFER_TIMEOUT // 60} мин, затем перейдет следующему."
+    )
+    keyboard = InlineKeyboardMarkup([[
+        InlineKeyboardButton("✅ Записаться", callback_data=make_callback("w", "y", *slot_args(slot_id))),
+        InlineKeyboardButton("❌ Отказаться", callback_data=make_callback("w", "n", *slot_args(slot_id))),
+    ]])
+    return text, keyboard
+
+
+def offer_job_name(slot_id):
+    return f"waitlist_offer_{slot_id}"
+
+
+def cancel_offer_timeout(application, slot_id):
+    """Снимает таймер предложения слота (ответ получен или предложение ушло другому)"""
+    if application.job_queue:
+        for job in application.job_queue.get_jobs_by_name(offer_job_name(slot_id)):
+            job.schedule_removal()
+
+
+def start_offer_timeout(application, slot_id, student_id):
+    """Через WAITLIST_OFFER_TIMEOUT без ответа предложение перейдет следующему в очереди"""
+    if not application.job_queue:
+        logger.warning("JobQueue недоступен: предложения листа ожидания не истекают")
+        return
+
+    cancel_offer_timeout(application, slot_id)
+    application.job_queue.run_once(
+        expire_waitlist_offer, WAITLIST_OFFER_TIMEOUT,
+        data={'slot_id': slot_id, 'user_id': student_id},
+        name=offer_job_name(slot_id)
+    )
+
+
+def offer_freed_slots(application, slot_ids):
+    """Отправляет предложение первому в очереди на каждый освободившийся слот"""
+    offers = []
+    for slot_id in dict.fromkeys(slot_ids):
+        if not is_slot_open(slot_id):
+            continue
+        student_id = get_next_waitlisted(slot_id)
+        if student_id:
+            offers.append((student_id, *waitlist_offer(slot_id)))
+            start_offer_timeout(application, slot_id, student_id)
+
+    if offers:
+        logger.info(f"Лист ожидания: предложено слотов {len(offers)}")
+    return queue_notifications(application, offers)
+
+
+async def expire_waitlist_offer(context: ContextTypes.DEFAULT_TYPE):
+    """Задача JobQueue: студент не ответил на предложение - передаем слот следующему"""
+    slot_id = context.job.data['slot_id']
+    student_id = context.job.data['user_id']
+
+    # Слот уже заняли - предлагать нечего, студент остается в очереди
+    if not is_slot_open(slot_id):
+        return
+
+    if remove_from_waitlist(slot_id, student_id):
+        queue_notifications(context.application, [(
+            student_id,
+            f"⌛ Время ответа истекло: {get_slot_label(slot_id)} предложено следующему в листе ожидания."
+        )], parse_mode=None)
+        offer_freed_slots(context.application, [slot_id])
+
+
+def register_waitlist(application):
+    """Подписывает лист ожидания на отмену занятий"""
+    async def offer_cancelled_slots(event):
+        # Асинхронный подписчик: очередь проверяется уже после ответа на отмену
+        offer_freed_slots(application, event.slot_ids)
+
+    event_bus.subscribe(offer_cancelled_slots, LessonCancelled)
+
+
+@deduplicate_callback
+async def accept_waitlist_offer(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Студент принимает освободившийся слот (w:y:<дата>:<время>)"""
+    query = update.callback_query
+    student_id = query.from_user.id
+    slot_id = slot_from_args(*context.args)
+    slot_name = get_slot_label(slot_id)
+
+    # Проверка занятости и запись - одна транзакция, без await между ними
+    result = book_waitlist_slot(student_id, slot_id) if is_slot_ahead(slot_id) else ('taken',)
+
+    if result[0] == 'stale':
+        await query.answer("❌ Предложение устарело", show_alert=True)
+        return
+
+    await query.answer()
+    if result[0] == 'taken':
+        await query.edit_message_text(
+            f"😔 Время {slot_name} уже занято или прошло.\n"
+            f"Если вы в листе ожидания, мы напишем, когда оно освободится снова."
+        )
+        return
+
+    _, lesson, balance, _ = result
+    cancel_offer_timeout(context.application, slot_id)
+    remove_slot_from_all_requests(slot_id)
+
+    await query.edit_message_text(
+        f"✅ *Вы записаны на занятие!*\n\n"
+        f"*Дата и время:* {slot_name}\n"
+        f"*Оплата:* {lesson['payment_type']}\n\n"
+        f"Уроков осталось: {balance['lessons_left']} шт.\n"
+        f"Баланс: {format_balance(balance['balance'])}\n\n"
+        f"Занятие появится в разделе '🕐 Мои занятия'.",
+        parse_mode='Markdown'
+    )
+
+    student_name = (get_user(student_id) or {}).get('fio', 'Студент')
+    queue_notifications(context.application, [
+        (teacher_id, f"🔔 Лист ожидания: {student_name} записан(а) на освободившееся время {slot_name} "
+                     f"({lesson['payment_type']})")
+        for teacher_id in TEACHER_IDS
+    ], parse_mode=None)
+
+
+@deduplicate_callback
+async def decline_waitlist_offer(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Студент отказывается от слота - предложение уходит следующему (w:n:<дата>:<время>)"""
+    query = update.callback_query
+    slot_id = slot_from_args(*context.args)
+    await query.answer()
+
+    if remove_from_waitlist(slot_id, query.from_user.id):
+        cancel_offer_timeout(context.application, slot_id)
+        offer_freed_slots(context.application, [slot_id])
+
+    await query.edit_message_text(f"👌 Вы отказались от времени {get_slot_label(slot_id)} и убраны из листа ожидания.")
+
+
+waitlist_callback_routes = {
+    'y': accept_waitlist_offer,
+    'n': decline_waitlist_offer,
+}
@@ -1,8 +1,10 @@
 from telegram import Update
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, CallbackQueryHandler, ContextTypes
-from config import BOT_TOKEN, cleanup_weekly_requests
+from telegram.ext import Application, CommandHandler, MessageHandler, TypeHandler, filters, ContextTypes
+from config import BOT_TOKEN, cleanup_weekly_requests, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_LISTEN, \
+    WEBHOOK_PORT, WEBHOOK_SECRET, WEBHOOK_REGISTER, WEBHOOK_RECORD_FILE, MAX_CONCURRENT_UPDATES, \
+    PERSISTENCE_INTERVAL, USER_STATE_TTL, USER_STATE_SWEEP_INTERVAL
 from handlers.start import start, help_command, profile_command
-from handlers.main_handler import main_message_handler_obj
+from handlers.main_handler import main_message_handler_obj, build_menu_routes
 from handlers.feedback import feedback_conversation
 from handlers.profile_conversation import create_profile_conversation, edit_profile_conversation
 from handlers.reminders import check_and_send_reminders
@@ -11,7 +13,16 @@ from handlers.teacher import show_upcoming_birthdays
 from handlers.teacher_chat import teacher_chat_conversation
 from handlers.lesson_management import lesson_management_conversation
 from handlers.student_management import student_management_conversation
+from handlers.student_search import find_student_command
+from handlers.bulk_balance import bulk_command, deposit_csv_handler
+from handlers.waitlist import register_waitlist
+from utils.webhook_server import WebhookServer
+from utils.update_processor import PerChatUpdateProcessor
+from utils.persistence import SQLitePersistence
+from utils.user_state import touch_user_state, sweep_user_state
+import asyncio
 import logging
+import signal
 
 
 logging.basicConfig(
@@ -31,15 +42,20 @@ def main():
         .read_timeout(30.0) \
         .write_timeout(30.0) \
         .pool_timeout(30.0) \
+        .concurrent_updates(PerChatUpdateProcessor(MAX_CONCURRENT_UPDATES)) \
+        .persistence(SQLitePersistence(update_interval=PERSISTENCE_INTERVAL)) \
         .build()
 
     try:
         from config import cleanup_old_requests
         removed = cleanup_old_requests()
-        print(f"🧹 Очищено {removed} старых заявок")
+        print(f"🧹 Удалено {removed} прошедших слотов из заявок")
     except Exception as e:
         print(f"⚠️ Не удалось очистить старые заявки: {e}")
 
+    # 0. Отметка активности пользователя (для очистки устаревших user_data)
+    application.add_handler(TypeHandler(Update, touch_user_state), group=-1)
+
     # 1. ConversationHandler
     application.add_handler(create_profile_conversation)
     application.add_handler(edit_profile_conversation)
@@ -56,41 +72,26 @@ def main():
     application.add_handler(CommandHandler("profile", profile_command))
     application.add_handler(CommandHandler("menu", start))
     application.add_handler(CommandHandler("birthdays", show_upcoming_birthdays))
+    application.add_handler(CommandHandler("find", find_student_command))
+    application.add_handler(CommandHandler("bulk", bulk_command))
+
+    # Импорт депозитов из CSV-выписки
+    application.add_handler(deposit_csv_handler)
 
-    # 3. ГЛАВНЫЙ обработчик сообщений
+    # 3. ГЛАВНЫЙ обработчик сообщений (таблица маршрутов меню строится один раз)
+    build_menu_routes()
     application.add_handler(main_message_handler_obj)
 
-    # 4. CallbackQueryHandler из balance.py
-    from handlers.balance import (
-        select_student, handle_action_choice, show_student_statistics,
-        charge_lesson, cancel_balance_management
-    )
+    # 4. Все callback-кнопки вне диалогов: один обработчик со словарем маршрутов
+    from handlers.callback_router import callback_router, stale_button_handler
+    application.add_handler(callback_router.handler())
+    # Кнопки, которые не принял ни один обработчик выше
+    application.add_handler(stale_button_handler)
 
-    application.add_handler(CallbackQueryHandler(select_student, pattern="^balance_select_"))
-    application.add_handler(CallbackQueryHandler(handle_action_choice, pattern="^balance_"))
-    application.add_handler(CallbackQueryHandler(show_student_statistics, pattern="^balance_statistics$"))
-    application.add_handler(CallbackQueryHandler(charge_lesson, pattern="^balance_charge_lesson$"))
-    application.add_handler(CallbackQueryHandler(charge_lesson, pattern="^balance_confirm_lesson$"))
-    application.add_handler(CallbackQueryHandler(cancel_balance_management, pattern="^balance_cancel$"))
+    # Лист ожидания: предложение освободившегося слота сразу после отмены занятия
+    register_waitlist(application)
 
-    # 5. CallbackQueryHandler из schedule.py
-    try:
-        from handlers.schedule import (
-            handle_schedule_buttons, handle_teacher_confirmation
-        )
-        application.add_handler(CallbackQueryHandler(handle_schedule_buttons, pattern="^select_day_"))
-        application.add_handler(CallbackQueryHandler(handle_schedule_buttons, pattern="^select_time_"))
-        application.add_handler(CallbackQueryHandler(handle_schedule_buttons, pattern="^nav_day_"))
-        application.add_handler(CallbackQueryHandler(handle_schedule_buttons, pattern="^show_selected"))
-        application.add_handler(CallbackQueryHandler(handle_schedule_buttons, pattern="^finish_schedule"))
-        application.add_handler(CallbackQueryHandler(handle_teacher_confirmation, pattern="^confirm_"))
-        application.add_handler(CallbackQueryHandler(handle_teacher_confirmation, pattern="^reject_all_"))
-        application.add_handler(
-            CallbackQueryHandler(lambda update, context: update.callback_query.answer(), pattern="^ignore$"))
-    except ImportError as e:
-        print(f"⚠️ Warning: Could not import schedule handlers: {e}")
-
-    # 6. НАСТРОЙКА ВСЕХ НАПОМИНАНИЙ - JobQueue
+    # 5. НАСТРОЙКА ВСЕХ НАПОМИНАНИЙ - JobQueue
     job_queue = application.job_queue
 
     if job_queue:
@@ -112,7 +113,7 @@ def main():
             name="birthday_reminders"
         )
 
-        # 3. ОЧИСТКА СТАРЫХ ЗАЯВОК КАЖДЫЙ ПОНЕДЕЛЬНИК В 8:00
+        # 3. ОЧИСТКА ПРОШЕДШИХ СЛОТОВ В ЗАЯВКАХ КАЖДЫЙ ПОНЕДЕЛЬНИК В 8:00
         job_queue.run_daily(
             cleanup_weekly_requests,
             time=time(hour=5, minute=0),  # 8:00 Москва = 5:00 UTC
@@ -120,6 +121,15 @@ def main():
             name="weekly_cleanup"
         )
 
+        # 4. ОЧИСТКА ВРЕМЕННЫХ ДАННЫХ НЕАКТИВНЫХ ПОЛЬЗОВАТЕЛЕЙ
+        job_queue.run_repeating(
+            sweep_user_state,
+            interval=USER_STATE_SWEEP_INTERVAL,
+            first=USER_STATE_SWEEP_INTERVAL,
+            data=USER_STATE_TTL,
+            name="user_state_sweep"
+        )
+
         print("=" * 50)
         print("🎹 Бот музыкальной школы запущен!")
         print("=" * 50)
@@ -128,6 +138,7 @@ def main():
         print("   • О днях рождения: каждый день в 10:00 по Москве")
         print("   • Очистка заявок: каждый понедельник в 8:00")
         print("   • Очистка занятий: каждый день в 03:05 (храним 30 дней)")
+        print(f"   • Очистка user_data: каждые {USER_STATE_SWEEP_INTERVAL // 60} мин")
         print("=" * 50)
 
     else:
@@ -140,10 +151,13 @@ def main():
     # Запуск бота
     print("\n🔄 Бот запускается...")
     try:
-        application.run_polling(
-            allowed_updates=Update.ALL_TYPES,
-            drop_pending_updates=True
-        )
+        if WEBHOOK_URL:
+            asyncio.run(run_webhook(application))
+        else:
+            application.run_polling(
+                allowed_updates=Update.ALL_TYPES,
+                drop_pending_updates=True
+            )
     except KeyboardInterrupt:
         print("\n🛑 Бот остановлен пользователем")
     except Exception as e:
@@ -151,6 +165,43 @@ def main():
         logger.error(f"Critical error: {e}", exc_info=True)
 
 
+async def run_webhook(application):
+    """Режим вебхука: встроенный HTTP-приемник вместо long polling"""
+    if not WEBHOOK_SECRET:
+        raise RuntimeError("Для режима вебхука нужно задать WEBHOOK_SECRET")
+
+    server = WebhookServer(application, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH,
+                           WEBHOOK_SECRET, WEBHOOK_RECORD_FILE or None)
+
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            pass  # Windows: остановка через KeyboardInterrupt
+
+    async with application:
+        if WEBHOOK_REGISTER:
+            # drop_pending_updates=False: обновления, накопившиеся за время деплоя, не теряются
+            await application.bot.set_webhook(
+                url=WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH,
+                secret_token=WEBHOOK_SECRET,
+                allowed_updates=Update.ALL_TYPES,
+                drop_pending_updates=False
+            )
+        await application.start()
+        await server.start()
+        print(f"🌐 Режим вебхука: {WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH} -> {WEBHOOK_LISTEN}:{WEBHOOK_PORT}")
+
+        try:
+            await stop_event.wait()
+        finally:
+            await server.stop()
+            await application.stop()
+    print("\n🛑 Бот остановлен")
+
+
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик ошибок"""
     logger.error(f"Exception while handling an update: {context.error}", exc_info=True)
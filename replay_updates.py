@@ -0,0 +1,61 @@
+# replay_updates.py
+"""
+Воспроизведение записанных обновлений Telegram для локальной проверки режима вебхука.
+
+Запуск бота локально:
+    WEBHOOK_URL=http://localhost WEBHOOK_SECRET=test WEBHOOK_REGISTER=0 python main.py
+
+Отправка обновлений (файл - по одному JSON на строку, например WEBHOOK_RECORD_FILE):
+    python replay_updates.py updates.jsonl --secret test
+"""
+import argparse
+import json
+import time
+import urllib.error
+import urllib.request
+
+
+def post_update(url, secret, update):
+    """Отправляет одно обновление так же, как это делает Telegram; возвращает HTTP-статус"""
+    request = urllib.request.Request(
+        url,
+        data=json.dumps(update).encode('utf-8'),
+        headers={
+            'Content-Type': 'application/json',
+            'X-Telegram-Bot-Api-Secret-Token': secret,
+        },
+        method='POST'
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Отправка записанных обновлений на локальный вебхук")
+    parser.add_argument('file', help="JSONL-файл с обновлениями")
+    parser.add_argument('--url', default='http://127.0.0.1:8080/telegram')
+    parser.add_argument('--secret', required=True)
+    parser.add_argument('--delay', type=float, default=0.0, help="пауза между обновлениями, сек")
+    args = parser.parse_args()
+
+    sent = 0
+    with open(args.file, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            update = json.loads(line)
+            status = post_update(args.url, args.secret, update)
+            print(f"update_id={update.get('update_id')}: HTTP {status}")
+            sent += 1
+            if args.delay:
+                time.sleep(args.delay)
+
+    print(f"Отправлено обновлений: {sent}")
+
+
+if __name__ == '__main__':
+    main()
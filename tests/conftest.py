@@ -0,0 +1,22 @@
+# conftest.py
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# database.py создает music_school.db в текущем каталоге при импорте -
+# тесты не должны трогать рабочую базу
+os.chdir(tempfile.mkdtemp(prefix='music_school_tests_'))
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """Чистая база в отдельном каталоге теста"""
+    monkeypatch.chdir(tmp_path)
+    import database
+    database.init_database()
+    return database
@@ -0,0 +1,38 @@
+# test_bulk_balance.py
+from handlers.bulk_balance import parse_deposit_csv
+
+
+def test_semicolon_with_comma_decimals():
+    rows, errors = parse_deposit_csv("Иванова Анна Сергеевна;3000,00\nПетров Петр;1 500,00\n")
+    assert rows == [(1, 'Иванова Анна Сергеевна', 3000), (2, 'Петров Петр', 1500)]
+    assert errors == []
+
+
+def test_tab_separated():
+    rows, errors = parse_deposit_csv("Иванова Анна\t3 000,00\nПетров Петр\t1500\n")
+    assert rows == [(1, 'Иванова Анна', 3000), (2, 'Петров Петр', 1500)]
+    assert errors == []
+
+
+def test_comma_separated_with_header():
+    rows, errors = parse_deposit_csv("ФИО,Сумма\nИванова Анна,3000\nПетров Петр,1500.00\n")
+    assert rows == [(2, 'Иванова Анна', 3000), (3, 'Петров Петр', 1500)]
+    assert errors == []
+
+
+def test_header_after_blank_lines():
+    rows, errors = parse_deposit_csv("\n\nФИО;Сумма\nИванова Анна;3000\n")
+    assert rows == [(4, 'Иванова Анна', 3000)]
+    assert errors == []
+
+
+def test_telegram_id_rows():
+    rows, errors = parse_deposit_csv("ID;Сумма\n123456789;3000\n987654321;1 500,00\n")
+    assert rows == [(2, '123456789', 3000), (3, '987654321', 1500)]
+    assert errors == []
+
+
+def test_unparseable_first_line_with_digits_is_reported():
+    rows, errors = parse_deposit_csv("123456789;три тысячи\nИванова Анна;3000\nПетров Петр;-\n")
+    assert rows == [(2, 'Иванова Анна', 3000)]
+    assert errors == [1, 3]
@@ -0,0 +1,95 @@
+# test_database.py
+"""Операции, которые двигают деньги: списание проведенных занятий и запись из листа ожидания"""
+
+
+def add_student(db, user_id, lessons_left=0, balance=0, lesson_price=1500):
+    db.save_user({'user_id': user_id, 'fio': f'Студент {user_id}', 'role': 'student'})
+    db.save_student_balance({'user_id': user_id, 'lessons_left': lessons_left, 'balance': balance,
+                             'lesson_price': lesson_price})
+
+
+def add_lesson(db, user_id, slot_id, **extra):
+    db.save_confirmed_lesson(dict({'user_id': user_id, 'slot_id': slot_id, 'slot_name': slot_id}, **extra))
+    return next(lesson['id'] for lesson in db.get_confirmed_lessons(user_id) if lesson['slot_id'] == slot_id)
+
+
+def assert_stats_match_data(db):
+    """Счетчики панели, которые ведут триггеры, равны пересчету verify_dashboard_stats"""
+    with db.get_connection() as conn:
+        cursor = conn.cursor()
+        actual = {}
+        for name, query in db.DASHBOARD_STATS.items():
+            cursor.execute(query)
+            actual[name] = cursor.fetchone()[0]
+    assert db.get_dashboard_stats() == actual
+
+
+def test_charge_lessons_uses_prepaid_then_debt(db):
+    add_student(db, 1, lessons_left=1, balance=1000)
+    lesson_ids = [add_lesson(db, 1, slot_id) for slot_id in ('20260105_1400', '20260105_1500', '20260105_1600')]
+
+    charges = db.charge_lessons(lesson_ids)
+
+    assert [charge['from_prepaid'] for charge in charges] == [True, False, False]
+    assert [charge['balance'] for charge in charges] == [1000, -500, -2000]
+    balance = db.get_student_balance(1)
+    assert (balance['lessons_left'], balance['balance']) == (0, -2000)
+    assert_stats_match_data(db)
+
+
+def test_charge_lessons_twice_is_noop(db):
+    add_student(db, 1, lessons_left=1)
+    lesson_ids = [add_lesson(db, 1, '20260105_1400'), add_lesson(db, 1, '20260105_1500')]
+
+    assert len(db.charge_lessons(lesson_ids)) == 2
+    assert db.charge_lessons(lesson_ids) == []
+
+    balance = db.get_student_balance(1)
+    assert (balance['lessons_left'], balance['balance']) == (0, -1500)
+    assert_stats_match_data(db)
+
+
+def test_paid_lesson_is_never_billed_again(db):
+    add_student(db, 1, lessons_left=2)
+    # Занятие из заявки оплачено при подтверждении
+    confirmed_id = add_lesson(db, 1, '20260105_1400', charged=True)
+    # Занятие, списанное вручную через управление балансом
+    manual_id = add_lesson(db, 1, '20260105_1500')
+    db.charge_student_lesson(1, started_before='2026-01-05 15:00')
+
+    assert db.charge_lessons([confirmed_id, manual_id]) == []
+    balance = db.get_student_balance(1)
+    assert (balance['lessons_left'], balance['balance']) == (1, 0)
+    assert_stats_match_data(db)
+
+
+def test_waitlist_booking_charges_once(db):
+    add_student(db, 1, lessons_left=0, balance=3000)
+    db.add_to_waitlist('20261021_1400', 1)
+    lesson_data = {'user_id': 1, 'slot_id': '20261021_1400', 'slot_name': 'Ср 21.10.2026 14:00'}
+
+    result = db.book_waitlisted_slot(lesson_data, lambda lessons: True)
+
+    assert result[0] == 'booked'
+    _, lesson, balance, from_prepaid = result
+    assert not from_prepaid
+    assert balance['balance'] == 1500
+    assert lesson['payment_type'] == "списано 1500 руб. с депозита"
+    # Занятие уже оплачено: массовое списание и повторное нажатие ничего не спишут
+    assert db.charge_lessons([lesson['id']]) == []
+    assert db.book_waitlisted_slot(lesson_data, lambda lessons: True) == ('stale',)
+    assert db.get_student_balance(1)['balance'] == 1500
+    assert_stats_match_data(db)
+
+
+def test_waitlist_booking_of_taken_slot_changes_nothing(db):
+    add_student(db, 1, lessons_left=1)
+    db.add_to_waitlist('20261021_1400', 1)
+    lesson_data = {'user_id': 1, 'slot_id': '20261021_1400', 'slot_name': 'Ср 21.10.2026 14:00'}
+
+    assert db.book_waitlisted_slot(lesson_data, lambda lessons: False) == ('taken',)
+
+    assert db.get_student_balance(1)['lessons_left'] == 1
+    assert db.get_confirmed_lessons(1) == []
+    assert db.get_next_waitlisted('20261021_1400') == 1
+    assert_stats_match_data(db)
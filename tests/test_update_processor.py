@@ -0,0 +1,66 @@
+# test_update_processor.py
+import asyncio
+from datetime import datetime
+
+from telegram import Chat, Message, Update
+
+from utils.update_processor import PerChatUpdateProcessor
+
+
+def make_update(update_id, chat_id):
+    chat = Chat(id=chat_id, type=Chat.PRIVATE)
+    return Update(update_id, message=Message(update_id, datetime.now(), chat))
+
+
+async def run_updates(updates, max_concurrent_updates=16, delays=None, failing=()):
+    """Обрабатывает обновления одновременно через process_update (с общим семафором);
+    возвращает (порядок завершения, макс. параллельных по чатам)"""
+    processor = PerChatUpdateProcessor(max_concurrent_updates)
+    delays = delays or {}
+    order = []
+    running = {}
+    max_running = {}
+
+    async def handle(update):
+        chat_id = update.effective_chat.id
+        running[chat_id] = running.get(chat_id, 0) + 1
+        max_running[chat_id] = max(max_running.get(chat_id, 0), running[chat_id])
+        try:
+            await asyncio.sleep(delays.get(chat_id, 0.01))
+            if update.update_id in failing:
+                raise RuntimeError("сбой обработчика")
+            order.append(update.update_id)
+        finally:
+            running[chat_id] -= 1
+
+    tasks = [asyncio.create_task(processor.process_update(update, handle(update))) for update in updates]
+    await asyncio.gather(*tasks)
+    # Задачи-владельцы дорабатывают очереди чатов после возврата остальных
+    while processor._chat_queues:
+        await asyncio.sleep(0.01)
+    return order, max_running
+
+
+def test_one_chat_is_processed_in_order_one_at_a_time():
+    order, max_running = asyncio.run(run_updates([make_update(i, 1) for i in range(1, 4)]))
+    assert order == [1, 2, 3]
+    assert max_running == {1: 1}
+
+
+def test_different_chats_run_concurrently():
+    _, max_running = asyncio.run(run_updates([make_update(1, 1), make_update(2, 2)]))
+    assert max_running == {1: 1, 2: 1}
+
+
+def test_burst_from_one_chat_does_not_block_other_chats():
+    # Очередь чата 1 больше лимита параллельных обновлений
+    updates = [make_update(i, 1) for i in range(1, 7)] + [make_update(100, 2)]
+    order, max_running = asyncio.run(run_updates(updates, max_concurrent_updates=2, delays={1: 0.05, 2: 0}))
+    assert order[0] == 100
+    assert [update_id for update_id in order if update_id != 100] == [1, 2, 3, 4, 5, 6]
+    assert max_running == {1: 1, 2: 1}
+
+
+def test_failed_update_does_not_stop_chat_queue():
+    order, _ = asyncio.run(run_updates([make_update(i, 1) for i in range(1, 4)], failing={2}))
+    assert order == [1, 3]
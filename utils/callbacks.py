@@ -0,0 +1,205 @@
+# callbacks.py
+"""
+Компактный формат callback_data и маршрутизатор callback-кнопок.
+
+Формат: 'пространство:действие:арг1:арг2...', например s:t:20261021:1400.
+Разбор и проверка аргументов выполняются только здесь (CALLBACK_SCHEMA),
+а обработчик выбирается по словарю (пространство, действие) за O(1).
+
+Кнопки старого формата из уже отправленных сообщений (balance_..., ignore,
+show_selected и др.) переводятся в новый формат в parse_legacy_callback.
+"""
+from collections import namedtuple
+from telegram.ext import CallbackQueryHandler
+
+CALLBACK_SEPARATOR = ':'
+MAX_CALLBACK_BYTES = 64  # ограничение Telegram на callback_data
+
+Callback = namedtuple('Callback', ['namespace', 'action', 'args'])
+
+
+def _digits(length):
+    """Проверка строки из length цифр (дата ГГГГММДД, время ЧЧММ)"""
+    def convert(value):
+        if len(value) != length or not value.isdigit():
+            raise ValueError(value)
+        return value
+    return convert
+
+
+def _choice(*options):
+    """Проверка значения из фиксированного набора"""
+    def convert(value):
+        if value not in options:
+            raise ValueError(value)
+        return value
+    return convert
+
+
+SLOT_DATE = _digits(8)
+SLOT_TIME = _digits(4)
+
+BALANCE_ACTIONS = ('add_lessons', 'charge_lesson', 'add_deposit', 'statistics',
+                   'set_price', 'add_notes', 'back_to_list', 'finish')
+
+# Списки выбора студента: баланс, занятия, чат, удаление (handlers/student_picker.py)
+STUDENT_PICKERS = ('b', 'l', 'c', 'm')
+# Фильтры списка: все, должники, фортепиано, вокал, аранжировка
+PICKER_FILTERS = ('a', 'd', 'p', 'v', 'r')
+
+# (пространство, действие) -> преобразователи аргументов
+CALLBACK_SCHEMA = {
+    # Пустая кнопка (заголовки, занятые слоты)
+    ('x', ''): (),
+
+    # Выбор расписания студентом
+    ('s', 'd'): (int, int),                 # день: неделя, индекс дня
+    ('s', 'w'): (int,),                     # неделя горизонта
+    ('s', 't'): (SLOT_DATE, SLOT_TIME),     # слот: дата, время
+    ('s', 'l'): (),                         # список выбранных слотов
+    ('s', 'f'): (),                         # завершить выбор
+    ('s', 'n'): (_choice('i', 'd'), int, int),  # нужно уроков +/-: неделя, день
+    ('s', 'q'): (SLOT_DATE, SLOT_TIME),     # встать в лист ожидания / выйти из него
+
+    # Подтверждение заявки преподавателем
+    ('c', 't'): (int, SLOT_DATE, SLOT_TIME),  # отметить слот студента
+    ('c', 'm'): (int,),                       # подтвердить отмеченные
+    ('c', 'r'): (int,),                       # отклонить заявку
+
+    # Автоподбор слотов
+    ('a', 's'): (),  # показать предложение
+    ('a', 'y'): (),  # утвердить
+    ('a', 'n'): (),  # отменить
+
+    # Управление балансом
+    ('b', 's'): (int,),                      # выбрать студента
+    ('b', 'c'): (),                          # отмена
+    ('b', 'a'): (_choice(*BALANCE_ACTIONS),),  # действие с балансом
+    ('b', 'y'): (),                          # подтвердить списание урока
+    ('b', 't'): (),                          # занятия, проведенные сегодня
+    ('b', 'k'): (),                          # списать все проведенные сегодня
+    ('b', 'u'): (),                          # применить массовую операцию
+    ('b', 'v'): (),                          # отменить массовую операцию
+
+    # Предложение освободившегося слота из листа ожидания
+    ('w', 'y'): (SLOT_DATE, SLOT_TIME),  # записаться
+    ('w', 'n'): (SLOT_DATE, SLOT_TIME),  # отказаться
+
+    # Список выбора студента
+    ('p', 'n'): (_choice(*STUDENT_PICKERS), int, _choice(*PICKER_FILTERS)),  # страница, фильтр
+    ('p', 'c'): (_choice(*STUDENT_PICKERS),),                                # сбросить поиск
+}
+
+
+def slot_args(slot_id):
+    """ID слота 20261021_1400 -> аргументы ('20261021', '1400')"""
+    return tuple(slot_id.split('_'))
+
+
+def slot_from_args(slot_date, slot_time):
+    """Аргументы ('20261021', '1400') -> ID слота 20261021_1400"""
+    return f"{slot_date}_{slot_time}"
+
+
+def make_callback(namespace, action='', *args):
+    """Собирает callback_data и проверяет его по схеме и длине"""
+    parts = [namespace, action, *(str(arg) for arg in args)] if action or args else [namespace]
+    data = CALLBACK_SEPARATOR.join(parts)
+
+    if len(data.encode('utf-8')) > MAX_CALLBACK_BYTES:
+        raise ValueError(f"callback_data длиннее {MAX_CALLBACK_BYTES} байт: {data}")
+    if parse_callback(data) is None:
+        raise ValueError(f"callback_data не соответствует схеме: {data}")
+    return data
+
+
+# Старый формат: префикс -> (пространство, действие, разбор остатка в список аргументов).
+# Переводятся только кнопки, старые данные которых полностью совпадают с новыми
+# аргументами; кнопки расписания хранили индекс дня (day0_1400) вместо даты
+# и отвечают «Кнопка устарела» (handlers/callback_router.py)
+LEGACY_PREFIXES = [
+    ('balance_select_', 'b', 's', lambda rest: [rest]),
+    ('balance_confirm_lesson', 'b', 'y', lambda rest: []),
+    ('balance_cancel', 'b', 'c', lambda rest: []),
+    ('balance_', 'b', 'a', lambda rest: [rest]),
+]
+
+LEGACY_EXACT = {
+    'ignore': ('x', '', []),
+    'show_selected': ('s', 'l', []),
+    'finish_schedule': ('s', 'f', []),
+    'auto_assign': ('a', 's', []),
+    'auto_assign_apply': ('a', 'y', []),
+    'auto_assign_cancel': ('a', 'n', []),
+}
+
+
+def parse_legacy_callback(data):
+    """Переводит callback_data старого формата в (пространство, действие, аргументы)"""
+    if data in LEGACY_EXACT:
+        return LEGACY_EXACT[data]
+
+    for prefix, namespace, action, split_args in LEGACY_PREFIXES:
+        if data.startswith(prefix):
+            return namespace, action, split_args(data[len(prefix):])
+    return None
+
+
+def parse_callback(data):
+    """Разбирает callback_data в Callback или возвращает None, если данные неверны"""
+    if not data:
+        return None
+
+    if CALLBACK_SEPARATOR in data or (data, '') in CALLBACK_SCHEMA:
+        parts = data.split(CALLBACK_SEPARATOR)
+        namespace, action, raw_args = parts[0], parts[1] if len(parts) > 1 else '', parts[2:]
+    else:
+        legacy = parse_legacy_callback(data)
+        if not legacy:
+            return None
+        namespace, action, raw_args = legacy
+
+    converters = CALLBACK_SCHEMA.get((namespace, action))
+    if converters is None or len(converters) != len(raw_args):
+        return None
+
+    try:
+        args = tuple(convert(value) for convert, value in zip(converters, raw_args))
+    except ValueError:
+        return None
+    return Callback(namespace, action, args)
+
+
+class CallbackRouter:
+    """Единый обработчик callback-кнопок: словарь (пространство, действие) -> обработчик"""
+
+    def __init__(self):
+        self.routes = {}
+
+    def add(self, namespace, action, handler):
+        self.routes[(namespace, action)] = handler
+
+    def resolve(self, data):
+        """Возвращает (обработчик, Callback) или None"""
+        callback = parse_callback(data)
+        if not callback:
+            return None
+
+        handler = self.routes.get((callback.namespace, callback.action))
+        if not handler:
+            return None
+        return handler, callback
+
+    async def dispatch(self, update, context):
+        resolved = self.resolve(update.callback_query.data)
+        if not resolved:
+            return
+        handler, callback = resolved
+
+        # Аргументы кнопки передаются так же, как аргументы команд
+        context.args = list(callback.args)
+        return await handler(update, context)
+
+    def handler(self):
+        """CallbackQueryHandler, который принимает только известные маршруты"""
+        return CallbackQueryHandler(self.dispatch, pattern=lambda data: self.resolve(data) is not None)
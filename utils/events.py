@@ -0,0 +1,74 @@
+# events.py
+"""
+Внутренняя шина событий предметной области.
+
+Функции записи в database.py публикуют событие после commit своей транзакции,
+поэтому подписчики видят уже сохраненное состояние. Кэши и представления
+(config.py) подписываются обычными функциями и обновляются сразу, по порядку
+подписки. Подписчик-корутина (например, рассылка) запускается отдельной задачей
+в цикле событий бота и не задерживает обработчик, изменивший данные.
+Ошибка подписчика записывается в лог и не мешает остальным.
+"""
+import asyncio
+import logging
+from collections import namedtuple, defaultdict
+
+logger = logging.getLogger(__name__)
+
+# Занятие сохранено: lesson - запись с id и starts_at
+LessonConfirmed = namedtuple('LessonConfirmed', ['user_id', 'lesson'])
+# Занятия удалены: их ID и освободившиеся слоты
+LessonCancelled = namedtuple('LessonCancelled', ['user_id', 'lesson_ids', 'slot_ids'])
+# Баланс изменен: balance - запись student_balance после изменения
+BalanceChanged = namedtuple('BalanceChanged', ['user_id', 'balance'])
+# Профиль сохранен: profile - сохраненные поля
+ProfileUpdated = namedtuple('ProfileUpdated', ['user_id', 'profile'])
+# Пользователь удален (archived=False) или заархивирован
+UserRemoved = namedtuple('UserRemoved', ['user_id', 'archived'])
+# Заявка на расписание сохранена; request=None - заявка удалена
+RequestUpdated = namedtuple('RequestUpdated', ['user_id', 'request'])
+
+
+class EventBus:
+    """Подписчики по типу события: handler(event) - функция или корутина"""
+
+    def __init__(self):
+        self._handlers = defaultdict(list)
+        # Запущенные задачи подписчиков-корутин (иначе их может собрать сборщик мусора)
+        self._tasks = set()
+
+    def subscribe(self, handler, *event_types):
+        """Подписывает handler на события перечисленных типов"""
+        for event_type in event_types:
+            self._handlers[event_type].append(handler)
+        return handler
+
+    def publish(self, event):
+        """Передает событие подписчикам его типа"""
+        for handler in self._handlers.get(type(event), ()):
+            try:
+                result = handler(event)
+                if asyncio.iscoroutine(result):
+                    self._start_task(result, event)
+            except Exception as e:
+                logger.error(f"Ошибка подписчика {handler.__name__} на {type(event).__name__}: {e}")
+
+    def _start_task(self, coro, event):
+        try:
+            task = asyncio.get_running_loop().create_task(coro)
+        except RuntimeError:
+            # Вне цикла событий (скрипты обслуживания) асинхронные подписчики не запускаются
+            coro.close()
+            logger.warning(f"Нет цикла событий для асинхронного подписчика {type(event).__name__}")
+            return
+
+        self._tasks.add(task)
+        task.add_done_callback(self._task_done)
+
+    def _task_done(self, task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception():
+            logger.error(f"Ошибка асинхронного подписчика: {task.exception()}")
+
+
+event_bus = EventBus()
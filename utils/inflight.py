@@ -0,0 +1,110 @@
+# inflight.py
+"""
+Защита от двойного нажатия inline-кнопок.
+
+Ключ нажатия - (пользователь, сообщение, версия сообщения, callback_data). Пока обработчик
+выполняется, повторное нажатие с тем же ключом только получает ответ на callback и не
+выполняется. Обработчик, который редактирует свое сообщение, держит ключ еще ttl секунд:
+нажатия на старую версию, отправленные до того, как клиент получил правку, игнорируются,
+а после правки у сообщения новая версия (edit_date) и нажатия снова обрабатываются.
+Обработчик, который отвечает всплывающим уведомлением или новым сообщением, свое
+сообщение не меняет - для него ключ освобождается сразу, иначе законные повторные
+нажатия игнорировались бы ttl секунд.
+"""
+import time
+from functools import wraps
+
+from telegram import Update
+
+from config import CALLBACK_DEDUP_TTL
+
+DUPLICATE_ANSWER = "⏳ Уже выполняется..."
+
+
+class CallbackDeduplicator:
+    """Реестр нажатий с истечением по TTL"""
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._keys = {}  # ключ -> время истечения
+        self._next_prune = 0
+
+    @staticmethod
+    def key_for(query):
+        message = query.message
+        if message is None:
+            # Сообщения из inline-режима
+            return query.from_user.id, query.inline_message_id, query.data
+
+        version = message.edit_date or message.date
+        return (query.from_user.id, message.chat.id, message.message_id,
+                version.timestamp() if version else 0, query.data)
+
+    def _prune(self, now):
+        if now < self._next_prune:
+            return
+        self._keys = {key: expires for key, expires in self._keys.items() if expires > now}
+        self._next_prune = now + self.ttl
+
+    def acquire(self, key):
+        """Регистрирует нажатие; False, если такое нажатие уже выполняется или выполнено недавно"""
+        now = time.monotonic()
+        self._prune(now)
+
+        if self._keys.get(key, 0) > now:
+            return False
+        self._keys[key] = now + self.ttl
+        return True
+
+    def complete(self, key):
+        """Нажатие обработано, сообщение отредактировано: повторы на старую версию игнорируются еще ttl секунд"""
+        self._keys[key] = time.monotonic() + self.ttl
+
+    def release(self, key):
+        """Повторное нажатие снова разрешено (обработчик упал или не меняет свое сообщение)"""
+        self._keys.pop(key, None)
+
+    def __len__(self):
+        return len(self._keys)
+
+
+callback_deduplicator = CallbackDeduplicator(CALLBACK_DEDUP_TTL)
+
+
+def deduplicate_callback(func=None, *, edits_message=True):
+    """
+    Декоратор обработчика: повторное нажатие той же кнопки не выполняется.
+    edits_message=False - обработчик не редактирует свое сообщение (всплывающее уведомление,
+    ответ новым сообщением): повторы отсекаются только пока он выполняется.
+    Вызовы не из callback-кнопки (сообщения, вспомогательные функции с query) проходят как есть.
+    """
+    if func is None:
+        return lambda handler: deduplicate_callback(handler, edits_message=edits_message)
+
+    @wraps(func)
+    async def wrapper(update, context, *args, **kwargs):
+        if not isinstance(update, Update) or not update.callback_query:
+            return await func(update, context, *args, **kwargs)
+
+        query = update.callback_query
+        key = callback_deduplicator.key_for(query)
+        if not callback_deduplicator.acquire(key):
+            try:
+                await query.answer(DUPLICATE_ANSWER)
+            except Exception:
+                pass  # На повтор можно и не ответить
+            return None
+
+        try:
+            result = await func(update, context, *args, **kwargs)
+        except Exception:
+            callback_deduplicator.release(key)
+            raise
+
+        if edits_message:
+            callback_deduplicator.complete(key)
+        else:
+            callback_deduplicator.release(key)
+        return result
+
+    return wrapper
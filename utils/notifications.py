@@ -0,0 +1,76 @@
+# notifications.py
+"""
+Массовая отправка уведомлений студентам.
+
+Уведомления ставятся в очередь одной задачей JobQueue и отправляются по порядку
+с паузой NOTIFY_SEND_DELAY, чтобы не упереться в лимит Telegram на рассылку
+(около 30 сообщений в секунду). Обработчик, поставивший уведомления в очередь,
+не ждет их отправки. Ошибка отправки одному студенту не прерывает рассылку.
+
+Уведомление - (chat_id, текст) или (chat_id, текст, клавиатура).
+"""
+import asyncio
+import logging
+
+from telegram.error import RetryAfter, TelegramError
+
+logger = logging.getLogger(__name__)
+
+# Пауза между сообщениями рассылки
+NOTIFY_SEND_DELAY = 0.05
+
+
+def queue_notifications(application, notifications, parse_mode='Markdown'):
+    """Ставит уведомления [(chat_id, текст[, клавиатура]), ...] в очередь; возвращает их количество"""
+    notifications = list(notifications)
+    if not notifications:
+        return 0
+
+    if application.job_queue:
+        application.job_queue.run_once(
+            send_notifications_job, 0,
+            data={'notifications': notifications, 'parse_mode': parse_mode},
+            name='bulk_notifications'
+        )
+    else:
+        # Без JobQueue отправляем фоновой задачей приложения
+        application.create_task(send_notifications(application.bot, notifications, parse_mode))
+    return len(notifications)
+
+
+async def send_notification(bot, chat_id, text, parse_mode, reply_markup=None):
+    """Отправляет одно уведомление; при превышении лимита ждет и повторяет один раз"""
+    for attempt in range(2):
+        try:
+            await bot.send_message(chat_id=chat_id, text=text, parse_mode=parse_mode, reply_markup=reply_markup)
+            return
+        except RetryAfter as e:
+            if attempt:
+                raise
+            logger.warning(f"Лимит Telegram при рассылке, ждем {e.retry_after} с")
+            await asyncio.sleep(e.retry_after)
+
+
+async def send_notifications(bot, notifications, parse_mode='Markdown'):
+    """Отправляет уведомления по очереди; возвращает (отправлено, ошибок)"""
+    sent = 0
+    failed = 0
+
+    for i, (chat_id, text, *reply_markup) in enumerate(notifications):
+        if i:
+            await asyncio.sleep(NOTIFY_SEND_DELAY)
+        try:
+            await send_notification(bot, chat_id, text, parse_mode, *reply_markup)
+            sent += 1
+        except TelegramError as e:
+            failed += 1
+            logger.error(f"Не удалось отправить уведомление {chat_id}: {e}")
+
+    logger.info(f"Рассылка завершена: отправлено {sent}, ошибок {failed}")
+    return sent, failed
+
+
+async def send_notifications_job(context):
+    """Задача JobQueue: отправляет уведомления из context.job.data"""
+    data = context.job.data
+    await send_notifications(context.bot, data['notifications'], data['parse_mode'])
@@ -0,0 +1,145 @@
+# persistence.py
+"""
+Хранение состояний диалогов (ConversationHandler), user_data и chat_data в SQLite.
+
+Application сам вызывает update_* раз в update_interval секунд и передает копии данных.
+Здесь изменения только накапливаются в памяти, а запись в БД идет одной транзакцией
+в отдельном потоке - обработка обновлений на запись не тратит время.
+"""
+import asyncio
+import json
+import logging
+import pickle
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from database import get_persistence_data, get_conversation_states, save_persistence_batch
+
+logger = logging.getLogger(__name__)
+
+
+class SQLitePersistence(BasePersistence):
+    """Persistence для python-telegram-bot поверх music_school.db"""
+
+    def __init__(self, update_interval=30):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, callback_data=False),
+            update_interval=update_interval
+        )
+        # Накопленные изменения: {(вид, ключ): данные или None для удаления}
+        self._dirty_data = {}
+        # {(имя диалога, ключ JSON): состояние или None для удаления}
+        self._dirty_states = {}
+        self._flush_task = None
+        self._flush_lock = asyncio.Lock()
+
+    # ---------- Загрузка при старте ----------
+
+    @staticmethod
+    def _load(kind):
+        result = {}
+        for key, blob in get_persistence_data(kind).items():
+            try:
+                result[key] = pickle.loads(blob)
+            except Exception as e:
+                logger.error(f"Не удалось загрузить {kind} для {key}: {e}")
+        return result
+
+    async def get_user_data(self):
+        return await asyncio.to_thread(self._load, 'user_data')
+
+    async def get_chat_data(self):
+        return await asyncio.to_thread(self._load, 'chat_data')
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        states = await asyncio.to_thread(get_conversation_states, name)
+        return {tuple(json.loads(key)): json.loads(state) for key, state in states.items()}
+
+    # ---------- Накопление изменений ----------
+
+    def _mark_data(self, kind, key, data):
+        self._dirty_data[(kind, key)] = data
+        self._schedule_flush()
+
+    async def update_user_data(self, user_id, data):
+        self._mark_data('user_data', user_id, data)
+
+    async def update_chat_data(self, chat_id, data):
+        self._mark_data('chat_data', chat_id, data)
+
+    async def drop_user_data(self, user_id):
+        self._mark_data('user_data', user_id, None)
+
+    async def drop_chat_data(self, chat_id):
+        self._mark_data('chat_data', chat_id, None)
+
+    async def update_conversation(self, name, key, new_state):
+        self._dirty_states[(name, json.dumps(list(key)))] = new_state
+        self._schedule_flush()
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    # ---------- Запись в БД ----------
+
+    def _schedule_flush(self):
+        """Одна запись на весь пакет изменений, который Application передает за один проход"""
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.get_running_loop().create_task(self.flush())
+
+    async def flush(self):
+        # При остановке бота дожидаемся уже запланированной записи, чтобы не оставить висящую задачу
+        pending = self._flush_task
+        if pending and not pending.done() and pending is not asyncio.current_task():
+            await pending
+
+        async with self._flush_lock:
+            dirty_data, self._dirty_data = self._dirty_data, {}
+            dirty_states, self._dirty_states = self._dirty_states, {}
+            if not dirty_data and not dirty_states:
+                return
+
+            data_rows, data_deletes = [], []
+            for (kind, key), data in dirty_data.items():
+                if data is None:
+                    data_deletes.append((kind, key))
+                    continue
+                try:
+                    data_rows.append((kind, key, pickle.dumps(data)))
+                except Exception as e:
+                    logger.error(f"Не удалось сохранить {kind} для {key}: {e}")
+
+            state_rows, state_deletes = [], []
+            for (name, key), state in dirty_states.items():
+                if state is None:
+                    state_deletes.append((name, key))
+                else:
+                    state_rows.append((name, key, json.dumps(state)))
+
+            try:
+                await asyncio.to_thread(save_persistence_batch, data_rows, data_deletes, state_rows, state_deletes)
+            except Exception as e:
+                logger.error(f"Ошибка записи состояния бота: {e}")
+                # Возвращаем изменения, чтобы записать их при следующей попытке (новые данные важнее)
+                for item_key, data in dirty_data.items():
+                    self._dirty_data.setdefault(item_key, data)
+                for item_key, state in dirty_states.items():
+                    self._dirty_states.setdefault(item_key, state)
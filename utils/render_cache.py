@@ -0,0 +1,61 @@
+# render_cache.py
+"""
+Кэш последнего отрисованного содержимого сообщений бота.
+
+Для каждого сообщения (чат, message_id) хранится хэш текста и клавиатуры, которые
+бот отправил последним редактированием, и версия сообщения (edit_date) после него.
+Если сообщение с тех пор не менялось, а новое содержимое совпадает, запрос
+edit_message_text к Telegram не нужен. Старые записи вытесняются по LRU.
+"""
+import hashlib
+import json
+from collections import OrderedDict
+
+RENDER_CACHE_SIZE = 2048
+
+
+def render_hash(text, parse_mode=None, reply_markup=None):
+    """Хэш содержимого сообщения: текст, режим разметки и клавиатура"""
+    markup = json.dumps(reply_markup.to_dict(), sort_keys=True, ensure_ascii=False) if reply_markup else ''
+    content = f"{parse_mode or ''}\x00{text}\x00{markup}"
+    return hashlib.blake2b(content.encode('utf-8'), digest_size=16).digest()
+
+
+def message_version(message):
+    """Версия сообщения: время последнего редактирования или отправки"""
+    version = message.edit_date or message.date
+    return version.timestamp() if version else 0
+
+
+class RenderCache:
+    """LRU: (чат, message_id) -> (хэш содержимого, версия сообщения)"""
+
+    def __init__(self, max_size=RENDER_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+
+    def is_current(self, message, content_hash):
+        """True, если сообщение уже показывает это содержимое"""
+        key = (message.chat.id, message.message_id)
+        entry = self._entries.get(key)
+        if entry is None:
+            return False
+
+        self._entries.move_to_end(key)
+        return entry == (content_hash, message_version(message))
+
+    def store(self, message, content_hash):
+        key = (message.chat.id, message.message_id)
+        self._entries[key] = (content_hash, message_version(message))
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def forget(self, message):
+        self._entries.pop((message.chat.id, message.message_id), None)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+render_cache = RenderCache()
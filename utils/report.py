@@ -0,0 +1,89 @@
+# report.py
+"""
+Отправка длинных отчетов несколькими сообщениями.
+
+Отчет - это последовательность блоков (день расписания, студент, заявка). Блоки
+собираются в сообщения не длиннее REPORT_CHUNK_LIMIT и режутся только по границам
+блоков, поэтому разметка Markdown внутри блока не разрывается. Блок длиннее лимита
+делится по строкам. Сообщения отправляются по порядку с паузой между ними.
+"""
+import asyncio
+import logging
+
+from telegram.error import RetryAfter
+
+logger = logging.getLogger(__name__)
+
+TELEGRAM_MESSAGE_LIMIT = 4096
+# Запас под служебные символы и подпись продолжения
+REPORT_CHUNK_LIMIT = 3800
+# Пауза между сообщениями одного отчета (Telegram: не больше ~1 сообщения в секунду в чат)
+REPORT_SEND_DELAY = 1.0
+
+
+def split_block(block, limit):
+    """Делит слишком длинный блок по строкам (строку длиннее лимита - по символам)"""
+    part = []
+    size = 0
+    for line in block.splitlines(keepends=True):
+        while len(line) > limit:
+            if part:
+                yield ''.join(part)
+                part, size = [], 0
+            yield line[:limit]
+            line = line[limit:]
+
+        if size + len(line) > limit and part:
+            yield ''.join(part)
+            part, size = [], 0
+        part.append(line)
+        size += len(line)
+
+    if part:
+        yield ''.join(part)
+
+
+def chunk_blocks(blocks, limit=REPORT_CHUNK_LIMIT):
+    """Собирает блоки в тексты сообщений не длиннее limit (генератор)"""
+    chunk = []
+    size = 0
+    for block in blocks:
+        pieces = split_block(block, limit) if len(block) > limit else (block,)
+        for piece in pieces:
+            if size + len(piece) > limit and chunk:
+                yield ''.join(chunk)
+                chunk, size = [], 0
+            chunk.append(piece)
+            size += len(piece)
+
+    if chunk:
+        yield ''.join(chunk)
+
+
+async def send_report(message, blocks, parse_mode='Markdown', reply_markup=None, delay=REPORT_SEND_DELAY):
+    """
+    Отправляет отчет ответами на message. Клавиатура прикрепляется к последнему сообщению.
+    Текст собирается заранее: во время пауз между сообщениями не держим открытым запрос к БД.
+    """
+    chunks = list(chunk_blocks(blocks))
+    for i, chunk in enumerate(chunks):
+        is_last = i == len(chunks) - 1
+        if i:
+            await asyncio.sleep(delay)
+
+        for attempt in range(2):
+            try:
+                await message.reply_text(
+                    chunk,
+                    parse_mode=parse_mode,
+                    reply_markup=reply_markup if is_last else None
+                )
+                break
+            except RetryAfter as e:
+                # Превышен лимит Telegram: ждем, сколько он попросил, и повторяем один раз
+                logger.warning(f"Лимит Telegram при отправке отчета, ждем {e.retry_after} с")
+                if attempt:
+                    raise
+                await asyncio.sleep(e.retry_after)
+
+    return len(chunks)
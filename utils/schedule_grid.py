@@ -0,0 +1,190 @@
+# schedule_grid.py
+"""
+Сетка расписания школы.
+
+Рабочие дни, часы работы, длительность урока и перерыв задаются в config.py,
+поэтому изменить расписание можно без правки кода.
+
+Слоты имеют стабильные идентификаторы вида ГГГГММДД_ЧЧММ (например, 20261021_1400),
+а занятость дня хранится как битовая маска: бит i = занят i-й слот дня.
+"""
+from datetime import datetime, date, timedelta
+
+WEEKDAY_NAMES = ['Пн', 'Вт', 'Ср', 'Чт', 'Пт', 'Сб', 'Вс']
+
+
+def parse_time(time_str):
+    """Переводит строку ЧЧ:ММ в минуты от начала дня"""
+    hours, minutes = time_str.split(':')
+    return int(hours) * 60 + int(minutes)
+
+
+def format_time(minutes):
+    """Переводит минуты от начала дня в строку ЧЧ:ММ"""
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+def parse_slot_name(slot_name):
+    """Извлекает дату и время из названия занятия ('Ср 21.10.2026 14:00')"""
+    date_value = None
+    time_str = None
+
+    for part in (slot_name or '').split():
+        if '.' in part and len(part.split('.')) == 3:
+            try:
+                date_value = datetime.strptime(part, "%d.%m.%Y").date()
+            except ValueError:
+                continue
+        elif ':' in part and len(part.split(':')) == 2:
+            time_str = part
+
+    return date_value, time_str
+
+
+class ScheduleGrid:
+    """Сетка слотов: какие дни и в какое время проводятся занятия"""
+
+    def __init__(self, work_days, day_start, day_end, lesson_minutes=60, break_minutes=0):
+        self.work_days = tuple(sorted(set(work_days)))
+        self.day_start = parse_time(day_start)
+        self.day_end = parse_time(day_end)
+        self.lesson_minutes = lesson_minutes
+        self.break_minutes = break_minutes
+
+        # Времена начала слотов: урок должен закончиться до конца рабочего дня
+        self.starts = []
+        start = self.day_start
+        while start + lesson_minutes <= self.day_end:
+            self.starts.append(start)
+            start += lesson_minutes + break_minutes
+
+        self.times = [format_time(start) for start in self.starts]
+        self._time_index = {time_str: i for i, time_str in enumerate(self.times)}
+        self.full_mask = (1 << len(self.times)) - 1
+
+    # ---------- Идентификаторы слотов ----------
+
+    def slot_id(self, day, time_str):
+        """Стабильный ID слота: ГГГГММДД_ЧЧММ"""
+        return f"{day.strftime('%Y%m%d')}_{time_str.replace(':', '')}"
+
+    @staticmethod
+    def parse_slot_id(slot_id):
+        """Возвращает (дата, 'ЧЧ:ММ') для ID слота или None для старых форматов"""
+        if not slot_id or len(slot_id) != 13 or slot_id[8] != '_':
+            return None
+        try:
+            day = datetime.strptime(slot_id[:8], '%Y%m%d').date()
+            minutes = int(slot_id[9:11]) * 60 + int(slot_id[11:13])
+        except ValueError:
+            return None
+        return day, format_time(minutes)
+
+    def slot_label(self, slot_id):
+        """Человекочитаемое название слота: 'Ср 21.10.2026 14:00'"""
+        parsed = self.parse_slot_id(slot_id)
+        if not parsed:
+            return f"Слот {slot_id}"
+        day, time_str = parsed
+        return f"{WEEKDAY_NAMES[day.weekday()]} {day.strftime('%d.%m.%Y')} {time_str}"
+
+    def lesson_key(self, lesson):
+        """Дата и время занятия: из slot_id, а для старых записей - из slot_name"""
+        parsed = self.parse_slot_id(lesson.get('slot_id', ''))
+        if parsed:
+            return parsed
+        day, time_str = parse_slot_name(lesson.get('slot_name', ''))
+        if day and time_str:
+            return day, time_str
+        return None
+
+    # ---------- Дни ----------
+
+    def is_work_day(self, day):
+        return day.weekday() in self.work_days
+
+    def week_days(self, week_start):
+        """Рабочие дни недели, начинающейся с week_start"""
+        return [week_start + timedelta(days=i) for i in range(7)
+                if (week_start + timedelta(days=i)).weekday() in self.work_days]
+
+    def next_week_start(self, today=None):
+        """Ближайший (строго после сегодня) первый рабочий день недели"""
+        today = today or date.today()
+        first_day = self.work_days[0] if self.work_days else 0
+        days_until = (first_day - today.weekday() + 7) % 7
+        if days_until == 0:
+            days_until = 7
+        return today + timedelta(days=days_until)
+
+    def describe_days(self):
+        """Список рабочих дней для подсказок: 'Ср, Чт, Пт, Сб, Вс'"""
+        return ", ".join(WEEKDAY_NAMES[d] for d in self.work_days)
+
+    def describe_hours(self):
+        """Диапазон времени начала уроков: '13:00 - 22:00'"""
+        if not self.times:
+            return "—"
+        return f"{self.times[0]} - {self.times[-1]}"
+
+    # ---------- Битовые маски занятости ----------
+
+    def slot_index(self, time_str):
+        return self._time_index.get(time_str)
+
+    def mask_for_time(self, time_str):
+        """Маска слотов, которые перекрывает занятие, начинающееся в time_str"""
+        index = self._time_index.get(time_str)
+        if index is not None:
+            return 1 << index
+
+        # Занятие вне сетки (например, добавленное вручную) - помечаем все пересекающиеся слоты
+        start = parse_time(time_str)
+        end = start + self.lesson_minutes
+        mask = 0
+        for i, slot_start in enumerate(self.starts):
+            if slot_start < end and start < slot_start + self.lesson_minutes:
+                mask |= 1 << i
+        return mask
+
+    def build_occupancy(self, lessons):
+        """Строит словарь {дата: битовая маска} по списку занятий"""
+        occupancy = {}
+        for lesson in lessons:
+            key = self.lesson_key(lesson)
+            if not key:
+                continue
+            day, time_str = key
+            try:
+                occupancy[day] = occupancy.get(day, 0) | self.mask_for_time(time_str)
+            except ValueError:
+                continue
+        return occupancy
+
+    def is_free(self, occupancy, slot_id):
+        """Свободен ли слот с учетом карты занятости"""
+        parsed = self.parse_slot_id(slot_id)
+        if not parsed:
+            return False
+        day, time_str = parsed
+        return not occupancy.get(day, 0) & self.mask_for_time(time_str)
+
+    def free_mask(self, day_mask):
+        return ~day_mask & self.full_mask
+
+    def free_count(self, day_mask):
+        return bin(self.free_mask(day_mask)).count('1')
+
+    def free_windows(self, day_mask, length=1):
+        """Индексы слотов, с которых начинается length свободных слотов подряд"""
+        free = self.free_mask(day_mask)
+        window = free
+        for shift in range(1, length):
+            window &= free >> shift
+
+        indexes = []
+        while window:
+            lowest = window & -window
+            indexes.append(lowest.bit_length() - 1)
+            window ^= lowest
+        return indexes
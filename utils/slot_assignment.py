@@ -0,0 +1,141 @@
+# slot_assignment.py
+"""
+Автоматическое распределение слотов по заявкам студентов.
+
+Задача сводится к потоку минимальной стоимости:
+    исток -> студент (пропускная способность = сколько уроков хочет студент)
+    студент -> слот (1, если студент выбрал этот слот)
+    слот -> сток (1, в слот помещается один урок)
+
+Максимальный поток дает наибольшее число назначенных уроков, а стоимость ребер
+отдает спорные слоты студентам с предоплаченными уроками.
+"""
+import heapq
+
+# Стоимость назначения урока студенту без предоплаты
+NO_PREPAID_COST = 1
+
+
+class MinCostFlow:
+    """Поток минимальной стоимости (последовательные кратчайшие пути, Дейкстра с потенциалами)"""
+
+    def __init__(self, size):
+        self.size = size
+        self.graph = [[] for _ in range(size)]
+
+    def add_edge(self, source, target, capacity, cost):
+        """Добавляет ребро и обратное ребро; возвращает (вершина, индекс) прямого ребра"""
+        self.graph[source].append([target, capacity, cost, len(self.graph[target])])
+        self.graph[target].append([source, 0, -cost, len(self.graph[source]) - 1])
+        return source, len(self.graph[source]) - 1
+
+    def flow(self, source, sink):
+        """Возвращает (поток, стоимость)"""
+        total_flow = 0
+        total_cost = 0
+        potential = [0] * self.size  # стоимости неотрицательны, начальные потенциалы нулевые
+
+        while True:
+            dist = [None] * self.size
+            prev = [None] * self.size
+            dist[source] = 0
+            heap = [(0, source)]
+
+            while heap:
+                d, node = heapq.heappop(heap)
+                if d > dist[node]:
+                    continue
+                for i, (target, capacity, cost, _) in enumerate(self.graph[node]):
+                    if capacity <= 0:
+                        continue
+                    nd = d + cost + potential[node] - potential[target]
+                    if dist[target] is None or nd < dist[target]:
+                        dist[target] = nd
+                        prev[target] = (node, i)
+                        heapq.heappush(heap, (nd, target))
+
+            if dist[sink] is None:
+                break
+
+            for node in range(self.size):
+                if dist[node] is not None:
+                    potential[node] += dist[node]
+
+            # Находим узкое место пути
+            push = None
+            node = sink
+            while node != source:
+                parent, i = prev[node]
+                capacity = self.graph[parent][i][1]
+                push = capacity if push is None else min(push, capacity)
+                node = parent
+
+            node = sink
+            while node != source:
+                parent, i = prev[node]
+                edge = self.graph[parent][i]
+                edge[1] -= push
+                self.graph[node][edge[3]][1] += push
+                total_cost += push * edge[2]
+                node = parent
+
+            total_flow += push
+
+        return total_flow, total_cost
+
+
+def assign_slots(requests, free_slots, prepaid_students=()):
+    """
+    Распределяет свободные слоты по заявкам.
+
+    requests: {user_id: {'selected_slots': [...], 'desired_lessons': n}}
+    free_slots: множество свободных слотов
+    prepaid_students: студенты с предоплаченными уроками (получают приоритет)
+
+    Возвращает {user_id: [slot_id, ...]} - только студентов, которым что-то досталось.
+    """
+    prepaid_students = set(prepaid_students)
+
+    students = []
+    slot_nodes = {}
+    for user_id, request in requests.items():
+        wanted = [slot for slot in request.get('selected_slots', []) if slot in free_slots]
+        desired = min(request.get('desired_lessons') or 1, len(wanted))
+        if desired <= 0:
+            continue
+        students.append((user_id, wanted, desired))
+        for slot_id in wanted:
+            slot_nodes.setdefault(slot_id, None)
+
+    if not students:
+        return {}
+
+    # Нумерация вершин: 0 - исток, 1 - сток, затем студенты, затем слоты
+    source, sink = 0, 1
+    for i, slot_id in enumerate(slot_nodes):
+        slot_nodes[slot_id] = 2 + len(students) + i
+
+    network = MinCostFlow(2 + len(students) + len(slot_nodes))
+    assignment_edges = []
+
+    for i, (user_id, wanted, desired) in enumerate(students):
+        student_node = 2 + i
+        cost = 0 if user_id in prepaid_students else NO_PREPAID_COST
+        network.add_edge(source, student_node, desired, 0)
+        for slot_id in wanted:
+            edge = network.add_edge(student_node, slot_nodes[slot_id], 1, cost)
+            assignment_edges.append((user_id, slot_id, edge))
+
+    for node in slot_nodes.values():
+        network.add_edge(node, sink, 1, 0)
+
+    network.flow(source, sink)
+
+    result = {}
+    for user_id, slot_id, (node, index) in assignment_edges:
+        if network.graph[node][index][1] == 0:
+            result.setdefault(user_id, []).append(slot_id)
+
+    for slots in result.values():
+        slots.sort()
+    return result
@@ -0,0 +1,80 @@
+# update_processor.py
+"""
+Параллельная обработка обновлений с сохранением порядка внутри одного чата.
+
+Обновления из разных чатов обрабатываются одновременно, а обновления одного чата
+(в том числе шаги ConversationHandler) - строго по очереди, в порядке поступления.
+"""
+import logging
+from collections import deque
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """Обработчик обновлений с отдельной очередью на каждый чат.
+
+    BaseUpdateProcessor.process_update занимает место в общем семафоре до вызова
+    do_process_update, поэтому обновление не должно ждать свой чат, держа это место:
+    иначе серия сообщений одного чата занимает весь лимит и задерживает остальные чаты.
+    Первое обновление чата обрабатывает очередь чата до конца, следующие только
+    добавляются в нее и сразу освобождают место.
+    """
+
+    __slots__ = ('_chat_queues',)
+
+    def __init__(self, max_concurrent_updates):
+        super().__init__(max_concurrent_updates)
+        # Ожидающие корутины по чатам; ключ есть, пока очередь чата обрабатывается
+        self._chat_queues = {}
+
+    @staticmethod
+    def get_chat_key(update):
+        """Ключ очереди: чат, а если его нет (inline-запросы) - пользователь"""
+        if not isinstance(update, Update):
+            return None
+        if update.effective_chat:
+            return update.effective_chat.id
+        if update.effective_user:
+            return update.effective_user.id
+        return None
+
+    async def do_process_update(self, update, coroutine):
+        key = self.get_chat_key(update)
+        if key is None:
+            await coroutine
+            return
+
+        queue = self._chat_queues.get(key)
+        if queue is not None:
+            # Чат уже обрабатывается - обновление выполнит задача-владелец очереди
+            queue.append(coroutine)
+            return
+
+        queue = self._chat_queues[key] = deque([coroutine])
+        try:
+            while queue:
+                try:
+                    await queue[0]
+                except Exception as e:
+                    # Ошибка одного обновления не должна останавливать очередь чата
+                    logger.error(f"Ошибка обработки обновления чата {key}: {e}")
+                finally:
+                    queue.popleft()
+        finally:
+            # Очередь прервана (отмена задачи) - невыполненные корутины закрываем
+            for pending in queue:
+                pending.close()
+            del self._chat_queues[key]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        # Выполняемые сейчас обновления завершатся сами, ожидающие отбрасываем
+        for queue in self._chat_queues.values():
+            while len(queue) > 1:
+                queue.pop().close()
@@ -0,0 +1,75 @@
+# user_state.py
+"""
+Ограничение памяти, занимаемой context.user_data.
+
+Каждое обновление отмечает время последней активности пользователя (LAST_SEEN_KEY).
+Фоновая задача JobQueue удаляет временные ключи диалогов у тех, кто давно не писал,
+а полностью опустевшие записи user_data удаляет целиком - вместе с их копией в БД.
+"""
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+LAST_SEEN_KEY = 'last_seen'
+
+# Временные данные диалогов: имеют смысл только пока пользователь что-то делает
+TRANSIENT_KEYS = (
+    # Управление занятиями
+    'lesson_mgmt_student_id', 'future_lessons', 'selected_month', 'selected_year',
+    'selected_day', 'selected_time', 'full_slot_name', 'series_weeks',
+    # Управление балансом
+    'selected_student_id', 'current_action', 'charge_today', 'bulk_operation',
+    # Автоподбор, чат и управление студентами
+    'auto_assignment', 'chat_student_id', 'student_mgmt_student_id',
+    # Открытый список выбора студента
+    'student_picker',
+)
+
+
+async def touch_user_state(update, context):
+    """Отмечает время последней активности пользователя (группа -1, до остальных обработчиков)"""
+    if update.effective_user:
+        context.user_data[LAST_SEEN_KEY] = time.time()
+
+
+def evict_user_state(user_data):
+    """Удаляет временные ключи; возвращает True, если что-то удалено"""
+    removed = False
+    for key in TRANSIENT_KEYS:
+        if key in user_data:
+            del user_data[key]
+            removed = True
+    return removed
+
+
+async def sweep_user_state(context):
+    """Задача JobQueue: чистит user_data пользователей, неактивных дольше context.job.data секунд"""
+    application = context.application
+    deadline = time.time() - context.job.data
+
+    stale = [
+        user_id for user_id, user_data in application.user_data.items()
+        if user_data.get(LAST_SEEN_KEY, 0) < deadline
+    ]
+
+    dropped = 0
+    cleaned = 0
+    for user_id in stale:
+        user_data = application.user_data.get(user_id)
+        if user_data is None:
+            continue
+
+        changed = evict_user_state(user_data)
+        if set(user_data) <= {LAST_SEEN_KEY}:
+            application.drop_user_data(user_id)
+            dropped += 1
+        elif changed:
+            cleaned += 1
+            # Изменения из задачи JobQueue сами в persistence не попадают
+            if application.persistence:
+                await application.persistence.update_user_data(user_id, dict(user_data))
+
+    if dropped or cleaned:
+        logger.info(f"Очистка user_data: удалено записей {dropped}, очищено {cleaned}, "
+                    f"осталось {len(application.user_data)}")
@@ -0,0 +1,138 @@
+# webhook_server.py
+"""
+Встроенный асинхронный HTTP-приемник вебхуков Telegram (без внешних зависимостей).
+
+Работает за reverse proxy: принимает POST на WEBHOOK_PATH, проверяет заголовок
+X-Telegram-Bot-Api-Secret-Token, сразу отвечает 200 и кладет обновление
+в application.update_queue - дальше его обрабатывает Application как обычно.
+"""
+import asyncio
+import hmac
+import json
+import logging
+
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = 'x-telegram-bot-api-secret-token'
+MAX_BODY_BYTES = 1024 * 1024
+MAX_HEADERS = 100
+READ_TIMEOUT = 10
+
+RESPONSES = {
+    200: 'OK',
+    400: 'Bad Request',
+    403: 'Forbidden',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    413: 'Payload Too Large',
+}
+
+
+class WebhookServer:
+    """HTTP-сервер на asyncio.start_server, передающий обновления в очередь приложения"""
+
+    def __init__(self, application, host, port, path, secret_token, record_file=None):
+        self.application = application
+        self.host = host
+        self.port = port
+        self.path = path
+        self.secret_token = secret_token
+        self.record_file = record_file
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+        logger.info(f"Вебхук слушает http://{self.host}:{self.port}{self.path}")
+
+    async def stop(self):
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    async def handle_connection(self, reader, writer):
+        try:
+            status, update_data = await asyncio.wait_for(self.read_request(reader), READ_TIMEOUT)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, ValueError):
+            status, update_data = 400, None
+
+        # Отвечаем сразу, обработка обновления идет через очередь
+        await self.send_response(writer, status)
+
+        if update_data is not None:
+            await self.enqueue(update_data)
+
+    async def read_request(self, reader):
+        """Читает запрос; возвращает (HTTP-статус, данные обновления или None)"""
+        request_line = (await reader.readline()).decode('latin-1').strip()
+        parts = request_line.split()
+        if len(parts) != 3:
+            return 400, None
+        method, target, _ = parts
+
+        headers = {}
+        for _ in range(MAX_HEADERS):
+            line = (await reader.readline()).decode('latin-1')
+            if line in ('\r\n', '\n', ''):
+                break
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        else:
+            return 400, None
+
+        if target.split('?', 1)[0] != self.path:
+            return 404, None
+        if method != 'POST':
+            return 405, None
+
+        # Секрет проверяется до чтения тела запроса
+        received_secret = headers.get(SECRET_HEADER, '')
+        if not self.secret_token or not hmac.compare_digest(received_secret, self.secret_token):
+            return 403, None
+
+        length = int(headers.get('content-length', '0'))
+        if length <= 0:
+            return 400, None
+        if length > MAX_BODY_BYTES:
+            return 413, None
+
+        body = await reader.readexactly(length)
+        try:
+            update_data = json.loads(body)
+        except ValueError:
+            return 400, None
+
+        if self.record_file:
+            self.record(body)
+        return 200, update_data
+
+    async def send_response(self, writer, status):
+        try:
+            writer.write(
+                f"HTTP/1.1 {status} {RESPONSES[status]}\r\n"
+                f"Content-Length: 0\r\n"
+                f"Connection: close\r\n\r\n".encode('latin-1')
+            )
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def enqueue(self, update_data):
+        try:
+            update = Update.de_json(update_data, self.application.bot)
+        except Exception as e:
+            logger.error(f"Не удалось разобрать обновление: {e}")
+            return
+        await self.application.update_queue.put(update)
+
+    def record(self, body):
+        """Сохраняет сырое обновление (одна строка JSON) для последующего воспроизведения"""
+        try:
+            with open(self.record_file, 'ab') as f:
+                f.write(body.replace(b'\n', b'') + b'\n')
+        except OSError as e:
+            logger.error(f"Не удалось записать обновление в {self.record_file}: {e}")